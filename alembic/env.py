@@ -10,6 +10,7 @@ from alembic import context
 from core.models import Base
 # Importujemy URL do naszej bazy danych
 from core.db import SQLALCHEMY_DATABASE_URL
+from core.search_index import is_email_search_table
 DATABASE_URL = SQLALCHEMY_DATABASE_URL
 
 # To jest obiekt konfiguracyjny Alembic, odczytywany z pliku alembic.ini
@@ -34,6 +35,13 @@ target_metadata = Base.metadata
 # ... itp.
 
 
+def include_name(name, type_, parent_names):
+    """Indeks FTS emaili (i jego tabele pomocnicze) jest zarządzany ręcznie, poza metadanymi modeli."""
+    if type_ == "table":
+        return not is_email_search_table(name)
+    return True
+
+
 def run_migrations_offline() -> None:
     """Uruchamia migracje w trybie 'offline'.
 
@@ -45,6 +53,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_name=include_name,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -69,7 +78,7 @@ def run_migrations_online() -> None:
     with connectable.connect() as connection:
         context.configure(
             connection=connection, target_metadata=target_metadata,
-            render_as_batch=True
+            include_name=include_name, render_as_batch=True
         )
 
         with context.begin_transaction():
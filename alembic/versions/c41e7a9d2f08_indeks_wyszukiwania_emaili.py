@@ -0,0 +1,36 @@
+"""indeks wyszukiwania emaili
+
+Revision ID: c41e7a9d2f08
+Revises: a66b48596bce
+Create Date: 2026-10-17 19:20:41.118306
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from core.search_index import EMAIL_FTS_DROP, create_email_search_index
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41e7a9d2f08'
+down_revision: Union[str, Sequence[str], None] = 'a66b48596bce'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Indeks FTS5 (trigram) nad users.email wraz z wyzwalaczami synchronizującymi; tylko SQLite
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    create_email_search_index(op.get_bind())
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != "sqlite":
+        return
+    for statement in EMAIL_FTS_DROP:
+        op.execute(statement)
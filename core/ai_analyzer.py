@@ -1,25 +1,25 @@
-import google.generativeai as genai
+import asyncio
 import os
 import json
 import re
-from typing import List, Dict, Any, Optional
+from contextlib import aclosing
+from typing import AsyncIterator, List, Dict, Any, Optional
 from PIL import Image
-import io
-import base64
 from datetime import date
 from sqlalchemy.orm import Session
 from fastapi import HTTPException
 
-from . import crud, models, schemas, units
-from .db import SessionLocal
+from . import ai_scheduler, crud, image_pipeline, models, schemas, units
+from .ai_cache import response_cache, make_key, is_enabled as is_cache_enabled
+from .ai_client import AIError, get_ai_client
+from .chat_context import daily_context
+from .db import SessionLocal, run_db, run_in_session
+from .food_index import food_index, normalize_key
 from .enums import MealCategory, ProductState
 
 # --- Konfiguracja ---
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-if not GEMINI_API_KEY:
-    raise ValueError("GEMINI_API_KEY nie został ustawiony w zmiennych środowiskowych.")
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-1.5-flash-latest')
+# Backend wybierany przez AI_BACKEND; dla Gemini brak klucza API zatrzymuje start aplikacji
+ai_client = get_ai_client()
 
 # --- Funkcje Pomocnicze ---
 
@@ -30,97 +30,156 @@ def _clean_json_response(text: str) -> str:
         return match.group(1).strip()
     return text.strip()
 
-async def _get_ai_response(prompt: str, image: Optional[Image.Image] = None) -> str:
-    """Wysyła zapytanie (tekst i/lub obraz) do modelu Gemini i zwraca odpowiedź tekstową."""
+async def _get_ai_response(prompt: str, image: Optional[Image.Image] = None, call_site: str = "default", cache: bool = False) -> str:
+    """
+    Wysyła zapytanie (tekst i/lub obraz) do modelu AI i zwraca odpowiedź tekstową (pustą w razie błędu).
+    `call_site` identyfikuje miejsce wywołania (limity czasu, statystyki, odpowiedzi stuba).
+    Jeśli `cache=True` i cache jest włączony dla `call_site`, identyczne zapytania
+    są obsługiwane z cache (patrz `ai_cache`), bez ponownego wywołania modelu.
+    """
+    cache_key = None
+    if cache and is_cache_enabled(call_site):
+        cache_key = make_key(ai_client.model_name, prompt, image)
+        cached = response_cache.get_from_memory(call_site, cache_key)
+        if cached is None:
+            cached = await run_db(response_cache.get, call_site, cache_key)
+        if cached is not None:
+            print(f"DEBUG: Cache HIT (AI, {call_site}). Pomijam zapytanie do modelu.")
+            return cached
     try:
         content_to_send = [prompt, image] if image else [prompt]
-        print(f"DEBUG: Wysyłanie zapytania do Gemini. Prompt: {prompt[:100]}...")
-        response = await model.generate_content_async(content_to_send)
-        print("DEBUG: Otrzymano odpowiedź z Gemini.")
-        return response.text if response.text else ""
-    except Exception as e:
-        print(f"BŁĄD KRYTYCZNY podczas komunikacji z API Gemini: {e}")
+        print(f"DEBUG: Wysyłanie zapytania do AI ({call_site}). Prompt: {prompt[:100]}...")
+        response_text = await ai_client.generate(content_to_send, call_site=call_site)
+        print("DEBUG: Otrzymano odpowiedź z AI.")
+    except AIError as e:
+        print(f"BŁĄD KRYTYCZNY podczas komunikacji z API AI ({call_site}): {e}")
         return ""
+    # Pustych odpowiedzi (błędów) nie zapamiętujemy
+    if cache_key and response_text:
+        await run_db(response_cache.put, call_site, cache_key, response_text)
+    return response_text
 
 # --- NOWA, GŁÓWNA LOGIKA ANALIZY POSIŁKÓW ---
 
-async def analyze_meal_entry(text: Optional[str] = None, image_base64: Optional[str] = None) -> Optional[Dict[str, Any]]:
-    """Główna, wieloetapowa funkcja do analizy posiłku, działająca w logice "Cache-First"."""
-    if not text and not image_base64: return None
+async def analyze_meal_entry(text: Optional[str] = None, image_base64: Optional[str] = None, image_bytes: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+    """
+    Główna, wieloetapowa funkcja do analizy posiłku, działająca w logice "Cache-First".
+    Zdjęcie można przekazać jako base64 (JSON) lub bezpośrednio jako bajty pliku (multipart).
+    """
+    if not text and not image_base64 and not image_bytes: return None
 
-    db = SessionLocal()
     try:
-        parsed_query = await _parse_user_query(text, image_base64)
+        parsed_query = await _parse_user_query(text, image_base64, image_bytes)
         if not parsed_query or not parsed_query.get("name"): return None
 
         product_name = parsed_query["name"]
         quantity = parsed_query["quantity"]
         unit = parsed_query["unit"]
-        
-        db_dish = crud.get_dish_by_name(db, name=product_name)
-        if db_dish:
-            print(f"DEBUG: Cache HIT (Dish)! Znaleziono '{product_name}' w bazie dań.")
-            return await _calculate_nutrients_for_dish(db, db_dish, quantity, unit)
-        
-        db_product = crud.get_product_by_name(db, name=product_name)
-        if db_product:
-            print(f"DEBUG: Cache HIT (Product)! Znaleziono '{product_name}' w bazie produktów.")
-            # KLUCZOWA POPRAWKA: Przekazujemy tylko 3 argumenty, bez `db`.
-            return _calculate_nutrients_for_product(db_product, quantity, unit)
+
+        # Wyszukiwanie i obliczenia na bazie w puli wątków bazy danych, poza pętlą zdarzeń
+        found, result = await run_in_session(_calculate_known_item, product_name, quantity, unit)
+        if found:
+            return result
 
         print(f"DEBUG: Cache MISS! Uruchamiam mechanizm uczenia dla '{product_name}'.")
-        return await _learn_new_dish(db, product_name, quantity, unit)
+        return await _learn_new_dish(product_name, quantity, unit)
     except Exception as e:
         # Dodajemy szczegółowy wydruk błędu do logów serwera
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Błąd podczas analizy posiłku: {e}")
-    finally:
-        db.close()
-        """
-    Główna, wieloetapowa funkcja do analizy posiłku, działająca w logice "Cache-First".
+
+def _calculate_known_item(db: Session, name: str, quantity: float, unit: str, with_breakdown: bool = True):
+    """
+    Szuka pozycji w bazie dań i produktów i liczy jej wartości. Funkcja blokująca (wywoływać przez `run_db`).
+    Zwraca krotkę (znaleziono, wynik).
+    """
+    # Wyszukiwanie po nazwie i aliasach w indeksie w pamięci (O(1) zamiast skanu tabeli)
+    db_dish = food_index.get_dish(db, name)
+    if db_dish:
+        print(f"DEBUG: Cache HIT (Dish)! Znaleziono '{name}' w bazie dań.")
+        return True, _calculate_nutrients_for_dish(db, db_dish, quantity, unit, with_breakdown=with_breakdown)
+
+    db_product = food_index.get_product(db, name)
+    if db_product:
+        print(f"DEBUG: Cache HIT (Product)! Znaleziono '{name}' w bazie produktów.")
+        return True, _calculate_nutrients_for_product(db_product, quantity, unit)
+    return False, None
+
+async def analyze_meal_items(text: str, include_breakdown: bool = True) -> Optional[Dict[str, Any]]:
     """
-    if not text and not image_base64:
+    Analizuje cały posiłek opisany jednym tekstem, np. "2 jajka, kromka chleba, 200 ml mleka".
+    Znane pozycje są liczone z lokalnej bazy, a wszystkie nieznane trafiają do AI jednym zapytaniem.
+    """
+    queries = [{**_parse_text_query(part), "query": part} for part in _split_meal_text(text)]
+    queries = [query for query in queries if query.get("name")]
+    if not queries:
         return None
 
-    db = SessionLocal()
-    try:
-        # KROK 1: Inteligentne parsowanie zapytania
-        parsed_query = await _parse_user_query(text, image_base64)
-        if not parsed_query or not parsed_query.get("name"):
-            return None
-
-        product_name = parsed_query["name"]
-        quantity = parsed_query["quantity"]
-        unit = parsed_query["unit"]
-
-        # KROK 2: Wyszukiwanie w lokalnej bazie (Cache-First)
-        # Najpierw szukamy dania złożonego
-        db_dish = crud.get_dish_by_name(db, name=product_name)
-        if db_dish:
-            print(f"DEBUG: Cache HIT (Dish)! Znaleziono '{product_name}' w bazie dań.")
-            return await _calculate_nutrients_for_dish(db, db_dish, quantity, unit)
-        
-        # Jeśli nie ma dania, szukamy produktu podstawowego
-        db_product = crud.get_product_by_name(db, name=product_name)
-        if db_product:
-            print(f"DEBUG: Cache HIT (Product)! Znaleziono '{product_name}' w bazie produktów.")
-            return _calculate_nutrients_for_product(db_product, quantity, unit)
-
-        # KROK 3: Jeśli nie ma w cache (Cache Miss) - uruchom mechanizm "uczenia się"
-        print(f"DEBUG: Cache MISS! Uruchamiam mechanizm uczenia dla '{product_name}'.")
-        return await _learn_new_dish(db, product_name, quantity, unit)
-
-    finally:
-        db.close()
+    unknown: Dict[str, List[int]] = {}
+    known_flags = await run_in_session(_are_known_items, [query["name"] for query in queries])
+    for index, query in enumerate(queries):
+        if not known_flags[index]:
+            unknown.setdefault(normalize_key(query["name"]), []).append(index)
+
+    # Uczenie nieznanych pozycji startuje od razu, równolegle z liczeniem znanych
+    learning = asyncio.create_task(_learn_new_dishes([queries[indexes[0]]["name"] for indexes in unknown.values()])) if unknown else None
+    known = [index for index in range(len(queries)) if normalize_key(queries[index]["name"]) not in unknown]
+    print(f"DEBUG: Analiza zbiorcza: {len(known)} pozycji z cache, {len(unknown)} do nauczenia.")
+
+    results, errors = await run_in_session(_calculate_known_items, queries, known, include_breakdown)
+
+    if learning:
+        learned = await learning
+        for key, indexes in unknown.items():
+            for index in indexes:
+                if not learned.get(key):
+                    continue
+                try:
+                    results[index] = _scale_learned_dish(learned[key], queries[index]["quantity"], queries[index]["unit"])
+                except ValueError as e:
+                    errors[index] = str(e)
+
+    items = []
+    totals = {"quantity_grams": 0.0, "calories": 0.0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
+    for index, query in enumerate(queries):
+        result = results[index]
+        item = {"query": query["query"], "aggregated_meal": None, "deconstruction_details": [], "error": None}
+        if result:
+            item.update(result)
+            for key in totals:
+                totals[key] += result["aggregated_meal"].get(key, 0) or 0
+        else:
+            item["error"] = errors.get(index, "AI nie mogło przeanalizować tego produktu.")
+        items.append(item)
+
+    totals = {key: round(value) if key in ("quantity_grams", "calories") else round(value, 1) for key, value in totals.items()}
+    return {"items": items, "totals": totals}
+
+def _are_known_items(db: Session, names: List[str]) -> List[bool]:
+    """Sprawdza w indeksie, które pozycje są już znane (jako danie lub produkt)."""
+    return [food_index.find_dish_id(db, name) is not None or food_index.find_product_id(db, name) is not None for name in names]
+
+def _calculate_known_items(db: Session, queries: List[Dict[str, Any]], indexes: List[int], with_breakdown: bool):
+    """Liczy wartości znanych pozycji posiłku w jednej sesji. Zwraca (wyniki wg indeksu, błędy wg indeksu)."""
+    results: List[Optional[Dict[str, Any]]] = [None] * len(queries)
+    errors: Dict[int, str] = {}
+    for index in indexes:
+        query = queries[index]
+        try:
+            _, results[index] = _calculate_known_item(db, query["name"], query["quantity"], query["unit"], with_breakdown=with_breakdown)
+        except ValueError as e:
+            errors[index] = str(e)
+    return results, errors
 
-async def _parse_user_query(text: Optional[str], image_base64: Optional[str]) -> Dict[str, Any]:
+async def _parse_user_query(text: Optional[str], image_base64: Optional[str], image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
     """Przetwarza zapytanie użytkownika (tekst lub obraz) na ustrukturyzowane dane."""
     quantity = 1.0
     unit = "szt."
     product_name = text.strip() if text else ""
 
-    if image_base64:
+    has_image = bool(image_base64 or image_bytes)
+    if has_image:
         image_prompt = """
         Przeanalizuj to zdjęcie. Odpowiedz TYLKO w formacie JSON z kluczami: "name" (nazwa potrawy), "quantity" (oszacowana waga lub objętość) i "unit" (jednostka, "g" dla ciał stałych lub "ml" dla płynów).
 
@@ -128,11 +187,24 @@ async def _parse_user_query(text: Optional[str], image_base64: Optional[str]) ->
         Przykład dla płynu: {"name": "Zupa pomidorowa", "quantity": 300, "unit": "ml"}
         """
         try:
-            image_data = base64.b64decode(image_base64.split(',')[1])
-            image = Image.open(io.BytesIO(image_data))
-            response_text = await _get_ai_response(image_prompt, image)
-            parsed_image = json.loads(_clean_json_response(response_text))
-            
+            # Dekodowanie i zmniejszenie zdjęcia w wątku roboczym, poza pętlą zdarzeń
+            if image_bytes:
+                prepared = await image_pipeline.preprocess_image(image_bytes)
+            else:
+                prepared = await image_pipeline.preprocess_base64(image_base64)
+            parsed_image = image_pipeline.parsed_image_cache.find(prepared.phash)
+            if parsed_image is not None:
+                print(f"DEBUG: Cache HIT (zdjęcie)! Rozpoznano wcześniej: '{parsed_image.get('name')}'.")
+            else:
+                response_text = await _get_ai_response(image_prompt, prepared.image, call_site="parse_image")
+                parsed_image = json.loads(_clean_json_response(response_text))
+                if parsed_image.get("name"):
+                    image_pipeline.parsed_image_cache.add(prepared.phash, {
+                        "name": parsed_image["name"],
+                        "quantity": parsed_image.get("quantity", 100.0),
+                        "unit": parsed_image.get("unit", "g"),
+                    })
+
             product_name = parsed_image.get("name", "Produkt ze zdjęcia")
             quantity = parsed_image.get("quantity", 100.0)
             unit = parsed_image.get("unit", "g")
@@ -149,23 +221,52 @@ async def _parse_user_query(text: Optional[str], image_base64: Optional[str]) ->
         return {}
     
     # Dalsze parsowanie tekstu (jeśli nie było obrazu lub był podany tekst)
-    if not image_base64 or text:
-        match = re.match(r"^\s*(\d+[\.,]?\d*)\s*([a-zA-ZżźćńółęąśŻŹĆŃÓŁĘĄŚ\.]+)\s*(.*)", product_name)
-        if match:
-            try:
-                quantity = float(match.group(1).replace(',', '.'))
-                unit = match.group(2)
-                product_name = match.group(3).strip() if match.group(3) else unit
-            except (ValueError, IndexError):
-                pass
+    if not has_image or text:
+        return _parse_text_query(product_name, quantity, unit)
     
     normalized_name = units.normalize_name(product_name)
     return {"quantity": quantity, "unit": unit, "name": normalized_name, "original_text": product_name}
 
-async def _calculate_nutrients_for_dish(db: Session, dish: models.Dish, quantity: float, unit: str):
-    """Oblicza wartości odżywcze dla istniejącego dania na podstawie jego przepisu."""
-    base_recipe_weight = sum(ing.weight_g for ing in dish.ingredients if ing.weight_g is not None)
-    if base_recipe_weight == 0:
+_QUANTITY_PATTERN = re.compile(r"^\s*(\d+[\.,]?\d*)\s*([a-zA-ZżźćńółęąśŻŹĆŃÓŁĘĄŚ\.]+)\s*(.*)")
+# Separatory pozycji w opisie posiłku. Przecinek między cyframi ("1,5 szklanki") nie rozdziela pozycji.
+_ITEM_SEPARATORS = re.compile(r"(?<!\d),|,(?!\d)|[;\n+]|\s+(?:oraz|plus)\s+", re.IGNORECASE)
+
+def _parse_text_query(text: str, quantity: float = 1.0, unit: str = "szt.") -> Dict[str, Any]:
+    """Wyodrębnia ilość, jednostkę i nazwę z opisu jednej pozycji (np. "200 ml mleka", "kromka chleba")."""
+    product_name = text.strip()
+    match = _QUANTITY_PATTERN.match(product_name)
+    if match:
+        try:
+            quantity = float(match.group(1).replace(',', '.'))
+            unit = match.group(2)
+            product_name = match.group(3).strip() if match.group(3) else unit
+        except (ValueError, IndexError):
+            pass
+    else:
+        # Jednostka bez liczby, np. "kromka chleba" oznacza jedną kromkę
+        first_word, _, rest = product_name.partition(" ")
+        if rest.strip() and first_word.lower() in units.KNOWN_UNITS:
+            quantity, unit, product_name = 1.0, first_word, rest.strip()
+
+    normalized_name = units.normalize_name(product_name)
+    return {"quantity": quantity, "unit": unit, "name": normalized_name, "original_text": product_name}
+
+def _split_meal_text(text: str) -> List[str]:
+    """Dzieli opis całego posiłku na pojedyncze pozycje."""
+    return [part.strip() for part in _ITEM_SEPARATORS.split(text or "") if part and part.strip()]
+
+def _calculate_nutrients_for_dish(db: Session, dish: models.Dish, quantity: float, unit: str, with_breakdown: bool = True):
+    """
+    Oblicza wartości odżywcze dla istniejącego dania na podstawie zmaterializowanych sum przepisu.
+    Składniki (dekonstrukcja) są wczytywane tylko, gdy są potrzebne.
+    """
+    if dish.base_weight_g is None:
+        # Danie zapisane przed materializacją sum - przeliczamy i zapisujemy je raz
+        crud.refresh_dish_totals(db, dish)
+        db.commit()
+
+    base_recipe_weight = dish.base_weight_g or 0
+    if base_recipe_weight == 0 or not dish.nutrients_per_100g:
         return None
 
     user_portion_grams = 0
@@ -174,38 +275,17 @@ async def _calculate_nutrients_for_dish(db: Session, dish: models.Dish, quantity
     if unit_lower in ["szt", "szt.", "sztuka", "sztuki"] or unit_lower == dish.name.lower():
         user_portion_grams = base_recipe_weight * quantity
     else:
-        liquid_weight = sum(ing.weight_g for ing in dish.ingredients if ing.product and ing.product.state == ProductState.LIQUID)
-        dish_state = ProductState.LIQUID if (liquid_weight / base_recipe_weight) > 0.5 else ProductState.SOLID
-        user_portion_grams, _ = units.standardize_unit(quantity, unit, dish_state)
+        user_portion_grams, _ = units.standardize_unit(quantity, unit, dish.state or ProductState.SOLID)
 
     scaling_factor = user_portion_grams / base_recipe_weight if base_recipe_weight > 0 else 0
-
-    total_nutrients = {"calories": 0.0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
-    deconstruction_details = []
-
-    for ingredient in dish.ingredients:
-        if ingredient.product and ingredient.product.nutrients:
-            # Obliczanie sumy nutrientów dla całego dania
-            factor_for_total = ingredient.weight_g / 100.0
-            total_nutrients["calories"] += ingredient.product.nutrients.get("calories", 0) * factor_for_total
-            total_nutrients["protein"] += ingredient.product.nutrients.get("protein", 0) * factor_for_total
-            total_nutrients["fat"] += ingredient.product.nutrients.get("fat", 0) * factor_for_total
-            total_nutrients["carbs"] += ingredient.product.nutrients.get("carbs", 0) * factor_for_total
-            
-            # Tworzenie dekonstrukcji dla frontendu (już przeskalowanej)
-            scaled_weight = ingredient.weight_g * scaling_factor
-            deconstruction_details.append({
-                "name": ingredient.product.name,
-                "quantity_grams": scaled_weight, # Zapisz dokładną wagę
-                "nutrients_per_100g": ingredient.product.nutrients
-            })
+    portion_factor = user_portion_grams / 100.0
 
     # --- KLUCZOWA POPRAWKA W ZAOKRĄGLANIU ---
     final_nutrients = {
-        "calories": round(total_nutrients["calories"] * scaling_factor),
-        "protein": round(total_nutrients["protein"] * scaling_factor, 1),
-        "fat": round(total_nutrients["fat"] * scaling_factor, 1),
-        "carbs": round(total_nutrients["carbs"] * scaling_factor, 1)
+        "calories": round(dish.nutrients_per_100g.get("calories", 0) * portion_factor),
+        "protein": round(dish.nutrients_per_100g.get("protein", 0) * portion_factor, 1),
+        "fat": round(dish.nutrients_per_100g.get("fat", 0) * portion_factor, 1),
+        "carbs": round(dish.nutrients_per_100g.get("carbs", 0) * portion_factor, 1)
     }
 
     aggregated_meal = {
@@ -214,21 +294,49 @@ async def _calculate_nutrients_for_dish(db: Session, dish: models.Dish, quantity
         "display_quantity_text": f"{quantity} {unit}",
         **final_nutrients
     }
-    
-    # Uzupełnij dekonstrukcję o obliczone, przeskalowane wartości
-    for detail in deconstruction_details:
-        factor = detail["quantity_grams"] / 100.0
-        nutrients = detail["nutrients_per_100g"]
-        detail["calories"] = round(nutrients.get("calories", 0) * factor)
-        detail["protein"] = round(nutrients.get("protein", 0) * factor, 1)
-        detail["fat"] = round(nutrients.get("fat", 0) * factor, 1)
-        detail["carbs"] = round(nutrients.get("carbs", 0) * factor, 1)
-        detail["quantity_grams"] = round(detail["quantity_grams"])
 
+    deconstruction_details = []
+    if with_breakdown:
+        # Tworzenie dekonstrukcji dla frontendu (już przeskalowanej) - jedno zapytanie ze składnikami i produktami
+        deconstruction_details = _scale_recipe(_dish_recipe(db, dish), scaling_factor)
 
     return {"aggregated_meal": aggregated_meal, "deconstruction_details": deconstruction_details}
 
 
+def _dish_recipe(db: Session, dish: models.Dish) -> List[Dict[str, Any]]:
+    """Zwraca składniki przepisu (ID i nazwa produktu, waga w przepisie, wartości per 100g) jako zwykłe dane."""
+    return [
+        {
+            "product_id": ingredient.product.id,
+            "name": ingredient.product.name,
+            "weight_g": ingredient.weight_g,
+            "nutrients_per_100g": dict(ingredient.product.nutrients),
+        }
+        for ingredient in crud.get_dish_ingredients(db, dish.id)
+        if ingredient.product and ingredient.product.nutrients and ingredient.weight_g is not None
+    ]
+
+
+def _scale_recipe(recipe: List[Dict[str, Any]], scaling_factor: float) -> List[Dict[str, Any]]:
+    """Dekonstrukcja przeskalowana do porcji użytkownika - każdy składnik ze stałym `product_id`."""
+    deconstruction_details = []
+    for ingredient in recipe:
+        scaled_weight = ingredient["weight_g"] * scaling_factor
+        factor = scaled_weight / 100.0
+        nutrients = ingredient["nutrients_per_100g"]
+        deconstruction_details.append({
+            "product_id": ingredient["product_id"],
+            "name": ingredient["name"],
+            "quantity_grams": round(scaled_weight),
+            "nutrients_per_100g": nutrients,
+            "calories": round(nutrients.get("calories", 0) * factor),
+            "protein": round(nutrients.get("protein", 0) * factor, 1),
+            "fat": round(nutrients.get("fat", 0) * factor, 1),
+            "carbs": round(nutrients.get("carbs", 0) * factor, 1)
+        })
+    return deconstruction_details
+
+
 def _calculate_nutrients_for_product(product: models.Product, quantity: float, unit: str):
     """Oblicza wartości dla produktu podstawowego na podstawie porcji użytkownika."""
     # POPRAWKA: Usunięto błędny, czwarty argument `db` z wywołania funkcji
@@ -251,11 +359,89 @@ def _calculate_nutrients_for_product(product: models.Product, quantity: float, u
     return {"aggregated_meal": aggregated_meal, "deconstruction_details": []}
 
 
-async def _learn_new_dish(db: Session, dish_name: str, quantity: float, unit: str) -> Optional[Dict[str, Any]]:
+# --- UCZENIE SIĘ NOWYCH DAŃ (single-flight) ---
+
+# Trwające procesy uczenia, kluczowane znormalizowaną nazwą dania.
+# Równoległe zapytania o to samo nieznane danie czekają na jedno wspólne zadanie.
+_learning_in_flight: Dict[str, asyncio.Task] = {}
+
+async def _learn_new_dish(dish_name: str, quantity: float, unit: str) -> Optional[Dict[str, Any]]:
+    """
+    Uruchamia (lub dołącza do trwającego) procesu uczenia się nowego dania
+    i zwraca wynik przeskalowany do porcji użytkownika.
+    """
+    key = normalize_key(dish_name)
+    task = _learning_in_flight.get(key)
+    if task is None:
+        # Uczenie działa we własnym zadaniu i sesji, więc przerwanie zapytania,
+        # które je rozpoczęło, nie przerywa go pozostałym oczekującym.
+        task = _register_learning(key, _learn_dish_task(dish_name))
+    else:
+        print(f"DEBUG: Uczenie '{dish_name}' już trwa. Dołączam do oczekujących.")
+
+    learned = await asyncio.shield(task)
+    if not learned:
+        return None
+    return _scale_learned_dish(learned, quantity, unit)
+
+async def _learn_new_dishes(dish_names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Uczy się wielu nieznanych dań naraz (jedno zbiorcze zapytanie do AI).
+    Dania, których uczenie już trwa, dołączają do istniejących zadań.
+    Zwraca słownik: znormalizowana nazwa -> dane bazowe nauczonego dania (lub None).
+    """
+    tasks: Dict[str, asyncio.Task] = {}
+    to_learn: Dict[str, str] = {}
+    for dish_name in dish_names:
+        key = normalize_key(dish_name)
+        if key in _learning_in_flight:
+            tasks[key] = _learning_in_flight[key]
+        elif key not in to_learn:
+            to_learn[key] = dish_name
+
+    if len(to_learn) == 1:
+        (key, dish_name), = to_learn.items()
+        tasks[key] = _register_learning(key, _learn_dish_task(dish_name))
+    elif to_learn:
+        batch = asyncio.create_task(_learn_dishes_batch_task(list(to_learn.values())))
+        for key in to_learn:
+            tasks[key] = _register_learning(key, _pick_learned(batch, key))
+
+    results = await asyncio.gather(*(asyncio.shield(task) for task in tasks.values()), return_exceptions=True)
+    return {key: None if isinstance(result, BaseException) else result for key, result in zip(tasks, results)}
+
+def _register_learning(key: str, coro) -> asyncio.Task:
+    """Uruchamia zadanie uczenia i rejestruje je jako trwające dla danego klucza."""
+    task = asyncio.create_task(coro)
+    _learning_in_flight[key] = task
+    task.add_done_callback(lambda t: _finish_learning(key, t))
+    return task
+
+def _finish_learning(key: str, task: asyncio.Task):
+    """Usuwa zakończone zadanie z rejestru i odbiera ewentualny wyjątek."""
+    if _learning_in_flight.get(key) is task:
+        del _learning_in_flight[key]
+    if not task.cancelled() and task.exception():
+        print(f"BŁĄD: Uczenie dania '{key}' zakończyło się wyjątkiem: {task.exception()}")
+
+async def _pick_learned(batch: asyncio.Task, key: str) -> Optional[Dict[str, Any]]:
+    """Wyciąga wynik jednego dania z zadania uczenia zbiorczego."""
+    return (await asyncio.shield(batch)).get(key)
+
+async def _learn_dish_task(dish_name: str) -> Optional[Dict[str, Any]]:
+    """Wykonuje uczenie we własnej sesji bazy danych (zadanie współdzielone)."""
+    db = SessionLocal()
+    try:
+        return await _learn_dish_data(db, dish_name)
+    finally:
+        db.close()
+
+async def _learn_dish_data(db: Session, dish_name: str) -> Optional[Dict[str, Any]]:
     """
     Uruchamia proces uczenia się nowego dania.
     NOWA LOGIKA: Najpierw prosi o zagregowane dane. Jeśli AI uzna, że to danie złożone,
     dopiero wtedy prosi o dekonstrukcję.
+    Zwraca dane bazowe (per 100g) zapisanego produktu, niezależne od porcji użytkownika.
     """
     # Krok 1: Poproś AI o dane zagregowane i o informację, czy to danie złożone.
     first_pass_prompt = f"""
@@ -263,7 +449,7 @@ async def _learn_new_dish(db: Session, dish_name: str, quantity: float, unit: st
     Odpowiedz ZAWSZE w formacie JSON z kluczami: "is_complex" (boolean: true, jeśli to danie wieloskładnikowe; false, jeśli to produkt prosty),
     "name" (poprawna nazwa), "base_quantity_g" (typowa waga w gramach dla całej porcji, np. dla przepisu), "nutrients_per_100g" (obiekt z "calories", "protein", "fat", "carbs" dla 100g produktu).
     """
-    response_text = await _get_ai_response(first_pass_prompt)
+    response_text = await _get_ai_response(first_pass_prompt, call_site="learn_dish", cache=True)
     try:
         parsed = json.loads(_clean_json_response(response_text))
         if not all(k in parsed for k in ["name", "nutrients_per_100g", "is_complex"]):
@@ -271,54 +457,144 @@ async def _learn_new_dish(db: Session, dish_name: str, quantity: float, unit: st
     except (json.JSONDecodeError, TypeError):
         return None
 
-    is_complex_dish = parsed.get("is_complex", False)
     deconstruction_details = []
-    nutrients_data = parsed.get("nutrients_per_100g", {})
 
     # Krok 2: Jeśli AI oznaczyło to jako danie złożone, poproś o dekonstrukcję.
-    if is_complex_dish:
+    if parsed.get("is_complex", False):
         base_weight = parsed.get("base_quantity_g", 100)
         decon_prompt = f"""
         Podaj przepis dla potrawy "{parsed['name']}" jako listę składników i ich wag w gramach dla porcji {base_weight}g.
         Odpowiedz TYLKO w formacie tablicy JSON `[]` z obiektami o kluczach "ingredient_name" i "weight_g".
         """
-        decon_response_text = await _get_ai_response(decon_prompt)
+        decon_response_text = await _get_ai_response(decon_prompt, call_site="learn_dish_recipe", cache=True)
         try:
             deconstruction_details = json.loads(_clean_json_response(decon_response_text))
-            # Sprawdź i doucz się brakujących składników
-            for ingredient in deconstruction_details:
-                product_name = ingredient.get("ingredient_name")
-                if product_name and not crud.get_product_by_name(db, name=product_name):
-                    await _learn_new_product(db, product_name) # Douczanie się składników
-        except (json.JSONDecodeError, TypeError):
+            # Zbierz wszystkie brakujące składniki i doucz się ich jednym zapytaniem
+            await _learn_missing_ingredients(db, deconstruction_details)
+        except (json.JSONDecodeError, TypeError, AttributeError):
             deconstruction_details = [] # W razie błędu, zapisz bez dekonstrukcji
 
     # Krok 3: Zapisz nowe danie/produkt w bazie.
-    product_state = schemas.ProductState.LIQUID if "zupa" in parsed['name'].lower() else schemas.ProductState.SOLID
-    
+    return await run_db(_store_learned_dish, db, dish_name, parsed, deconstruction_details)
+
+async def _learn_dishes_batch_task(dish_names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Uczy się wielu dań jednym zapytaniem do AI (dane zagregowane i przepisy naraz).
+    Dania pominięte w odpowiedzi są douczane pojedynczo, równolegle.
+    """
+    names_list = "\n".join(f"- {name}" for name in dish_names)
+    batch_prompt = f"""
+    Jesteś dietetykiem. Przeanalizuj każdy z produktów:
+    {names_list}
+    Odpowiedz ZAWSZE i TYLKO w formacie tablicy JSON `[]`, jeden obiekt na produkt, z kluczami:
+    "query" (nazwa dokładnie tak, jak podano ją na liście), "is_complex" (boolean: true, jeśli to danie wieloskładnikowe; false, jeśli to produkt prosty),
+    "name" (poprawna nazwa), "state" ("solid" lub "liquid"), "base_quantity_g" (typowa waga w gramach dla całej porcji, np. dla przepisu), "nutrients_per_100g" (obiekt z "calories", "protein", "fat", "carbs" dla 100g produktu),
+    "ingredients" (tylko dla dań złożonych: tablica obiektów z kluczami "ingredient_name" i "weight_g" dla porcji base_quantity_g; dla produktów prostych pusta tablica).
+    """
+    requested = {normalize_key(name): name for name in dish_names}
+    parsed_by_key: Dict[str, Dict[str, Any]] = {}
+    response_text = await _get_ai_response(batch_prompt, call_site="learn_dishes_batch", cache=True)
+    try:
+        for parsed in json.loads(_clean_json_response(response_text)):
+            key = normalize_key(parsed.get("query"))
+            if key in requested and all(k in parsed for k in ["name", "nutrients_per_100g", "is_complex"]):
+                parsed_by_key.setdefault(key, parsed)
+    except (json.JSONDecodeError, TypeError, AttributeError) as e:
+        print(f"BŁĄD: Nieprawidłowa zbiorcza odpowiedź AI dla dań {dish_names}. {e}")
+
+    learned: Dict[str, Optional[Dict[str, Any]]] = {}
+    db = SessionLocal()
+    try:
+        recipes = {}
+        for key, parsed in parsed_by_key.items():
+            ingredients = parsed.get("ingredients") if parsed.get("is_complex") else []
+            if not isinstance(ingredients, list) or not all(isinstance(ing, dict) for ing in ingredients):
+                ingredients = []
+            recipes[key] = ingredients
+        # Brakujące składniki wszystkich dań - jedno wspólne douczanie
+        await _learn_missing_ingredients(db, [ing for ingredients in recipes.values() for ing in ingredients])
+        for key, parsed in parsed_by_key.items():
+            learned[key] = await run_db(_store_learned_dish, db, requested[key], parsed, recipes[key])
+    finally:
+        db.close()
+
+    missing = [key for key in requested if key not in learned]
+    if missing:
+        print(f"DEBUG: Zbiorcza odpowiedź AI pominęła {len(missing)} pozycji. Douczam je pojedynczo.")
+        results = await asyncio.gather(*(_learn_dish_task(requested[key]) for key in missing), return_exceptions=True)
+        for key, result in zip(missing, results):
+            learned[key] = None if isinstance(result, BaseException) else result
+    return learned
+
+async def _learn_missing_ingredients(db: Session, ingredients: List[Dict[str, Any]]):
+    """Zbiera składniki nieobecne w bazie i douczanie się ich jednym zapytaniem."""
+    names = [ingredient.get("ingredient_name") for ingredient in ingredients if ingredient.get("ingredient_name")]
+    # Pierwsze użycie indeksu może wczytywać go z bazy
+    await run_db(food_index.ensure_loaded, db)
+    missing_products = {}
+    for product_name in names:
+        if not food_index.find_product_id(db, product_name):
+            missing_products.setdefault(normalize_key(product_name), product_name)
+    if missing_products:
+        await _learn_new_products(db, list(missing_products.values()))
+
+def _store_learned_dish(db: Session, dish_name: str, parsed: Dict[str, Any], deconstruction_details: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Zapisuje nauczone danie/produkt (upsert) i zwraca jego dane bazowe.
+    Przepis zwracany jest z zapisanych składników (z `product_id`), tak jak dla dań znanych z bazy.
+    """
+    is_complex_dish = parsed.get("is_complex", False)
+    nutrients_data = parsed.get("nutrients_per_100g", {})
+    if parsed.get("state") in (schemas.ProductState.SOLID.value, schemas.ProductState.LIQUID.value):
+        product_state = schemas.ProductState(parsed["state"])
+    else:
+        product_state = schemas.ProductState.LIQUID if "zupa" in parsed['name'].lower() else schemas.ProductState.SOLID
+    # Nazwa z zapytania trafia do aliasów, aby kolejne zapytania trafiały w cache
+    aliases = [dish_name] if normalize_key(dish_name) != normalize_key(parsed['name']) else []
+
     # Zapisujemy produkt, który przechowuje wartości odżywcze per 100g
     product_schema = schemas.ProductCreate(
         name=parsed['name'],
+        aliases=aliases,
         nutrients=nutrients_data,
         state=product_state,
         average_weight_g=parsed.get("base_quantity_g") if not is_complex_dish else 0
     )
-    new_db_product = crud.create_product(db, product=product_schema)
+    new_db_product = crud.upsert_product(db, product=product_schema)
 
+    recipe, recipe_weight_g = [], 0
     if is_complex_dish and deconstruction_details:
         # Jeśli to danie złożone, zapisz przepis w tabeli Dishes
         dish_schema = schemas.DishCreate(
             name=parsed['name'],
-            aliases=[parsed['name']],
-            ingredients=[schemas.DishIngredientCreate(product_name=ing["ingredient_name"], weight_g=ing["weight_g"]) for ing in deconstruction_details]
+            aliases=[parsed['name'], *aliases],
+            ingredients=[
+                schemas.DishIngredientCreate(product_name=ing["ingredient_name"], weight_g=ing["weight_g"])
+                for ing in deconstruction_details if ing.get("ingredient_name") and ing.get("weight_g") is not None
+            ]
         )
-        # Powiąż nowo utworzony produkt z daniem
-        crud.create_dish_with_ingredients(db, dish=dish_schema, base_product_id=new_db_product.id)
-
+        db_dish = crud.upsert_dish_with_ingredients(db, dish=dish_schema)
+        if db_dish.base_weight_g is None:
+            crud.refresh_dish_totals(db, db_dish)
+            db.commit()
+        recipe, recipe_weight_g = _dish_recipe(db, db_dish), db_dish.base_weight_g or 0
+
+    # Zwracamy dane zapisanego rekordu - przy konflikcie wygrywa istniejący produkt,
+    # więc wszyscy oczekujący dostają ten sam wynik.
+    return {
+        "name": new_db_product.name,
+        "nutrients_per_100g": dict(new_db_product.nutrients or {}),
+        "state": new_db_product.state,
+        "average_weight_g": new_db_product.average_weight_g,
+        "recipe": recipe,
+        "recipe_weight_g": recipe_weight_g,
+    }
 
-    # Krok 4: Zwróć wynik przeskalowany do porcji użytkownika.
-    final_quantity_grams, _ = units.standardize_unit(quantity, unit, new_db_product.state, new_db_product.average_weight_g)
+def _scale_learned_dish(learned: Dict[str, Any], quantity: float, unit: str) -> Dict[str, Any]:
+    """Zwraca wynik nauczonego dania przeskalowany do porcji użytkownika."""
+    final_quantity_grams, _ = units.standardize_unit(quantity, unit, learned["state"], learned["average_weight_g"])
     factor = final_quantity_grams / 100.0
+    nutrients_data = learned["nutrients_per_100g"]
 
     final_nutrients = {
         "calories": round(nutrients_data.get("calories", 0) * factor),
@@ -328,16 +604,82 @@ async def _learn_new_dish(db: Session, dish_name: str, quantity: float, unit: st
     }
 
     aggregated_meal = {
-        "name": f"{parsed['name']}",
+        "name": f"{learned['name']}",
         "quantity_grams": round(final_quantity_grams),
         "display_quantity_text": f"{quantity} {unit}",
         **final_nutrients
     }
-    return {"aggregated_meal": aggregated_meal, "deconstruction_details": deconstruction_details}
+    scaling_factor = final_quantity_grams / learned["recipe_weight_g"] if learned["recipe_weight_g"] > 0 else 0
+    return {"aggregated_meal": aggregated_meal, "deconstruction_details": _scale_recipe(learned["recipe"], scaling_factor)}
+
 
+# Limit równoległych zapytań przy douczaniu składników pojedynczo
+INGREDIENT_LEARNING_CONCURRENCY = int(os.getenv("INGREDIENT_LEARNING_CONCURRENCY", "4"))
+
+async def _learn_new_products(db: Session, product_names: List[str]):
+    """
+    Douczanie się wielu produktów naraz: jedno zbiorcze zapytanie do AI,
+    a dla pozycji pominiętych w odpowiedzi - zapytania równoległe z limitem.
+    Wszystkie produkty są zapisywane w jednej transakcji.
+    """
+    learned = await _fetch_products_data(product_names)
+    missing = [name for name in product_names if name not in learned]
+    if missing:
+        semaphore = asyncio.Semaphore(INGREDIENT_LEARNING_CONCURRENCY)
+
+        async def fetch_one(name: str):
+            async with semaphore:
+                return name, await _fetch_product_data(name)
+
+        for name, product_schema in await asyncio.gather(*(fetch_one(name) for name in missing)):
+            if product_schema:
+                learned[name] = product_schema
+
+    if learned:
+        await run_db(crud.upsert_products, db, list(learned.values()))
+        print(f"DEBUG: Cache WRITE! Nauczono się {len(learned)} nowych produktów: {', '.join(learned)}.")
+    for name in product_names:
+        if name not in learned:
+            print(f"BŁĄD: Nie udało się nauczyć nowego produktu '{name}'.")
+
+def _product_schema_from_ai(data: Dict[str, Any], product_name: str) -> schemas.ProductCreate:
+    """Buduje schemat produktu z odpowiedzi AI; nazwa z zapytania trafia do aliasów."""
+    name = data.get("name") or product_name
+    return schemas.ProductCreate(
+        name=name,
+        aliases=[product_name] if normalize_key(name) != normalize_key(product_name) else [],
+        nutrients=data.get("nutrients", {}),
+        state=data.get("state", "solid"),
+        average_weight_g=data.get("average_weight_g", 0)
+    )
 
-async def _learn_new_product(db: Session, product_name: str):
-    """Pyta AI o dane dla nowego produktu podstawowego i zapisuje go w bazie."""
+async def _fetch_products_data(product_names: List[str]) -> Dict[str, schemas.ProductCreate]:
+    """Pyta AI o dane wielu produktów w jednym zapytaniu. Zwraca słownik: nazwa z zapytania -> schemat."""
+    names_list = "\n".join(f"- {name}" for name in product_names)
+    products_prompt = f"""
+    Jesteś encyklopedią żywienia. Podaj kompletne dane dla każdego z produktów:
+    {names_list}
+    Odpowiedz ZAWSZE i TYLKO w formacie tablicy JSON `[]`, jeden obiekt na produkt, z kluczami:
+    - "query": nazwa produktu dokładnie tak, jak podano ją na liście.
+    - "name": poprawna, ujednolicona nazwa produktu.
+    - "state": "solid" lub "liquid",
+    - "average_weight_g": typowa waga jednej sztuki w gramach (lub 0, jeśli produkt nie jest sprzedawany na sztuki),
+    - "nutrients": obiekt z kluczami "calories", "protein", "fat", "carbs" dla 100g lub 100ml.
+    """
+    response_text = await _get_ai_response(products_prompt, call_site="learn_products_batch", cache=True)
+    requested = {normalize_key(name): name for name in product_names}
+    learned: Dict[str, schemas.ProductCreate] = {}
+    try:
+        for data in json.loads(_clean_json_response(response_text)):
+            product_name = requested.get(normalize_key(data.get("query")))
+            if product_name and product_name not in learned:
+                learned[product_name] = _product_schema_from_ai(data, product_name)
+    except (json.JSONDecodeError, TypeError, AttributeError, ValueError) as e:
+        print(f"BŁĄD: Nieprawidłowa zbiorcza odpowiedź AI dla produktów {product_names}. {e}")
+    return learned
+
+async def _fetch_product_data(product_name: str) -> Optional[schemas.ProductCreate]:
+    """Pyta AI o dane dla nowego produktu podstawowego (bez zapisu w bazie)."""
     product_prompt = f"""
     Jesteś encyklopedią żywienia. Podaj kompletne dane dla produktu: '{product_name}'.
     Odpowiedz ZAWSZE i TYLKO w formacie JSON z kluczami:
@@ -346,38 +688,110 @@ async def _learn_new_product(db: Session, product_name: str):
     - "average_weight_g": typowa waga jednej sztuki w gramach (lub 0, jeśli produkt nie jest sprzedawany na sztuki),
     - "nutrients": obiekt z kluczami "calories", "protein", "fat", "carbs" dla 100g lub 100ml.
     """
-    response_text = await _get_ai_response(product_prompt)
+    response_text = await _get_ai_response(product_prompt, call_site="learn_product", cache=True)
     try:
-        data = json.loads(_clean_json_response(response_text))
-        product_schema = schemas.ProductCreate(
-            name=data.get("name", product_name),
-            nutrients=data.get("nutrients", {}),
-            state=data.get("state", "solid"),
-            average_weight_g=data.get("average_weight_g", 0)
-        )
-        crud.create_product(db, product=product_schema)
-        print(f"DEBUG: Cache WRITE! Nauczono się nowego produktu: '{data.get('name', product_name)}'.")
-    except (json.JSONDecodeError, TypeError) as e:
+        return _product_schema_from_ai(json.loads(_clean_json_response(response_text)), product_name)
+    except (json.JSONDecodeError, TypeError, AttributeError, ValueError) as e:
         print(f"BŁĄD: Nie udało się nauczyć nowego produktu '{product_name}'. {e}")
+        return None
 
 # --- POZOSTAŁE FUNKCJE (z drobnymi adaptacjami) ---
 
+CHAT_FALLBACK_RESPONSE = "Przepraszam, mam problem z odpowiedzią."
+# Liczba ostatnich wiadomości przekazywanych dosłownie; starsze trafiają do kroczącego streszczenia
+CHAT_HISTORY_WINDOW = int(os.getenv("CHAT_HISTORY_WINDOW", "15"))
+# Streszczenie jest odświeżane, gdy poza oknem zbierze się co najmniej tyle wiadomości (i najwyżej tyle naraz)
+CHAT_SUMMARY_MIN_MESSAGES = int(os.getenv("CHAT_SUMMARY_MIN_MESSAGES", "10"))
+CHAT_SUMMARY_MAX_MESSAGES = int(os.getenv("CHAT_SUMMARY_MAX_MESSAGES", "50"))
+# Górna granica wiadomości w prompcie, gdy streszczenie nie nadąża (np. po błędach modelu)
+CHAT_HISTORY_MAX_MESSAGES = CHAT_HISTORY_WINDOW + CHAT_SUMMARY_MAX_MESSAGES
+_summaries_in_progress = set()
+
 async def get_chat_response(db: Session, user: models.User, conversation: models.Conversation, new_message: str) -> str:
     # W przyszłości tutaj zaimplementujemy Tool Calling
+    history_for_model = await build_chat_history(db, user, conversation)
+    try:
+        response_text = await ai_client.generate(history_for_model, call_site="chat")
+    except AIError as e:
+        print(f"BŁĄD: Nie udało się uzyskać odpowiedzi czatu. {e}")
+        response_text = ""
+    return response_text if response_text else CHAT_FALLBACK_RESPONSE
+
+async def build_chat_history(db: Session, user: models.User, conversation: models.Conversation) -> List[Dict[str, Any]]:
+    """Buduje kontekst rozmowy dla modelu. Zapytania i leniwe ładowanie relacji działają w puli wątków bazy danych."""
+    return await run_db(_build_chat_history, db, user, conversation)
+
+async def stream_chat_response(history_for_model: List[Dict[str, Any]]) -> AsyncIterator[str]:
+    """Strumieniuje odpowiedź AI Trenera fragmentami tekstu. Błędy modelu są zgłaszane jako AIError."""
+    async with aclosing(ai_client.stream(history_for_model, call_site="chat")) as stream:
+        async for chunk in stream:
+            yield chunk
+
+def _build_chat_history(db: Session, user: models.User, conversation: models.Conversation) -> List[Dict[str, Any]]:
+    # Migawka dnia z cache - odświeżana dopiero po zapisie w dzienniku lub zmianie celów
+    context = daily_context.get(db, user)
     
-    # Na razie prosty kontekst z dzisiejszego dnia
-    summary = crud.get_meals_by_date(db, user.id, date.today())
-    summary_text = f"Dzisiejsze posiłki użytkownika: {', '.join([e.product_name for m in summary for e in m.entries])}."
+    system_prompt = f"Jesteś AIKcal, osobistym trenerem AI. Rozmawiasz z {user.name}. {context.to_prompt()} Bądź przyjazny i odpowiadaj po polsku."
     
-    system_prompt = f"Jesteś AIKcal, osobistym trenerem AI. Rozmawiasz z {user.name}. Jego cel kaloryczny to {user.calorie_goal} kcal. {summary_text} Bądź przyjazny i odpowiadaj po polsku."
+    if conversation.summary:
+        system_prompt += f" Streszczenie wcześniejszej części rozmowy: {conversation.summary}"
     
     history_for_model = [{"role": "user", "parts": [{"text": system_prompt}]}]
-    for msg in conversation.messages[-15:]: # Ograniczamy kontekst do ostatnich 15 wiadomości
+    # Ostatnie wiadomości (LIMIT w zapytaniu) - koszt nie rośnie wraz z długością rozmowy. Okno obejmuje też
+    # wszystkie wiadomości jeszcze nieujęte w streszczeniu, więc nic nie wypada z kontekstu, zanim trafi do streszczenia.
+    for msg in _context_messages(db, conversation):
         role = 'model' if msg.role == 'ai' else 'user'
         history_for_model.append({"role": role, "parts": [{"text": msg.content}]})
-
-    response = await model.generate_content_async(history_for_model)
-    return response.text if response.text else "Przepraszam, mam problem z odpowiedzią."
+    return history_for_model
+
+def _context_messages(db: Session, conversation: models.Conversation) -> List[models.ChatMessage]:
+    recent = crud.get_recent_messages(db, conversation.id, limit=CHAT_HISTORY_MAX_MESSAGES)
+    summarized_until_id = conversation.summarized_until_id or 0
+    window_start = max(0, len(recent) - CHAT_HISTORY_WINDOW)
+    return [msg for index, msg in enumerate(recent) if index >= window_start or msg.id > summarized_until_id]
+
+def _pending_summary_messages(db: Session, conversation_id: int):
+    """Zwraca (streszczenie, wiadomości spoza okna jeszcze nieujęte w streszczeniu)."""
+    conversation = db.query(models.Conversation).filter(models.Conversation.id == conversation_id).first()
+    if conversation is None:
+        return None, []
+    window = crud.get_recent_messages(db, conversation_id, limit=CHAT_HISTORY_WINDOW)
+    if len(window) < CHAT_HISTORY_WINDOW:
+        return conversation.summary, []
+    pending = crud.get_messages_between(db, conversation_id, after_id=conversation.summarized_until_id,
+                                        before_id=window[0].id, limit=CHAT_SUMMARY_MAX_MESSAGES)
+    return conversation.summary, [(msg.id, msg.role, msg.content) for msg in pending]
+
+async def refresh_conversation_summary(conversation_id: int, user_id: int):
+    """
+    Dołącza do kroczącego streszczenia wiadomości, które wypadły z okna kontekstu.
+    Uruchamiane w tle po odpowiedzi AI; przy zbyt małej liczbie nowych wiadomości nic nie robi.
+    """
+    if conversation_id in _summaries_in_progress:
+        return
+    _summaries_in_progress.add(conversation_id)
+    try:
+        ai_scheduler.bind_user(user_id)
+        summary, pending = await run_in_session(_pending_summary_messages, conversation_id)
+        if len(pending) < CHAT_SUMMARY_MIN_MESSAGES:
+            return
+
+        transcript = "\n".join(f"{'Trener' if role == 'ai' else 'Użytkownik'}: {content}" for _, role, content in pending)
+        prompt = f"""
+        Streszczasz rozmowę użytkownika z AI Trenerem dietetycznym, aby trener mógł ją kontynuować.
+        Dotychczasowe streszczenie: {summary or "(brak)"}
+        Nowe wiadomości:
+        {transcript}
+        Zwróć zaktualizowane streszczenie po polsku (maksymalnie 150 słów). Zachowaj fakty o użytkowniku, jego cele,
+        preferencje, problemy i ustalenia. Pomiń powitania i dygresje. Zwróć tylko tekst streszczenia.
+        """
+        new_summary = (await _get_ai_response(prompt, call_site="chat_summary")).strip()
+        if not new_summary:
+            return
+        await run_in_session(crud.update_conversation_summary, conversation_id, new_summary, pending[-1][0])
+        print(f"DEBUG: Zaktualizowano streszczenie konwersacji {conversation_id} o {len(pending)} wiadomości.")
+    finally:
+        _summaries_in_progress.discard(conversation_id)
 
 
 async def analyze_workout(text: str, weight: float) -> Dict[str, Any]:
@@ -390,7 +804,7 @@ async def analyze_workout(text: str, weight: float) -> Dict[str, Any]:
     
     Przeanalizuj: "{text}"
     """
-    response_text = await _get_ai_response(prompt)
+    response_text = await _get_ai_response(prompt, call_site="analyze_workout", cache=True)
     try:
         return json.loads(_clean_json_response(response_text))
     except (json.JSONDecodeError, TypeError):
@@ -403,11 +817,11 @@ async def verify_challenge_completion(challenge_title: str, challenge_descriptio
     prompt = ""
     if category == 'dieta':
         prompt = f"""Jesteś sędzią w wyzwaniu dietetycznym: "{challenge_title}" (Zasady: {challenge_description}). Dziennik użytkownika:\n- {logs_str}\nCzy użytkownik ZŁAMAŁ zasady? Odpowiedz TYLKO "TAK" lub "NIE"."""
-        response_text = await _get_ai_response(prompt)
+        response_text = await _get_ai_response(prompt, call_site="verify_challenge", cache=True)
         return "NIE" in response_text.upper()
     elif category == 'aktywność':
         prompt = f"""Jesteś trenerem sprawdzającym wykonanie zadania: "{challenge_title}" (Zasady: {challenge_description}). Dziennik aktywności:\n- {logs_str}\nCzy użytkownik WYKONAŁ zadanie? Odpowiedz TYLKO "TAK" lub "NIE"."""
-        response_text = await _get_ai_response(prompt)
+        response_text = await _get_ai_response(prompt, call_site="verify_challenge", cache=True)
         return "TAK" in response_text.upper()
     return False
 
@@ -439,10 +853,17 @@ async def suggest_tdee_and_macros(req: schemas.GoalSuggestionRequest) -> Dict[st
         "carb_goal": round((adjusted_calories * ratios['c']) / 4)
     }
 
-async def generate_weekly_analysis(user_data: Dict[str, Any], user: models.User, start_date: date, end_date: date) -> str:
+async def generate_weekly_analysis(user_data: Dict[str, Any], user: models.User, start_date: date, end_date: date,
+                                   call_site: str = "weekly_analysis") -> str:
     """Generuje tekstowe podsumowanie tygodnia dla AI Trenera."""
-    # Konwersja danych na serializowalny format JSON
-    serializable_user_data = {
+    # Serializacja w puli wątków bazy danych (wpisy posiłków są ładowane z góry przez `crud`, ale dostęp do ORM zostaje poza pętlą zdarzeń)
+    serializable_user_data = await run_db(_serialize_weekly_data, user_data)
+    prompt = f"""Jesteś trenerem AI. Przeanalizuj dane użytkownika {user.name} od {start_date.strftime('%d.%m')} do {end_date.strftime('%d.%m')}. Dane: {json.dumps(serializable_user_data)}. Cele: {user.calorie_goal} kcal. Napisz krótkie, motywujące podsumowanie po polsku: co poszło dobrze, co poprawić i daj jedną sugestię."""
+    return await _get_ai_response(prompt, call_site=call_site)
+
+def _serialize_weekly_data(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Konwersja danych na serializowalny format JSON."""
+    return {
         "meals": [
             {"name": m.name, "date": m.date.isoformat(), "entries": [{"product_name": e.product_name, "calories": e.calories} for e in m.entries]} 
             for m in user_data.get("meals", [])
@@ -454,10 +875,13 @@ async def generate_weekly_analysis(user_data: Dict[str, Any], user: models.User,
         "weight_history": [
             {"weight": wh.weight, "date": wh.date.isoformat()} 
             for wh in user_data.get("weight_history", [])
+        ],
+        "daily_totals": [
+            {"date": day.date.isoformat(), "calories": round(day.calories), "protein": round(day.protein),
+             "water_ml": day.water_ml, "calories_burned": day.calories_burned}
+            for day in user_data.get("daily_totals", [])
         ]
     }
-    prompt = f"""Jesteś trenerem AI. Przeanalizuj dane użytkownika {user.name} od {start_date.strftime('%d.%m')} do {end_date.strftime('%d.%m')}. Dane: {json.dumps(serializable_user_data)}. Cele: {user.calorie_goal} kcal. Napisz krótkie, motywujące podsumowanie po polsku: co poszło dobrze, co poprawić i daj jedną sugestię."""
-    return await _get_ai_response(prompt)
 
 async def suggest_diet_plan(preferences: dict, macros: dict) -> Optional[List[Dict[str, Any]]]:
     """Generuje całodniowy plan posiłków dla AI Chefa."""
@@ -475,7 +899,7 @@ async def suggest_diet_plan(preferences: dict, macros: dict) -> Optional[List[Di
 
     Stwórz kompletny plan na jeden dzień.
     """
-    response_text = await _get_ai_response(prompt)
+    response_text = await _get_ai_response(prompt, call_site="diet_plan")
     try:
         plan = json.loads(_clean_json_response(response_text))
         return plan if isinstance(plan, list) and len(plan) > 0 else None
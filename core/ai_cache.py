@@ -0,0 +1,267 @@
+"""
+Moduł odpowiedzialny za cache odpowiedzi modelu AI.
+
+Ten plik zawiera:
+1.  Wyliczanie klucza cache z nazwy modelu, treści promptu i (opcjonalnie) obrazu.
+2.  Dwupoziomowy cache: szybki LRU w pamięci procesu oraz trwałą tabelę `ai_response_cache` w SQLite.
+3.  Wygasanie wpisów (TTL) i ograniczenie rozmiaru tabeli (usuwanie najdawniej używanych wpisów).
+    Trafienia (także z pamięci) są zliczane w pamięci i zapisywane do `last_used_at`/`hit_count` zbiorczo -
+    przed usuwaniem nadmiarowych wpisów lub po zebraniu USAGE_FLUSH_EVERY kluczy - więc odczyt nie jest transakcją zapisu.
+    Zapis odbywa się tylko w funkcjach blokujących (`get`, `put`, `purge`), wywoływanych poza pętlą zdarzeń;
+    `get_from_memory` jedynie zapamiętuje trafienie.
+4.  Flagi włączające cache osobno dla każdego miejsca wywołania oraz liczniki trafień i chybień.
+
+Cache jest "opt-in": z cache korzystają tylko wywołania `_get_ai_response(..., call_site=..., cache=True)`
+dla promptów deterministycznych względem danych wejściowych. Konfiguracja przez zmienne środowiskowe:
+- AI_CACHE_SITES: lista miejsc wywołania oddzielona przecinkami (domyślnie wszystkie z DEFAULT_SITES),
+  pusta wartość wyłącza cache całkowicie,
+- AI_CACHE_TTL_SECONDS: czas życia wpisu (domyślnie 30 dni),
+- AI_CACHE_MAX_ENTRIES: maksymalna liczba wpisów w bazie (domyślnie 10000),
+- AI_CACHE_MEMORY_ENTRIES: maksymalna liczba wpisów w pamięci (domyślnie 1024).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Tuple
+
+from PIL import Image
+from sqlalchemy import bindparam, func, update
+from sqlalchemy.exc import SQLAlchemyError
+
+from . import models
+from .db import SessionLocal
+
+# Miejsca wywołania, których prompty zależą wyłącznie od danych wejściowych
+DEFAULT_SITES = (
+    "learn_dish", "learn_dish_recipe", "learn_dishes_batch",
+    "learn_product", "learn_products_batch",
+    "analyze_workout", "verify_challenge",
+)
+
+TTL = timedelta(seconds=int(os.getenv("AI_CACHE_TTL_SECONDS", str(30 * 24 * 3600))))
+MAX_ENTRIES = int(os.getenv("AI_CACHE_MAX_ENTRIES", "10000"))
+MEMORY_ENTRIES = int(os.getenv("AI_CACHE_MEMORY_ENTRIES", "1024"))
+# Sprawdzanie rozmiaru tabeli co N zapisów, a nie przy każdym
+EVICTION_CHECK_EVERY = 50
+# Zapis zebranych trafień do bazy, gdy oczekuje ich tyle różnych kluczy
+USAGE_FLUSH_EVERY = 100
+
+
+def _enabled_sites() -> frozenset:
+    raw = os.getenv("AI_CACHE_SITES")
+    if raw is None:
+        return frozenset(DEFAULT_SITES)
+    return frozenset(site.strip() for site in raw.split(",") if site.strip())
+
+
+ENABLED_SITES = _enabled_sites()
+
+
+def is_enabled(call_site: Optional[str]) -> bool:
+    return bool(call_site) and call_site in ENABLED_SITES
+
+
+def make_key(model_name: str, prompt: str, image: Optional[Image.Image] = None) -> str:
+    """Zwraca hash SHA-256 z nazwy modelu, promptu i pikseli obrazu."""
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\x00")
+    digest.update(prompt.encode("utf-8"))
+    if image is not None:
+        digest.update(b"\x00")
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode("utf-8"))
+        digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class AIResponseCache:
+    """Cache odpowiedzi AI: LRU w pamięci przed trwałą tabelą w bazie."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, Tuple[str, datetime]]" = OrderedDict()
+        self._writes_since_eviction = 0
+        self._stats: Dict[str, Dict[str, int]] = {}
+        # Klucz -> (ostatnie użycie, liczba trafień) jeszcze niezapisane w bazie
+        self._pending_usage: Dict[str, Tuple[datetime, int]] = {}
+
+    # --- Liczniki ---
+
+    def _count(self, call_site: str, field: str):
+        with self._lock:
+            site_stats = self._stats.setdefault(call_site, {"hits": 0, "misses": 0, "writes": 0})
+            site_stats[field] += 1
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """Zwraca kopię liczników trafień, chybień i zapisów dla każdego miejsca wywołania."""
+        with self._lock:
+            return {site: dict(values) for site, values in self._stats.items()}
+
+    # --- Odczyt i zapis ---
+
+    def get_from_memory(self, call_site: str, key: str) -> Optional[str]:
+        """Sprawdza tylko cache w pamięci (bez dostępu do bazy, można wołać w pętli zdarzeń). Chybienie nie jest liczone."""
+        now = datetime.utcnow()
+        with self._lock:
+            cached = self._memory.get(key)
+            if cached is not None:
+                if cached[1] > now:
+                    self._memory.move_to_end(key)
+                else:
+                    del self._memory[key]
+                    cached = None
+        if cached is None:
+            return None
+        self._count(call_site, "hits")
+        self._record_usage(key, now)
+        return cached[0]
+
+    def get(self, call_site: str, key: str) -> Optional[str]:
+        """Sprawdza cache w pamięci, a potem w bazie. Funkcja blokująca - w kodzie async wywoływać przez `run_db`."""
+        cached = self.get_from_memory(call_site, key)
+        if cached is not None:
+            self._flush_usage_if_due()
+            return cached
+
+        now = datetime.utcnow()
+        response = self._get_from_db(key, now)
+        if response is None:
+            self._count(call_site, "misses")
+            return None
+        self._count(call_site, "hits")
+        self._record_usage(key, now)
+        self._flush_usage_if_due()
+        return response
+
+    def put(self, call_site: str, key: str, response: str):
+        now = datetime.utcnow()
+        expires_at = now + TTL
+        self._remember(key, response, expires_at)
+        self._count(call_site, "writes")
+        self._flush_usage_if_due()
+
+        db = SessionLocal()
+        try:
+            entry = db.get(models.AIResponseCache, key)
+            if entry is None:
+                entry = models.AIResponseCache(key=key, call_site=call_site)
+                db.add(entry)
+            entry.response = response
+            entry.created_at = now
+            entry.last_used_at = now
+            entry.expires_at = expires_at
+            db.commit()
+            with self._lock:
+                self._writes_since_eviction += 1
+                should_evict = self._writes_since_eviction >= EVICTION_CHECK_EVERY
+                if should_evict:
+                    self._writes_since_eviction = 0
+            if should_evict:
+                self._evict(db, now)
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"BŁĄD: Nie udało się zapisać odpowiedzi AI w cache. {e}")
+        finally:
+            db.close()
+
+    def purge(self):
+        """Zapisuje zebrane trafienia i usuwa z bazy wpisy przeterminowane i nadmiarowe (zadanie konserwacji bazy)."""
+        db = SessionLocal()
+        try:
+            self._evict(db, datetime.utcnow())
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"BŁĄD: Nie udało się wyczyścić cache odpowiedzi AI. {e}")
+        finally:
+            db.close()
+
+    def clear_memory(self):
+        with self._lock:
+            self._memory.clear()
+
+    # --- Wewnętrzne ---
+
+    def _remember(self, key: str, response: str, expires_at: datetime):
+        with self._lock:
+            self._memory[key] = (response, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > MEMORY_ENTRIES:
+                self._memory.popitem(last=False)
+
+    def _get_from_db(self, key: str, now: datetime) -> Optional[str]:
+        db = SessionLocal()
+        try:
+            entry = db.get(models.AIResponseCache, key)
+            if entry is None:
+                return None
+            if entry.expires_at <= now:
+                db.delete(entry)
+                db.commit()
+                return None
+            response, expires_at = entry.response, entry.expires_at
+            self._remember(key, response, expires_at)
+            return response
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"BŁĄD: Nie udało się odczytać cache odpowiedzi AI. {e}")
+            return None
+        finally:
+            db.close()
+
+    def _record_usage(self, key: str, now: datetime):
+        with self._lock:
+            _, hits = self._pending_usage.get(key, (now, 0))
+            self._pending_usage[key] = (now, hits + 1)
+
+    def _flush_usage_if_due(self):
+        with self._lock:
+            due = len(self._pending_usage) >= USAGE_FLUSH_EVERY
+        if due:
+            self.flush_usage()
+
+    def flush_usage(self, db=None):
+        """Zapisuje zebrane trafienia jednym poleceniem UPDATE (executemany) w jednej transakcji. Funkcja blokująca."""
+        with self._lock:
+            pending, self._pending_usage = self._pending_usage, {}
+        if not pending:
+            return
+        table = models.AIResponseCache.__table__
+        statement = (
+            update(table)
+            .where(table.c.key == bindparam("b_key"))
+            .values(last_used_at=bindparam("b_used"), hit_count=func.coalesce(table.c.hit_count, 0) + bindparam("b_hits"))
+        )
+        own_session = db is None
+        db = db or SessionLocal()
+        try:
+            db.connection().execute(statement, [
+                {"b_key": key, "b_used": used, "b_hits": hits} for key, (used, hits) in pending.items()
+            ])
+            db.commit()
+        except SQLAlchemyError as e:
+            db.rollback()
+            print(f"BŁĄD: Nie udało się zapisać statystyk użycia cache AI. {e}")
+        finally:
+            if own_session:
+                db.close()
+
+    def _evict(self, db, now: datetime):
+        """Usuwa wpisy przeterminowane, a potem najdawniej używane ponad limit MAX_ENTRIES."""
+        # Najpierw trafienia - inaczej najczęściej używane klucze (obsługiwane z pamięci) wyglądałyby na nieużywane
+        self.flush_usage(db)
+        table = models.AIResponseCache
+        expired = db.query(table).filter(table.expires_at <= now).delete(synchronize_session=False)
+        overflow = db.query(table).count() - MAX_ENTRIES
+        evicted = 0
+        if overflow > 0:
+            oldest = db.query(table.key).order_by(table.last_used_at.asc()).limit(overflow).subquery()
+            evicted = db.query(table).filter(table.key.in_(db.query(oldest.c.key))).delete(synchronize_session=False)
+        db.commit()
+        if expired or evicted:
+            print(f"DEBUG: Cache AI - usunięto {expired} przeterminowanych i {evicted} najstarszych wpisów.")
+
+
+# Jedna instancja na proces
+response_cache = AIResponseCache()
@@ -0,0 +1,393 @@
+"""
+Moduł odpowiedzialny za komunikację z modelem AI.
+
+Ten plik zawiera:
+1.  Wymienne backendy: Gemini (produkcyjny) oraz deterministyczny stub do testów obciążeniowych bez sieci.
+2.  Wspólnego klienta z limitem czasu na wywołanie, ponawianiem z wykładniczym opóźnieniem (z losowym jitterem)
+    dla błędów 429/5xx, wyłącznikiem obwodu (circuit breaker) i limitem równoległych zapytań.
+
+Konfiguracja przez zmienne środowiskowe:
+- AI_BACKEND: "gemini" (domyślnie) lub "stub",
+- AI_TIMEOUT_SECONDS: limit czasu jednego wywołania (domyślnie 30 s; czat i plany mają dłuższe limity),
+- AI_MAX_RETRIES: liczba ponowień po błędzie przejściowym (domyślnie 3),
+- AI_MAX_CONCURRENCY: maksymalna liczba równoległych zapytań do modelu (domyślnie 8),
+- AI_BREAKER_THRESHOLD / AI_BREAKER_COOLDOWN_SECONDS: liczba kolejnych błędów otwierająca obwód (5)
+  i czas, po którym dopuszczane jest zapytanie próbne (30 s),
+- AI_STUB_LATENCY_MS: sztuczne opóźnienie odpowiedzi stuba (domyślnie 0).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from .ai_scheduler import AIQueueTimeout, estimate_tokens, scheduler
+
+MODEL_NAME = 'gemini-1.5-flash-latest'
+
+AI_TIMEOUT_SECONDS = float(os.getenv("AI_TIMEOUT_SECONDS", "30"))
+# Dłuższe odpowiedzi tekstowe potrzebują więcej czasu
+CALL_SITE_TIMEOUTS = {"chat": 60.0, "chat_summary": 60.0, "weekly_analysis": 60.0, "weekly_analysis_pregen": 60.0, "diet_plan": 90.0}
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "3"))
+AI_MAX_CONCURRENCY = int(os.getenv("AI_MAX_CONCURRENCY", "8"))
+AI_BREAKER_THRESHOLD = int(os.getenv("AI_BREAKER_THRESHOLD", "5"))
+AI_BREAKER_COOLDOWN_SECONDS = float(os.getenv("AI_BREAKER_COOLDOWN_SECONDS", "30"))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+# --- Wyjątki ---
+
+class AIError(Exception):
+    """Błąd wywołania modelu AI."""
+
+class AITimeoutError(AIError):
+    """Model nie odpowiedział w wyznaczonym czasie."""
+
+class AIUnavailableError(AIError):
+    """Obwód jest otwarty po serii błędów - zapytanie odrzucono bez wywoływania modelu."""
+
+
+def _is_retryable(error: BaseException) -> bool:
+    """Błędy przejściowe: przekroczenie czasu oraz odpowiedzi HTTP 429 i 5xx (wyjątki google.api_core mają pole `code`)."""
+    if isinstance(error, (asyncio.TimeoutError, AITimeoutError, ConnectionError)):
+        return True
+    code = getattr(error, "code", None)
+    if isinstance(code, int):
+        return code in RETRYABLE_STATUS_CODES
+    return "429" in str(error)
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Opóźnienie przed kolejną próbą: wykładnicze z pełnym jitterem."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+# --- Backendy ---
+
+class GeminiBackend:
+    """Backend produkcyjny - model Gemini przez `google.generativeai`."""
+    name = "gemini"
+
+    def __init__(self, model_name: str = MODEL_NAME):
+        import google.generativeai as genai
+
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY nie został ustawiony w zmiennych środowiskowych.")
+        genai.configure(api_key=api_key)
+        self.model_name = model_name
+        self._model = genai.GenerativeModel(model_name)
+
+    async def generate(self, contents: List[Any], call_site: str, timeout: float) -> str:
+        response = await self._model.generate_content_async(contents, request_options={"timeout": timeout})
+        return response.text if response.text else ""
+
+    def generate_sync(self, contents: List[Any], call_site: str, timeout: float) -> str:
+        response = self._model.generate_content(contents, request_options={"timeout": timeout})
+        return response.text if response.text else ""
+
+    async def stream(self, contents: List[Any], call_site: str, timeout: float) -> AsyncIterator[str]:
+        response = await self._model.generate_content_async(contents, stream=True, request_options={"timeout": timeout})
+        async for chunk in response:
+            if chunk.text:
+                yield chunk.text
+
+
+class StubBackend:
+    """
+    Lokalny, deterministyczny backend do testów i testów obciążeniowych.
+    Odpowiedź zależy tylko od miejsca wywołania i treści promptu (liczby wyliczane z jego hasha).
+    """
+    name = "stub"
+
+    def __init__(self, model_name: str = "stub"):
+        self.model_name = model_name
+        self.latency = float(os.getenv("AI_STUB_LATENCY_MS", "0")) / 1000.0
+
+    async def generate(self, contents: List[Any], call_site: str, timeout: float) -> str:
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.respond(contents, call_site)
+
+    def generate_sync(self, contents: List[Any], call_site: str, timeout: float) -> str:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.respond(contents, call_site)
+
+    async def stream(self, contents: List[Any], call_site: str, timeout: float) -> AsyncIterator[str]:
+        words = self.respond(contents, call_site).split(" ")
+        for index, word in enumerate(words):
+            if self.latency:
+                await asyncio.sleep(self.latency / len(words))
+            yield word if index == 0 else " " + word
+
+    @staticmethod
+    def _prompt_text(contents: List[Any]) -> str:
+        parts = []
+        for item in contents:
+            if isinstance(item, str):
+                parts.append(item)
+            elif isinstance(item, dict):
+                parts.extend(part.get("text", "") for part in item.get("parts", []) if isinstance(part, dict))
+        return "\n".join(parts)
+
+    @staticmethod
+    def _number(seed: str, low: int, high: int) -> int:
+        digest = int(hashlib.sha256(seed.encode("utf-8")).hexdigest()[:8], 16)
+        return low + digest % (high - low + 1)
+
+    def _nutrients(self, seed: str) -> Dict[str, float]:
+        return {
+            "calories": float(self._number(seed + "kcal", 20, 500)),
+            "protein": float(self._number(seed + "p", 0, 30)),
+            "fat": float(self._number(seed + "f", 0, 30)),
+            "carbs": float(self._number(seed + "c", 0, 60)),
+        }
+
+    def _food_item(self, name: str) -> Dict[str, Any]:
+        return {
+            "query": name, "name": name, "is_complex": False, "state": "solid",
+            "base_quantity_g": self._number(name + "g", 50, 400), "average_weight_g": 0,
+            "nutrients_per_100g": self._nutrients(name), "nutrients": self._nutrients(name), "ingredients": [],
+        }
+
+    def respond(self, contents: List[Any], call_site: str) -> str:
+        prompt = self._prompt_text(contents)
+        quoted = re.findall(r"[\"']([^\"'\n]+)[\"']", prompt)
+        listed = re.findall(r"^\s*- (.+)$", prompt, re.MULTILINE)
+        first_quoted = quoted[0] if quoted else "produkt"
+
+        if call_site in ("learn_dish", "learn_product"):
+            return json.dumps(self._food_item(first_quoted), ensure_ascii=False)
+        if call_site in ("learn_dishes_batch", "learn_products_batch"):
+            return json.dumps([self._food_item(name.strip()) for name in listed], ensure_ascii=False)
+        if call_site == "learn_dish_recipe":
+            return "[]"
+        if call_site == "parse_image":
+            return json.dumps({"name": "Posiłek ze zdjęcia", "quantity": 250, "unit": "g"}, ensure_ascii=False)
+        if call_site == "analyze_workout":
+            return json.dumps({"name": "Trening", "calories_burned": self._number(prompt, 50, 600)}, ensure_ascii=False)
+        if call_site == "verify_challenge":
+            return "TAK" if self._number(prompt, 0, 1) else "NIE"
+        if call_site == "enrich_product":
+            return json.dumps({"state": "solid", "average_weight_g": 0})
+        if call_site == "diet_plan":
+            return json.dumps([{"meal_name": "Owsianka", "category": "Śniadanie", "recipe": "Ugotuj płatki na mleku.",
+                                "products": [{"name": "Płatki owsiane", "quantity_grams": 60, "calories": 222, "protein": 8, "fat": 4, "carbs": 36}]}],
+                              ensure_ascii=False)
+        return f"Odpowiedź testowa ({call_site})."
+
+
+def _create_backend(name: str, model_name: str):
+    if name == "stub":
+        return StubBackend(model_name)
+    if name == "gemini":
+        return GeminiBackend(model_name)
+    raise ValueError(f"Nieznany backend AI: '{name}'. Dostępne: gemini, stub.")
+
+
+# --- Klient ---
+
+class CircuitBreaker:
+    """Po `threshold` kolejnych błędach odrzuca zapytania przez `cooldown` sekund, potem przepuszcza jedno próbne."""
+
+    def __init__(self, threshold: int = AI_BREAKER_THRESHOLD, cooldown: float = AI_BREAKER_COOLDOWN_SECONDS):
+        self._lock = threading.Lock()
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self._trial_in_progress = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.cooldown or self._trial_in_progress:
+                return False
+            self._trial_in_progress = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_progress = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_progress = False
+            if self.failures >= self.threshold:
+                if self.opened_at is None:
+                    print(f"BŁĄD: {self.failures} kolejnych błędów AI. Otwieram obwód na {self.cooldown:.0f} s.")
+                self.opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.cooldown else "half-open"
+
+
+class AIClient:
+    """Wspólny klient modelu AI używany przez analizator i skrypty."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.model_name = backend.model_name
+        self.breaker = CircuitBreaker()
+        self._semaphore = asyncio.Semaphore(AI_MAX_CONCURRENCY)
+        self._stats_lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _count(self, call_site: str, field: str):
+        with self._stats_lock:
+            site_stats = self._stats.setdefault(call_site, {"calls": 0, "retries": 0, "failures": 0, "rejected": 0})
+            site_stats[field] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            per_site = {site: dict(values) for site, values in self._stats.items()}
+        return {"backend": self.backend.name, "breaker": self.breaker.state, "call_sites": per_site}
+
+    def _timeout_for(self, call_site: str, timeout: Optional[float]) -> float:
+        return timeout or CALL_SITE_TIMEOUTS.get(call_site, AI_TIMEOUT_SECONDS)
+
+    async def generate(self, contents: List[Any], call_site: str = "default", timeout: Optional[float] = None) -> str:
+        """
+        Wysyła zapytanie do modelu i zwraca tekst odpowiedzi.
+        Rzuca AIUnavailableError (obwód otwarty), AITimeoutError lub AIError po wyczerpaniu ponowień.
+        """
+        timeout = self._timeout_for(call_site, timeout)
+        estimated_tokens = estimate_tokens(contents, call_site)
+        self._count(call_site, "calls")
+        for attempt in range(AI_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._count(call_site, "rejected")
+                raise AIUnavailableError("Usługa AI jest chwilowo niedostępna.")
+            try:
+                # Kolejka priorytetowa z globalnym limitem QPS i tokenów (patrz `ai_scheduler`)
+                async with scheduler.slot(call_site, estimated_tokens):
+                    async with self._semaphore:
+                        text = await asyncio.wait_for(self.backend.generate(contents, call_site, timeout), timeout=timeout)
+            except AIQueueTimeout as e:
+                self._count(call_site, "rejected")
+                raise AIUnavailableError("Zbyt wiele zapytań do AI. Spróbuj ponownie za chwilę.") from e
+            except Exception as e:
+                error = AITimeoutError(f"Przekroczono limit {timeout:g} s") if isinstance(e, asyncio.TimeoutError) else e
+                if not _is_retryable(error):
+                    # Błąd zapytania (np. 400) nie świadczy o awarii usługi
+                    self.breaker.record_success()
+                    self._count(call_site, "failures")
+                    raise AIError(str(error)) from e
+                self.breaker.record_failure()
+                if attempt == AI_MAX_RETRIES:
+                    self._count(call_site, "failures")
+                    raise error if isinstance(error, AIError) else AIError(str(error)) from e
+                delay = _backoff_delay(attempt)
+                self._count(call_site, "retries")
+                print(f"DEBUG: Błąd przejściowy AI ({call_site}): {error}. Ponawiam za {delay:.1f} s.")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            # Korekta budżetu: faktyczna długość odpowiedzi zamiast szacunku
+            scheduler.record_usage(estimated_tokens, estimated_tokens - estimate_tokens([], call_site) + len(text) // 4)
+            return text
+
+    async def stream(self, contents: List[Any], call_site: str = "default", timeout: Optional[float] = None) -> AsyncIterator[str]:
+        """
+        Strumieniuje odpowiedź modelu kolejnymi fragmentami tekstu.
+        Limit czasu dotyczy oczekiwania na każdy kolejny fragment. Ponawiane jest tylko zapytanie,
+        które zawiodło przed wysłaniem pierwszego fragmentu. Przerwanie iteracji (np. rozłączenie klienta)
+        zamyka strumień i anuluje generowanie po stronie modelu.
+        """
+        timeout = self._timeout_for(call_site, timeout)
+        estimated_tokens = estimate_tokens(contents, call_site)
+        self._count(call_site, "calls")
+        for attempt in range(AI_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._count(call_site, "rejected")
+                raise AIUnavailableError("Usługa AI jest chwilowo niedostępna.")
+            received = []
+            try:
+                async with scheduler.slot(call_site, estimated_tokens):
+                    async with self._semaphore:
+                        upstream = self.backend.stream(contents, call_site, timeout)
+                        try:
+                            while True:
+                                try:
+                                    chunk = await asyncio.wait_for(upstream.__anext__(), timeout=timeout)
+                                except StopAsyncIteration:
+                                    break
+                                received.append(chunk)
+                                yield chunk
+                        finally:
+                            await upstream.aclose()
+            except AIQueueTimeout as e:
+                self._count(call_site, "rejected")
+                raise AIUnavailableError("Zbyt wiele zapytań do AI. Spróbuj ponownie za chwilę.") from e
+            except Exception as e:
+                error = AITimeoutError(f"Przekroczono limit {timeout:g} s") if isinstance(e, asyncio.TimeoutError) else e
+                if not _is_retryable(error):
+                    self.breaker.record_success()
+                    self._count(call_site, "failures")
+                    raise AIError(str(error)) from e
+                self.breaker.record_failure()
+                if received or attempt == AI_MAX_RETRIES:
+                    # Części odpowiedzi już wysłano - ponowienie powieliłoby tekst
+                    self._count(call_site, "failures")
+                    raise error if isinstance(error, AIError) else AIError(str(error)) from e
+                delay = _backoff_delay(attempt)
+                self._count(call_site, "retries")
+                print(f"DEBUG: Błąd przejściowy AI ({call_site}): {error}. Ponawiam za {delay:.1f} s.")
+                await asyncio.sleep(delay)
+                continue
+            self.breaker.record_success()
+            scheduler.record_usage(estimated_tokens, estimated_tokens - estimate_tokens([], call_site) + len("".join(received)) // 4)
+            return
+
+    def generate_sync(self, contents: List[Any], call_site: str = "default", timeout: Optional[float] = None) -> str:
+        """Wersja blokująca `generate` dla skryptów uruchamianych z linii poleceń."""
+        timeout = self._timeout_for(call_site, timeout)
+        self._count(call_site, "calls")
+        for attempt in range(AI_MAX_RETRIES + 1):
+            if not self.breaker.allow():
+                self._count(call_site, "rejected")
+                raise AIUnavailableError("Usługa AI jest chwilowo niedostępna.")
+            try:
+                text = self.backend.generate_sync(contents, call_site, timeout)
+            except Exception as e:
+                if not _is_retryable(e):
+                    self.breaker.record_success()
+                    self._count(call_site, "failures")
+                    raise AIError(str(e)) from e
+                self.breaker.record_failure()
+                if attempt == AI_MAX_RETRIES:
+                    self._count(call_site, "failures")
+                    raise AIError(str(e)) from e
+                delay = _backoff_delay(attempt)
+                self._count(call_site, "retries")
+                print(f"DEBUG: Błąd przejściowy AI ({call_site}): {e}. Ponawiam za {delay:.1f} s.")
+                time.sleep(delay)
+                continue
+            self.breaker.record_success()
+            return text
+
+
+_client: Optional[AIClient] = None
+_client_lock = threading.Lock()
+
+def get_ai_client() -> AIClient:
+    """Zwraca klienta AI dla procesu (tworzonego przy pierwszym użyciu wg AI_BACKEND)."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = AIClient(_create_backend(os.getenv("AI_BACKEND", "gemini").lower(), MODEL_NAME))
+        return _client
@@ -0,0 +1,255 @@
+"""
+Moduł odpowiedzialny za szeregowanie zapytań do modelu AI.
+
+Ten plik zawiera:
+1.  Klasy priorytetów: analiza posiłków (interaktywna) zawsze wyprzedza czat, generowanie planów
+    i analiz, a te z kolei zadania w tle (np. weryfikację wyzwań).
+2.  Globalne limity: liczba zapytań na sekundę (QPS) i budżet tokenów na minutę (token bucket).
+3.  Sprawiedliwe kolejkowanie: w ramach jednego priorytetu użytkownicy obsługiwani są po kolei (round-robin),
+    więc seria zapytań jednej osoby nie blokuje pozostałych.
+4.  Metryki: głębokość kolejek, liczba obsłużonych i odrzuconych zapytań, średni czas oczekiwania.
+
+Użytkownik, w imieniu którego wykonywane jest zapytanie, jest przekazywany przez ContextVar (`bind_user`).
+
+Konfiguracja przez zmienne środowiskowe:
+- AI_MAX_QPS: maksymalna liczba zapytań na sekundę (domyślnie 10),
+- AI_TOKENS_PER_MINUTE: budżet (szacowanych) tokenów na minutę (domyślnie 1 000 000),
+- AI_QUEUE_TIMEOUT_SECONDS: maksymalny czas oczekiwania w kolejce (domyślnie 30 s).
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Any, Deque, Dict, List, Optional
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0
+    CONVERSATIONAL = 1
+    GENERATIVE = 2
+    BACKGROUND = 3
+
+
+CALL_SITE_PRIORITIES = {
+    "parse_image": Priority.INTERACTIVE,
+    "learn_dish": Priority.INTERACTIVE,
+    "learn_dish_recipe": Priority.INTERACTIVE,
+    "learn_dishes_batch": Priority.INTERACTIVE,
+    "learn_product": Priority.INTERACTIVE,
+    "learn_products_batch": Priority.INTERACTIVE,
+    "analyze_workout": Priority.INTERACTIVE,
+    "chat": Priority.CONVERSATIONAL,
+    "diet_plan": Priority.GENERATIVE,
+    "weekly_analysis": Priority.GENERATIVE,
+    "weekly_analysis_pregen": Priority.BACKGROUND,
+    "verify_challenge": Priority.BACKGROUND,
+    "enrich_product": Priority.BACKGROUND,
+    "chat_summary": Priority.BACKGROUND,
+}
+
+# Szacowana długość odpowiedzi (w tokenach) doliczana do budżetu przed wywołaniem
+OUTPUT_TOKEN_ESTIMATES = {"chat": 400, "weekly_analysis": 600, "weekly_analysis_pregen": 600, "diet_plan": 1500, "learn_dishes_batch": 800, "learn_products_batch": 800}
+DEFAULT_OUTPUT_TOKENS = 300
+# Gemini liczy obraz jako stałą liczbę tokenów
+IMAGE_TOKENS = 258
+
+AI_MAX_QPS = float(os.getenv("AI_MAX_QPS", "10"))
+AI_TOKENS_PER_MINUTE = float(os.getenv("AI_TOKENS_PER_MINUTE", "1000000"))
+AI_QUEUE_TIMEOUT_SECONDS = float(os.getenv("AI_QUEUE_TIMEOUT_SECONDS", "30"))
+
+_current_user: ContextVar[str] = ContextVar("ai_user", default="anonymous")
+
+
+class AIQueueTimeout(Exception):
+    """Zapytanie czekało w kolejce dłużej niż AI_QUEUE_TIMEOUT_SECONDS."""
+
+
+def bind_user(user_key: Any):
+    """Ustawia użytkownika, w imieniu którego bieżące zadanie (i zadania z niego uruchomione) wysyła zapytania do AI."""
+    _current_user.set(str(user_key))
+
+
+def priority_for(call_site: str) -> Priority:
+    return CALL_SITE_PRIORITIES.get(call_site, Priority.GENERATIVE)
+
+
+def estimate_tokens(contents: List[Any], call_site: str) -> int:
+    """Zgrubne oszacowanie tokenów zapytania (~4 znaki na token) wraz z przewidywaną odpowiedzią."""
+    chars, images = 0, 0
+    for item in contents:
+        if isinstance(item, str):
+            chars += len(item)
+        elif isinstance(item, dict):
+            chars += sum(len(part.get("text", "")) for part in item.get("parts", []) if isinstance(part, dict))
+        else:
+            images += 1
+    return chars // 4 + images * IMAGE_TOKENS + OUTPUT_TOKEN_ESTIMATES.get(call_site, DEFAULT_OUTPUT_TOKENS)
+
+
+class _Waiter:
+    __slots__ = ("future", "cost", "enqueued_at")
+
+    def __init__(self, future: asyncio.Future, cost: float):
+        self.future = future
+        self.cost = cost
+        self.enqueued_at = time.monotonic()
+
+
+class AIScheduler:
+    """Kolejka priorytetowa z limitami QPS i tokenów oraz sprawiedliwym podziałem między użytkowników."""
+
+    def __init__(self, max_qps: float = AI_MAX_QPS, tokens_per_minute: float = AI_TOKENS_PER_MINUTE,
+                 queue_timeout: float = AI_QUEUE_TIMEOUT_SECONDS):
+        self.max_qps = max_qps
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reset_state()
+        self._dispatched = {priority: 0 for priority in Priority}
+        self._timeouts = {priority: 0 for priority in Priority}
+        self._wait_total = {priority: 0.0 for priority in Priority}
+
+    def _reset_state(self):
+        # Na każdy priorytet: użytkownik -> kolejka FIFO jego zapytań (kolejność użytkowników = round-robin)
+        self._queues: List["OrderedDict[str, Deque[_Waiter]]"] = [OrderedDict() for _ in Priority]
+        self._requests_available = max(self.max_qps, 1.0)
+        self._tokens_available = self.tokens_per_minute
+        self._refilled_at = time.monotonic()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    # --- Budżet ---
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._refilled_at
+        self._refilled_at = now
+        self._requests_available = min(max(self.max_qps, 1.0), self._requests_available + elapsed * self.max_qps)
+        self._tokens_available = min(self.tokens_per_minute, self._tokens_available + elapsed * self.tokens_per_minute / 60.0)
+
+    def _wait_time(self, cost: float) -> float:
+        """Czas do uzbierania budżetu na zapytanie o koszcie `cost`."""
+        request_wait = max(0.0, 1.0 - self._requests_available) / self.max_qps
+        token_wait = max(0.0, cost - self._tokens_available) / (self.tokens_per_minute / 60.0)
+        return max(request_wait, token_wait)
+
+    def _consume(self, cost: float):
+        self._requests_available -= 1.0
+        self._tokens_available -= cost
+
+    def record_usage(self, estimated_tokens: int, actual_tokens: int):
+        """Koryguje budżet po otrzymaniu odpowiedzi (różnica między szacunkiem a faktycznym zużyciem)."""
+        self._tokens_available -= actual_tokens - estimated_tokens
+
+    # --- Kolejkowanie ---
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # Nowa pętla zdarzeń (np. kolejne asyncio.run w skrypcie) - przyszłości ze starej pętli są bezużyteczne
+            self._loop = loop
+            self._reset_state()
+        return loop
+
+    def _has_waiters(self) -> bool:
+        return any(self._queues)
+
+    def _peek(self):
+        """Zwraca (priorytet, użytkownik, oczekujący) dla następnego zapytania, pomijając anulowane."""
+        for priority, users in enumerate(self._queues):
+            while users:
+                user, queue = next(iter(users.items()))
+                while queue and queue[0].future.done():
+                    queue.popleft()
+                if not queue:
+                    del users[user]
+                    continue
+                return priority, user, queue[0]
+        return None
+
+    def _dispatch(self):
+        self._timer = None
+        self._refill()
+        while True:
+            head = self._peek()
+            if head is None:
+                return
+            priority, user, waiter = head
+            cost = min(waiter.cost, self.tokens_per_minute)
+            wait = self._wait_time(cost)
+            if wait > 0:
+                self._timer = self._loop.call_later(wait, self._dispatch)
+                return
+            users = self._queues[priority]
+            users[user].popleft()
+            if users[user]:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            self._consume(cost)
+            self._record_dispatch(Priority(priority), time.monotonic() - waiter.enqueued_at)
+            waiter.future.set_result(None)
+
+    def _record_dispatch(self, priority: Priority, waited: float):
+        self._dispatched[priority] += 1
+        self._wait_total[priority] += waited
+
+    @asynccontextmanager
+    async def slot(self, call_site: str, estimated_tokens: int):
+        """Czeka na swoją kolej i budżet, a następnie przepuszcza jedno wywołanie modelu."""
+        loop = self._bind_loop()
+        priority = priority_for(call_site)
+        cost = min(float(estimated_tokens), self.tokens_per_minute)
+        self._refill()
+        if not self._has_waiters() and self._wait_time(cost) == 0:
+            # Ścieżka szybka - brak kolejki i wolny budżet
+            self._consume(cost)
+            self._record_dispatch(priority, 0.0)
+        else:
+            waiter = _Waiter(loop.create_future(), cost)
+            self._queues[priority].setdefault(_current_user.get(), deque()).append(waiter)
+            if self._timer is None:
+                self._dispatch()
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter.future), timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                if waiter.future.done():
+                    pass  # Przydzielono w ostatniej chwili
+                else:
+                    waiter.future.cancel()
+                    self._timeouts[priority] += 1
+                    raise AIQueueTimeout(f"Przekroczono czas oczekiwania w kolejce AI ({call_site}).")
+            except asyncio.CancelledError:
+                waiter.future.cancel()
+                raise
+        yield
+
+    # --- Metryki ---
+
+    def metrics(self) -> Dict[str, Any]:
+        if self._loop is not None and not self._loop.is_closed():
+            self._refill()
+        depth, users = {}, set()
+        for priority in Priority:
+            queues = self._queues[priority]
+            depth[priority.name.lower()] = sum(1 for queue in queues.values() for waiter in queue if not waiter.future.done())
+            users.update(queues)
+        return {
+            "queue_depth": depth,
+            "queued_users": len(users),
+            "dispatched": {priority.name.lower(): count for priority, count in self._dispatched.items()},
+            "queue_timeouts": {priority.name.lower(): count for priority, count in self._timeouts.items()},
+            "avg_wait_ms": {
+                priority.name.lower(): round(1000 * self._wait_total[priority] / self._dispatched[priority], 1) if self._dispatched[priority] else 0.0
+                for priority in Priority
+            },
+            "qps_available": round(self._requests_available, 2),
+            "tokens_available": round(self._tokens_available),
+            "limits": {"max_qps": self.max_qps, "tokens_per_minute": self.tokens_per_minute},
+        }
+
+
+# Jedna instancja na proces
+scheduler = AIScheduler()
@@ -0,0 +1,189 @@
+"""
+Moduł odpowiedzialny za lokalną, deterministyczną weryfikację wyzwań.
+
+Ten plik zawiera:
+1.  Zbiorcze ładowanie "dowodów" dla wielu użytkowników naraz: dzienne sumy posiłków wg kategorii,
+    liczby treningów i spalone kalorie na dzień (z tabeli `daily_totals`) oraz cele kaloryczne (trzy zapytania na partię).
+2.  Reguły przypisane do id wyzwania z `challenges_database`. Reguła zwraca:
+    - True / False, gdy wynik da się ustalić z zapisanych danych,
+    - None, gdy dane spełniają warunki konieczne, ale ocena wymaga interpretacji nazw produktów
+      lub treningów - wtedy o wyniku decyduje AI.
+    Wyzwania bez reguły zawsze trafiają do AI.
+
+Dni wyzwania to `duration_days` dni od `start_date` (czyli do dnia poprzedzającego `end_date`).
+Treningi nie mają zapisanego czasu trwania, więc reguły aktywności sprawdzają tylko liczbę i dni treningów;
+wymagania dotyczące czasu lub rodzaju aktywności ocenia AI.
+"""
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy.orm import Session
+
+from . import crud, utils
+from .enums import MealCategory
+
+BREAKFAST_PROTEIN_G = 20
+MEALS_PER_DAY = 5
+
+
+@dataclass
+class MealTotals:
+    entries: int
+    calories: float
+    protein: float
+
+
+@dataclass
+class UserEvidence:
+    """Zagregowany dziennik jednego użytkownika: dzień -> kategoria -> sumy oraz dzień -> liczba treningów i spalone kalorie."""
+    calorie_goal: Optional[int] = None
+    add_workout_calories_to_goal: bool = False
+    meals: Dict[date, Dict[MealCategory, MealTotals]] = field(default_factory=dict)
+    workouts: Dict[date, int] = field(default_factory=dict)
+    calories_burned: Dict[date, int] = field(default_factory=dict)
+
+    def workout_days(self, days: List[date]) -> int:
+        return sum(1 for day in days if self.workouts.get(day, 0) > 0)
+
+    def workout_count(self, days: List[date]) -> int:
+        return sum(self.workouts.get(day, 0) for day in days)
+
+    def calorie_goal_on(self, day: date) -> int:
+        """Cel dnia liczony tak samo jak na pulpicie (`utils.effective_calorie_goal`)."""
+        return utils.effective_calorie_goal(self.calorie_goal, self.add_workout_calories_to_goal, self.calories_burned.get(day, 0))
+
+
+Rule = Callable[[UserEvidence, List[date]], Optional[bool]]
+
+
+def challenge_days(start_date: date, end_date: date) -> List[date]:
+    return [start_date + timedelta(days=offset) for offset in range(max((end_date - start_date).days, 1))]
+
+
+def load_evidence(db: Session, user_ids: List[int], start_date: date, end_date: date) -> Dict[int, UserEvidence]:
+    """Ładuje dowody dla wielu użytkowników trzema zapytaniami agregującymi."""
+    evidence = {
+        user_id: UserEvidence(calorie_goal=goal, add_workout_calories_to_goal=add_workout_calories)
+        for user_id, (goal, add_workout_calories) in crud.get_calorie_goal_settings(db, user_ids).items()
+    }
+    for owner_id, day, category, entries, calories, protein in crud.get_meal_aggregates_for_users(db, user_ids, start_date, end_date):
+        user_evidence = evidence.setdefault(owner_id, UserEvidence())
+        user_evidence.meals.setdefault(day, {})[category] = MealTotals(entries, calories or 0.0, protein or 0.0)
+    for owner_id, day, count, calories_burned in crud.get_workout_totals_for_users(db, user_ids, start_date, end_date):
+        user_evidence = evidence.setdefault(owner_id, UserEvidence())
+        user_evidence.workouts[day] = count
+        user_evidence.calories_burned[day] = calories_burned or 0
+    return evidence
+
+
+# --- Reguły dietetyczne ---
+
+def _protein_breakfast(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+    """Białkowe śniadanie: każdego dnia co najmniej 20 g białka w kategorii Śniadanie."""
+    for day in days:
+        breakfast = evidence.meals.get(day, {}).get(MealCategory.SNIADANIE)
+        if breakfast is None or breakfast.protein < BREAKFAST_PROTEIN_G:
+            return False
+    return True
+
+
+def _calorie_control(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+    """
+    Pełna kontrola kalorii: każdego dnia zapisane posiłki i suma nieprzekraczająca celu dnia.
+    Bez ustawionego celu kalorycznego reguła nie rozstrzyga - decyduje AI.
+    """
+    if not evidence.calorie_goal:
+        return None
+    for day in days:
+        categories = evidence.meals.get(day)
+        if not categories or sum(totals.calories for totals in categories.values()) > evidence.calorie_goal_on(day):
+            return False
+    return True
+
+
+def _five_meals_every_day(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+    """5 porcji warzyw: warunek konieczny to pięć posiłków każdego dnia; obecność warzyw ocenia AI."""
+    if any(len(evidence.meals.get(day, {})) < MEALS_PER_DAY for day in days):
+        return False
+    return None
+
+
+def _min_meal_days(required: int) -> Rule:
+    def rule(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+        return False if sum(1 for day in days if evidence.meals.get(day)) < required else None
+    return rule
+
+
+# --- Reguły aktywności ---
+
+def _workout_every_day_then_ai(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+    """Codzienna aktywność (konkretnego rodzaju lub czasu trwania): brak treningu w którymkolwiek dniu przesądza o porażce."""
+    return False if evidence.workout_days(days) < len(days) else None
+
+
+def _min_workouts(required: int) -> Rule:
+    def rule(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+        return False if evidence.workout_count(days) < required else None
+    return rule
+
+
+def _min_workout_days(required: int) -> Rule:
+    def rule(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+        return False if evidence.workout_days(days) < required else None
+    return rule
+
+
+def _active_weekend(evidence: UserEvidence, days: List[date]) -> Optional[bool]:
+    """Aktywny weekend: trening w każdą sobotę i niedzielę w okresie wyzwania."""
+    weekend = [day for day in days if day.weekday() >= 5]
+    return False if not weekend or evidence.workout_days(weekend) < len(weekend) else None
+
+
+RULES: Dict[int, Rule] = {
+    2: _five_meals_every_day,
+    3: _protein_breakfast,
+    8: _min_meal_days(4),
+    30: _calorie_control,
+    31: _workout_every_day_then_ai,
+    32: _min_workouts(3),
+    33: _min_workouts(4),
+    35: _min_workouts(1),
+    36: _min_workouts(3),
+    37: _min_workouts(2),
+    38: _workout_every_day_then_ai,
+    39: _active_weekend,
+    40: _min_workouts(1),
+    41: _min_workouts(2),
+    42: _min_workouts(3),
+    43: _min_workouts(4),
+    44: _min_workouts(1),
+    45: _workout_every_day_then_ai,
+    46: _min_workouts(2),
+    47: _min_workouts(2),
+    48: _min_workouts(2),
+    49: _min_workout_days(5),
+    50: _min_workouts(3),
+    51: _min_workouts(1),
+    52: _min_workouts(3),
+    53: _min_workouts(1),
+    54: _min_workouts(1),
+    55: _min_workouts(4),
+    56: _min_workouts(1),
+    57: _min_workouts(3),
+    58: _workout_every_day_then_ai,
+    59: _min_workouts(1),
+    60: _workout_every_day_then_ai,
+}
+
+
+def has_rule(challenge_id: int) -> bool:
+    return challenge_id in RULES
+
+
+def evaluate(challenge_id: int, evidence: UserEvidence, start_date: date, end_date: date) -> Optional[bool]:
+    """Zwraca wynik reguły lub None, jeśli wyzwanie nie ma reguły albo wymaga oceny przez AI."""
+    rule = RULES.get(challenge_id)
+    if rule is None:
+        return None
+    return rule(evidence, challenge_days(start_date, end_date))
@@ -0,0 +1,151 @@
+"""
+Moduł odpowiedzialny za zbiorczą weryfikację zakończonych wyzwań.
+
+Ten plik zawiera:
+1.  Ładowanie aktywnych wyzwań po terminie i dzienników ich uczestników partiami (jedno zapytanie na kategorię).
+2.  Rozstrzyganie regułami lokalnymi (`challenge_rules`), a pozostałych wyzwań - przez AI z ograniczoną współbieżnością.
+3.  Zapis statusów jedną transakcją na partię.
+
+Używany przez endpoint `/api/challenges/challenges/verify` oraz zadanie cykliczne w `jobs`.
+
+Konfiguracja przez zmienne środowiskowe:
+- CHALLENGE_VERIFY_CONCURRENCY: liczba równoczesnych weryfikacji przez AI (domyślnie 8),
+- CHALLENGE_VERIFY_BATCH_SIZE: liczba wyzwań w jednej partii (domyślnie 500).
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import date
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import ai_analyzer, ai_scheduler, challenge_rules, challenges_database, crud
+from .db import run_in_session
+from .enums import ChallengeStatus
+
+# Liczba równoczesnych weryfikacji przez AI i liczba wyzwań ładowanych/zapisywanych w jednej partii
+CHALLENGE_VERIFY_CONCURRENCY = int(os.getenv("CHALLENGE_VERIFY_CONCURRENCY", "8"))
+CHALLENGE_VERIFY_BATCH_SIZE = int(os.getenv("CHALLENGE_VERIFY_BATCH_SIZE", "500"))
+
+class _PendingChallenge(NamedTuple):
+    id: int
+    user_id: int
+    challenge_id: int
+    start_date: date
+    end_date: date
+
+def _load_challenges_to_verify(db: Session, ended_after: Optional[date] = None) -> List[_PendingChallenge]:
+    return [
+        _PendingChallenge(uc.id, uc.user_id, uc.challenge_id, uc.start_date, uc.end_date)
+        for uc in crud.get_active_challenges_to_verify(db, ended_after=ended_after)
+    ]
+
+def _load_logs_for_batch(db: Session, batch: List[_PendingChallenge]) -> Dict[str, Dict[int, List[Tuple[date, str]]]]:
+    """Ładuje dzienniki dla całej partii: jedno zapytanie na kategorię zamiast jednego na wyzwanie."""
+    by_category: Dict[str, List[_PendingChallenge]] = {}
+    for item in batch:
+        challenge_info = challenges_database.get_challenge_by_id(item.challenge_id)
+        if challenge_info:
+            by_category.setdefault(challenge_info['category'], []).append(item)
+
+    loaders = {'dieta': crud.get_diet_logs_for_users, 'aktywność': crud.get_workout_logs_for_users}
+    logs = {}
+    for category, items in by_category.items():
+        if category in loaders:
+            user_ids = list({item.user_id for item in items})
+            start_date = min(item.start_date for item in items)
+            end_date = max(item.end_date for item in items)
+            logs[category] = loaders[category](db, user_ids, start_date, end_date)
+    return logs
+
+def _prepare_batch(db: Session, batch: List[_PendingChallenge]) -> Tuple[Dict[int, bool], Dict[str, Dict[int, List[Tuple[date, str]]]]]:
+    """Rozstrzyga wyzwania regułami lokalnymi, a dzienniki ładuje tylko dla tych, które wymagają oceny przez AI."""
+    verdicts: Dict[int, bool] = {}
+    ruled = [item for item in batch if challenge_rules.has_rule(item.challenge_id)]
+    if ruled:
+        evidence = challenge_rules.load_evidence(
+            db, list({item.user_id for item in ruled}),
+            min(item.start_date for item in ruled), max(item.end_date for item in ruled),
+        )
+        for item in ruled:
+            user_evidence = evidence.get(item.user_id, challenge_rules.UserEvidence())
+            verdict = challenge_rules.evaluate(item.challenge_id, user_evidence, item.start_date, item.end_date)
+            if verdict is not None:
+                verdicts[item.id] = verdict
+    return verdicts, _load_logs_for_batch(db, [item for item in batch if item.id not in verdicts])
+
+async def _verify_challenge(item: _PendingChallenge, challenge_info: dict, logs: List[str], semaphore: asyncio.Semaphore) -> Optional[ChallengeStatus]:
+    async with semaphore:
+        try:
+            ai_scheduler.bind_user(item.user_id)
+            is_completed = await ai_analyzer.verify_challenge_completion(challenge_title=challenge_info['title'], challenge_description=challenge_info['description'], user_logs=logs, category=challenge_info['category'])
+        except Exception as e:
+            logging.error(f"Error verifying challenge {item.id}: {e}", exc_info=True)
+            return None
+    return ChallengeStatus.COMPLETED if is_completed else ChallengeStatus.FAILED
+
+async def verify_ended_challenges_task(ended_after: Optional[date] = None) -> Dict[str, int]:
+    """
+    Weryfikuje aktywne wyzwania, których termin minął (opcjonalnie tylko zakończone po `ended_after`).
+    Zwraca liczniki: zweryfikowane, ukończone, nieudane, błędy.
+    """
+    logging.info("Starting independent background challenge verification task...")
+    started_at = time.monotonic()
+    processed, by_rules, counts = 0, 0, {ChallengeStatus.COMPLETED: 0, ChallengeStatus.FAILED: 0, None: 0}
+    try:
+        pending = await run_in_session(_load_challenges_to_verify, ended_after)
+        if not pending:
+            logging.info("No challenges found to verify. Task finished.")
+            return {"processed": 0, "completed": 0, "failed": 0, "errors": 0}
+        total = len(pending)
+        logging.info(f"Found {total} challenges to verify.")
+
+        semaphore = asyncio.Semaphore(CHALLENGE_VERIFY_CONCURRENCY)
+        for offset in range(0, total, CHALLENGE_VERIFY_BATCH_SIZE):
+            batch = pending[offset:offset + CHALLENGE_VERIFY_BATCH_SIZE]
+            verdicts, logs_by_category = await run_in_session(_prepare_batch, batch)
+
+            statuses: Dict[int, ChallengeStatus] = {}
+            verified_ids, tasks = [], []
+            for item in batch:
+                challenge_info = challenges_database.get_challenge_by_id(item.challenge_id)
+                if not challenge_info:
+                    logging.warning(f"Could not find info for challenge_id: {item.challenge_id}. Skipping.")
+                    continue
+                if item.id in verdicts:
+                    statuses[item.id] = ChallengeStatus.COMPLETED if verdicts[item.id] else ChallengeStatus.FAILED
+                    counts[statuses[item.id]] += 1
+                    by_rules += 1
+                    continue
+                user_logs = logs_by_category.get(challenge_info['category'], {}).get(item.user_id, [])
+                logs = [name for log_date, name in user_logs if item.start_date <= log_date <= item.end_date]
+                verified_ids.append(item.id)
+                tasks.append(_verify_challenge(item, challenge_info, logs, semaphore))
+            results = await asyncio.gather(*tasks)
+
+            # Jedna transakcja na partię; wyzwania z błędem zostają aktywne i wrócą w kolejnym przebiegu
+            statuses.update({user_challenge_id: status for user_challenge_id, status in zip(verified_ids, results) if status is not None})
+            if statuses:
+                await run_in_session(crud.update_user_challenge_statuses, statuses)
+            for status in results:
+                counts[status] += 1
+
+            processed += len(batch)
+            elapsed = time.monotonic() - started_at
+            logging.info(
+                f"Verified {processed}/{total} challenges in {elapsed:.1f}s ({processed / elapsed:.1f}/s) - "
+                f"completed: {counts[ChallengeStatus.COMPLETED]}, failed: {counts[ChallengeStatus.FAILED]}, errors: {counts[None]}, "
+                f"decided by rules: {by_rules}"
+            )
+    except Exception as e:
+        logging.error(f"A critical error occurred in the verification task: {e}", exc_info=True)
+        counts[None] += 1
+    logging.info(f"Challenge verification task finished in {time.monotonic() - started_at:.1f}s.")
+    return {
+        "processed": processed,
+        "completed": counts[ChallengeStatus.COMPLETED],
+        "failed": counts[ChallengeStatus.FAILED],
+        "errors": counts[None],
+    }
@@ -1,5 +1,9 @@
+import hashlib
+import json
 import random
-from datetime import datetime
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Tuple
 
 # Duża, statyczna lista wszystkich możliwych wyzwań w aplikacji
 ALL_CHALLENGES = [
@@ -425,31 +429,68 @@ ALL_CHALLENGES = [
   }
 ]
 
+class ChallengeCatalog:
+    """
+    Katalog wyzwań z indeksami po id i kategorii.
+    Tygodniowe losowanie jest liczone raz na tydzień ISO prywatnym generatorem liczb losowych
+    (bez ingerencji w globalny `random`), a jego odpowiedź JSON i ETag są przechowywane do końca tygodnia.
+    """
+
+    def __init__(self, challenges: List[dict], weekly_count: int = 3):
+        self.challenges = challenges
+        self.weekly_count = weekly_count
+        self._by_id = {challenge['id']: challenge for challenge in challenges}
+        self._by_category: Dict[str, List[dict]] = {}
+        for challenge in challenges:
+            self._by_category.setdefault(challenge['category'], []).append(challenge)
+        self._lock = threading.Lock()
+        self._weekly_key: Optional[Tuple[int, int]] = None
+        self._weekly: List[dict] = []
+        self._weekly_body = b""
+        self._weekly_etag = ""
+
+    def get(self, challenge_id: int) -> Optional[dict]:
+        return self._by_id.get(challenge_id)
+
+    def by_category(self, category: str) -> List[dict]:
+        return list(self._by_category.get(category, []))
+
+    def _ensure_weekly(self, today: date):
+        year, week, _ = today.isocalendar()
+        if self._weekly_key == (year, week):
+            return
+        with self._lock:
+            if self._weekly_key == (year, week):
+                return
+            # Ziarno z roku i tygodnia - wybór jest taki sam przez cały tydzień i we wszystkich procesach
+            rng = random.Random(f"{year}-{week}")
+            weekly = list(self.challenges) if len(self.challenges) < self.weekly_count else rng.sample(self.challenges, self.weekly_count)
+            body = json.dumps(weekly, ensure_ascii=False).encode("utf-8")
+            self._weekly, self._weekly_body = weekly, body
+            self._weekly_etag = f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+            self._weekly_key = (year, week)
+
+    def weekly(self, today: Optional[date] = None) -> List[dict]:
+        self._ensure_weekly(today or date.today())
+        return self._weekly
+
+    def weekly_response(self, today: Optional[date] = None) -> Tuple[bytes, str]:
+        """Zwraca zserializowane wyzwania tygodnia i ich ETag."""
+        self._ensure_weekly(today or date.today())
+        return self._weekly_body, self._weekly_etag
+
+
+catalog = ChallengeCatalog(ALL_CHALLENGES)
+
+
 def get_challenge_by_id(challenge_id: int):
     """
     Wyszukuje i zwraca jedno wyzwanie z listy na podstawie jego ID.
     """
-    for challenge in ALL_CHALLENGES:
-        if challenge['id'] == challenge_id:
-            return challenge
-    return None
+    return catalog.get(challenge_id)
 
 def get_all_challenges():
     """
     Zwraca 3 losowe wyzwania. Wybór jest stały dla danego tygodnia kalendarzowego.
     """
-    # Używamy numeru roku i tygodnia jako "ziarna" dla generatora liczb losowych.
-    # To gwarantuje, że przez cały tydzień wyniki losowania będą takie same.
-    today = datetime.today()
-    year, week, _ = today.isocalendar()
-    
-    # Ustawiamy ziarno na podstawie roku i tygodnia
-    random.seed(f"{year}-{week}")
-    
-    # Jeśli z jakiegoś powodu mamy mniej niż 3 wyzwania, zwróćmy wszystkie.
-    if len(ALL_CHALLENGES) < 3:
-        return ALL_CHALLENGES
-        
-    # Losujemy 3 unikalne wyzwania z całej puli
-    return random.sample(ALL_CHALLENGES, 3)
-
+    return catalog.weekly()
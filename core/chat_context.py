@@ -0,0 +1,153 @@
+"""
+Moduł odpowiedzialny za dzienny kontekst użytkownika dla AI Trenera.
+
+Ten plik zawiera:
+1.  Migawkę kontekstu (`DailyContext`): cele użytkownika, dzisiejsze spożycie (kalorie i makroskładniki),
+    wodę, spalone kalorie oraz listę zapisanych dziś produktów, wraz z gotowym fragmentem promptu.
+2.  Cache migawek w pamięci procesu, kluczowany (użytkownik, dzień), dzięki któremu seria wiadomości
+    na czacie nie odpytuje dziennika przy każdej wiadomości.
+3.  Unieważnianie: funkcje `invalidate_user` i `invalidate_meal` wywoływane przez operacje zapisu w `crud`
+    (posiłki, wpisy, woda, treningi, profil użytkownika).
+
+Konfiguracja przez zmienne środowiskowe:
+- CHAT_CONTEXT_TTL_SECONDS: maksymalny wiek migawki (domyślnie 600 s) - zabezpieczenie na wypadek zapisów
+  wykonanych poza `crud` lub w innym procesie.
+"""
+import os
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+
+CHAT_CONTEXT_TTL_SECONDS = float(os.getenv("CHAT_CONTEXT_TTL_SECONDS", "600"))
+
+
+@dataclass
+class DailyContext:
+    """Migawka dnia użytkownika używana w promptach czatu."""
+    user_id: int
+    day: date
+    calorie_goal: int
+    protein_goal: int
+    fat_goal: int
+    carb_goal: int
+    water_goal: int
+    calories: float
+    protein: float
+    fat: float
+    carbs: float
+    water_ml: int
+    calories_burned: int
+    foods: List[str]
+    meal_ids: FrozenSet[int] = field(default_factory=frozenset)
+    built_at: float = field(default_factory=time.monotonic)
+
+    def to_prompt(self) -> str:
+        foods = ", ".join(self.foods) if self.foods else "brak wpisów"
+        return (
+            f"Cele dzienne: {self.calorie_goal} kcal, białko {self.protein_goal} g, tłuszcze {self.fat_goal} g, "
+            f"węglowodany {self.carb_goal} g, woda {self.water_goal} ml. "
+            f"Dzisiaj spożyto: {round(self.calories)} kcal, białko {round(self.protein)} g, tłuszcze {round(self.fat)} g, "
+            f"węglowodany {round(self.carbs)} g, woda {self.water_ml} ml; spalono {self.calories_burned} kcal na treningach. "
+            f"Dzisiejsze posiłki użytkownika: {foods}."
+        )
+
+
+def build_daily_context(db: Session, user: models.User, day: date) -> DailyContext:
+    """Buduje migawkę trzema zapytaniami agregującymi (bez ładowania obiektów posiłków)."""
+    entries = (
+        db.query(models.MealEntry.meal_id, models.MealEntry.product_name, models.MealEntry.calories,
+                 models.MealEntry.protein, models.MealEntry.fat, models.MealEntry.carbs)
+        .join(models.Meal, models.Meal.id == models.MealEntry.meal_id)
+        .filter(models.Meal.owner_id == user.id, models.Meal.date == day)
+        .order_by(models.Meal.time, models.MealEntry.id)
+        .all()
+    )
+    meal_ids = db.query(models.Meal.id).filter(models.Meal.owner_id == user.id, models.Meal.date == day).all()
+    water_ml = db.query(func.coalesce(func.sum(models.WaterEntry.amount), 0)).filter(
+        models.WaterEntry.owner_id == user.id, models.WaterEntry.date == day
+    ).scalar()
+    calories_burned = db.query(func.coalesce(func.sum(models.Workout.calories_burned), 0)).filter(
+        models.Workout.owner_id == user.id, models.Workout.date == day
+    ).scalar()
+
+    return DailyContext(
+        user_id=user.id,
+        day=day,
+        calorie_goal=user.calorie_goal,
+        protein_goal=user.protein_goal,
+        fat_goal=user.fat_goal,
+        carb_goal=user.carb_goal,
+        water_goal=user.water_goal,
+        calories=sum(entry.calories or 0 for entry in entries),
+        protein=sum(entry.protein or 0 for entry in entries),
+        fat=sum(entry.fat or 0 for entry in entries),
+        carbs=sum(entry.carbs or 0 for entry in entries),
+        water_ml=int(water_ml),
+        calories_burned=int(calories_burned),
+        foods=[entry.product_name for entry in entries],
+        meal_ids=frozenset(meal_id for (meal_id,) in meal_ids),
+    )
+
+
+class DailyContextCache:
+    """Cache migawek kontekstu w pamięci procesu."""
+
+    def __init__(self, ttl: float = CHAT_CONTEXT_TTL_SECONDS):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshots: Dict[Tuple[int, date], DailyContext] = {}
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, db: Session, user: models.User, day: Optional[date] = None) -> DailyContext:
+        """Zwraca migawkę z cache lub buduje nową. Funkcja blokująca - w kodzie async wywoływać przez `run_db`."""
+        day = day or date.today()
+        key = (user.id, day)
+        with self._lock:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and time.monotonic() - snapshot.built_at < self.ttl:
+                self._hits += 1
+                return snapshot
+            self._misses += 1
+
+        snapshot = build_daily_context(db, user, day)
+        with self._lock:
+            # Migawki z poprzednich dni nie będą już potrzebne
+            for stale_key in [k for k in self._snapshots if k[0] == user.id and k[1] != day]:
+                del self._snapshots[stale_key]
+            self._snapshots[key] = snapshot
+        return snapshot
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for key in [k for k in self._snapshots if k[0] == user_id]:
+                del self._snapshots[key]
+
+    def invalidate_meal(self, meal_id: int):
+        """Unieważnia migawki, które obejmują dany posiłek (zapis wpisu bez znajomości właściciela)."""
+        with self._lock:
+            for key in [k for k, snapshot in self._snapshots.items() if meal_id in snapshot.meal_ids]:
+                del self._snapshots[key]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"snapshots": len(self._snapshots), "hits": self._hits, "misses": self._misses}
+
+
+# Jedna instancja na proces
+daily_context = DailyContextCache()
+
+
+def invalidate_user(user_id: int):
+    daily_context.invalidate_user(user_id)
+
+
+def invalidate_meal(meal_id: int):
+    daily_context.invalidate_meal(meal_id)
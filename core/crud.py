@@ -1,12 +1,15 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
+from sqlalchemy.orm import Session, joinedload, selectinload
+from sqlalchemy import Float, Integer, column, func, insert, literal, or_, select, table, text, union_all
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.attributes import flag_modified # Upewnij się, że masz ten import
 from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
 import json
 
-from . import models, schemas
+from . import chat_context, models, schemas, search_index
 from .security import get_password_hash
-from .enums import ChallengeStatus, FriendshipStatus, SubscriptionStatus
+from .food_index import food_index, normalize_key
+from .enums import ChallengeStatus, FriendshipStatus, SubscriptionStatus, ProductState
 
 # --- User Operations ---
 
@@ -54,6 +57,7 @@ def update_user(db: Session, db_user: models.User, user_update: schemas.UserUpda
         setattr(db_user, key, value)
     db.commit()
     db.refresh(db_user)
+    chat_context.invalidate_user(db_user.id)
     return db_user
 
 def delete_user(db: Session, user_id: int) -> bool:
@@ -62,6 +66,7 @@ def delete_user(db: Session, user_id: int) -> bool:
     if db_user:
         db.delete(db_user)
         db.commit()
+        chat_context.invalidate_user(user_id)
         return True
     return False
 
@@ -71,42 +76,190 @@ def get_product_by_name(db: Session, name: str):
     """Wyszukuje produkt podstawowy po jego unikalnej nazwie (ignoruje wielkość liter)."""
     return db.query(models.Product).filter(func.lower(models.Product.name) == func.lower(name)).first()
 
+def get_products_by_ids(db: Session, product_ids: List[int]) -> Dict[int, models.Product]:
+    """Pobiera wiele produktów jednym zapytaniem po kluczu głównym."""
+    if not product_ids:
+        return {}
+    products = db.query(models.Product).filter(models.Product.id.in_(set(product_ids))).all()
+    return {product.id: product for product in products}
+
 def create_product(db: Session, product: schemas.ProductCreate) -> models.Product:
     """Tworzy nowy produkt podstawowy w bazie."""
     db_product = models.Product(**product.model_dump())
     db.add(db_product)
     db.commit()
     db.refresh(db_product)
+    food_index.add_product(db_product)
     return db_product
 
+def _find_product_for_upsert(db: Session, name: str):
+    """Szuka istniejącego produktu po nazwie - najpierw w indeksie, potem dokładnym zapytaniem."""
+    product_id = food_index.find_product_id(db, name)
+    if product_id is not None:
+        db_product = db.get(models.Product, product_id)
+        if db_product:
+            return db_product
+    return db.query(models.Product).filter(models.Product.name == name).first()
+
+def _merge_product(db_product: models.Product, data: dict):
+    """Scala dane nowego produktu z istniejącym rekordem."""
+    aliases = list(db_product.aliases or [])
+    for alias in data.get("aliases") or []:
+        if alias not in aliases:
+            aliases.append(alias)
+    db_product.aliases = aliases
+    flag_modified(db_product, "aliases")
+    # Istniejące wartości odżywcze nadpisujemy tylko, jeśli rekord jest symbolem zastępczym (same zera)
+    if not any((db_product.nutrients or {}).values()):
+        db_product.nutrients = data["nutrients"]
+        db_product.state = data["state"]
+        db_product.average_weight_g = data.get("average_weight_g")
+        return True
+    return False
+
+def upsert_product(db: Session, product: schemas.ProductCreate) -> models.Product:
+    """Tworzy produkt lub scala go z istniejącym o tej samej nazwie (bez błędu unikalności)."""
+    data = product.model_dump()
+    db_product = _find_product_for_upsert(db, product.name)
+    if db_product:
+        if _merge_product(db_product, data):
+            refresh_dishes_using_products(db, [db_product.id])
+        db.commit()
+    else:
+        db_product = models.Product(**data)
+        db.add(db_product)
+        try:
+            db.commit()
+        except IntegrityError:
+            # Ten sam produkt został zapisany w międzyczasie przez inne zapytanie
+            db.rollback()
+            db_product = db.query(models.Product).filter(models.Product.name == product.name).one()
+            if _merge_product(db_product, data):
+                refresh_dishes_using_products(db, [db_product.id])
+            db.commit()
+    db.refresh(db_product)
+    food_index.add_product(db_product)
+    return db_product
+
+def upsert_products(db: Session, products: List[schemas.ProductCreate]) -> List[models.Product]:
+    """Zapisuje wiele produktów (upsert) w jednej transakcji."""
+    db_products = []
+    pending = {}
+    changed_ids = []
+    for product in products:
+        data = product.model_dump()
+        key = normalize_key(product.name)
+        db_product = pending.get(key) or _find_product_for_upsert(db, product.name)
+        if db_product:
+            if _merge_product(db_product, data) and db_product.id is not None:
+                changed_ids.append(db_product.id)
+        else:
+            db_product = models.Product(**data)
+            db.add(db_product)
+        pending[key] = db_product
+        db_products.append(db_product)
+    try:
+        if changed_ids:
+            refresh_dishes_using_products(db, changed_ids)
+        db.commit()
+    except IntegrityError:
+        # Konflikt z równoległym zapisem - wracamy do zapisu produkt po produkcie
+        db.rollback()
+        return [upsert_product(db, product) for product in products]
+    for db_product in db_products:
+        db.refresh(db_product)
+        food_index.add_product(db_product)
+    return db_products
+
 def get_dish_by_name(db: Session, name: str):
     """Wyszukuje danie po jego unikalnej nazwie (ignoruje wielkość liter)."""
     return db.query(models.Dish).filter(func.lower(models.Dish.name) == func.lower(name)).first()
 
 def create_dish_with_ingredients(db: Session, dish: schemas.DishCreate) -> models.Dish:
-    """Tworzy nowe danie i jego powiązania ze składnikami."""
+    """Tworzy nowe danie i jego powiązania ze składnikami w jednej transakcji."""
     db_dish = models.Dish(name=dish.name, category=dish.category, aliases=dish.aliases)
     db.add(db_dish)
-    db.commit()
-    db.refresh(db_dish)
 
+    placeholders = {}
     for ing in dish.ingredients:
-        db_product = get_product_by_name(db, name=ing.product_name)
+        # Składniki rozwiązujemy przez indeks nazw zamiast osobnego zapytania dla każdego z nich
+        product_id = food_index.find_product_id(db, ing.product_name)
+        if product_id is not None:
+            db_dish.ingredients.append(models.DishIngredient(product_id=product_id, weight_g=ing.weight_g))
+            continue
         # Jeśli produkt składnika nie istnieje, utwórz dla niego symbol zastępczy
-        if not db_product:
-            placeholder_product = schemas.ProductCreate(
+        key = normalize_key(ing.product_name)
+        if key not in placeholders:
+            placeholders[key] = models.Product(
                 name=ing.product_name,
                 nutrients={"calories": 0, "protein": 0, "fat": 0, "carbs": 0},
                 state=schemas.ProductState.SOLID
             )
-            db_product = create_product(db, placeholder_product)
-        # Utwórz połączenie między daniem a składnikiem
-        db_dish_ingredient = models.DishIngredient(
-            dish_id=db_dish.id, product_id=db_product.id, weight_g=ing.weight_g
-        )
-        db.add(db_dish_ingredient)
+            db.add(placeholders[key])
+        db_dish.ingredients.append(models.DishIngredient(product=placeholders[key], weight_g=ing.weight_g))
+    db.flush()
+    refresh_dish_totals(db, db_dish)
     db.commit()
     db.refresh(db_dish)
+    for db_product in placeholders.values():
+        food_index.add_product(db_product)
+    food_index.add_dish(db_dish)
+    return db_dish
+
+def get_dish_ingredients(db: Session, dish_id: int) -> List[models.DishIngredient]:
+    """Pobiera składniki dania razem z produktami w jednym zapytaniu."""
+    return db.query(models.DishIngredient).options(joinedload(models.DishIngredient.product)).filter(
+        models.DishIngredient.dish_id == dish_id
+    ).order_by(models.DishIngredient.id).all()
+
+def refresh_dish_totals(db: Session, db_dish: models.Dish):
+    """Przelicza zmaterializowane wartości dania (per 100g, waga przepisu, stan). Nie zatwierdza transakcji."""
+    ingredients = get_dish_ingredients(db, db_dish.id)
+    base_weight = sum(ing.weight_g for ing in ingredients if ing.weight_g is not None)
+    totals = {"calories": 0.0, "protein": 0.0, "fat": 0.0, "carbs": 0.0}
+    liquid_weight = 0.0
+    for ing in ingredients:
+        if not ing.product or ing.weight_g is None:
+            continue
+        for key in totals:
+            totals[key] += (ing.product.nutrients or {}).get(key, 0) * ing.weight_g / 100.0
+        if ing.product.state == ProductState.LIQUID:
+            liquid_weight += ing.weight_g
+
+    db_dish.base_weight_g = base_weight
+    db_dish.nutrients_per_100g = {key: value * 100.0 / base_weight for key, value in totals.items()} if base_weight else None
+    db_dish.state = ProductState.LIQUID if base_weight and (liquid_weight / base_weight) > 0.5 else ProductState.SOLID
+
+def refresh_dishes_using_products(db: Session, product_ids: List[int]):
+    """Przelicza dania, w których przepisie występuje któryś z podanych produktów. Nie zatwierdza transakcji."""
+    db.flush()
+    dishes = db.query(models.Dish).join(models.DishIngredient).filter(
+        models.DishIngredient.product_id.in_(product_ids)
+    ).distinct().all()
+    for db_dish in dishes:
+        refresh_dish_totals(db, db_dish)
+
+def upsert_dish_with_ingredients(db: Session, dish: schemas.DishCreate) -> models.Dish:
+    """Tworzy danie z przepisem lub zwraca istniejące o tej samej nazwie, dopisując aliasy."""
+    dish_id = food_index.find_dish_id(db, dish.name)
+    db_dish = db.get(models.Dish, dish_id) if dish_id is not None else None
+    if db_dish is None:
+        db_dish = db.query(models.Dish).filter(models.Dish.name == dish.name).first()
+    if db_dish is None:
+        try:
+            return create_dish_with_ingredients(db, dish)
+        except IntegrityError:
+            db.rollback()
+            db_dish = db.query(models.Dish).filter(models.Dish.name == dish.name).one()
+
+    aliases = list(db_dish.aliases or [])
+    new_aliases = [alias for alias in dish.aliases or [] if alias not in aliases]
+    if new_aliases:
+        db_dish.aliases = aliases + new_aliases
+        flag_modified(db_dish, "aliases")
+        db.commit()
+        db.refresh(db_dish)
+    food_index.add_dish(db_dish)
     return db_dish
 
 # --- NOWE OPERACJE DLA WIELOWĄTKOWEGO CZATU ---
@@ -139,6 +292,33 @@ def add_message_to_conversation(db: Session, conversation_id: int, role: str, co
     db.refresh(db_message)
     return db_message
 
+def get_recent_messages(db: Session, conversation_id: int, limit: int, before_id: Optional[int] = None) -> List[models.ChatMessage]:
+    """Zwraca ostatnie `limit` wiadomości konwersacji (starsze niż `before_id`, jeśli podano) w kolejności chronologicznej."""
+    query = db.query(models.ChatMessage).filter(models.ChatMessage.conversation_id == conversation_id)
+    if before_id is not None:
+        query = query.filter(models.ChatMessage.id < before_id)
+    messages = query.order_by(models.ChatMessage.id.desc()).limit(limit).all()
+    messages.reverse()
+    return messages
+
+def get_messages_between(db: Session, conversation_id: int, after_id: Optional[int], before_id: int, limit: int) -> List[models.ChatMessage]:
+    """Zwraca najstarsze (do `limit`) wiadomości o id z przedziału (after_id, before_id) w kolejności chronologicznej."""
+    query = db.query(models.ChatMessage).filter(
+        models.ChatMessage.conversation_id == conversation_id,
+        models.ChatMessage.id < before_id,
+    )
+    if after_id is not None:
+        query = query.filter(models.ChatMessage.id > after_id)
+    return query.order_by(models.ChatMessage.id.asc()).limit(limit).all()
+
+def update_conversation_summary(db: Session, conversation_id: int, summary: str, summarized_until_id: int):
+    """Zapisuje kroczące streszczenie konwersacji bez zmiany jej znacznika czasu."""
+    db.query(models.Conversation).filter(models.Conversation.id == conversation_id).update(
+        {models.Conversation.summary: summary, models.Conversation.summarized_until_id: summarized_until_id},
+        synchronize_session=False,
+    )
+    db.commit()
+
 # --- Meal Operations ---
 
 def create_user_meal(db: Session, meal: schemas.MealCreate, user_id: int):
@@ -147,6 +327,7 @@ def create_user_meal(db: Session, meal: schemas.MealCreate, user_id: int):
     db.add(db_meal)
     db.commit()
     db.refresh(db_meal)
+    chat_context.invalidate_user(user_id)
     return db_meal
 
 def add_entry_to_meal(db: Session, entry: schemas.MealEntryCreate, meal_id: int):
@@ -162,8 +343,12 @@ def add_entry_to_meal(db: Session, entry: schemas.MealEntryCreate, meal_id: int)
         is_default_quantity=entry.is_default_quantity
     )
     db.add(db_entry)
+    db_meal = db.get(models.Meal, meal_id)
+    if db_meal:
+        refresh_daily_totals(db, db_meal.owner_id, db_meal.date)
     db.commit()
     db.refresh(db_entry)
+    chat_context.invalidate_meal(meal_id)
     return db_entry
 
 # --- ZMIENIONA FUNKCJA ---
@@ -189,20 +374,37 @@ def update_meal_entry(db: Session, entry_id: int, entry_data: schemas.MealEntryC
             # Dla wszystkich innych pól używamy standardowego setattr
             setattr(db_entry, key, value)
     
+    refresh_daily_totals(db, db_entry.meal.owner_id, db_entry.meal.date)
     db.commit()
     db.refresh(db_entry)
+    chat_context.invalidate_meal(db_entry.meal_id)
     return db_entry
 
-def get_meals_by_date(db: Session, user_id: int, target_date: date):
-    """Pobiera posiłki użytkownika z określonej daty."""
-    return db.query(models.Meal).filter(
+def _on_day(column, target_date: date):
+    """
+    Warunek "w danym dniu" jako przedział [dzień, dzień + 1), a nie `func.date(kolumna) == dzień` -
+    kolumna pozostaje nieopakowana, więc zapytanie korzysta z indeksu (owner_id, date).
+    """
+    return column >= target_date, column < target_date + timedelta(days=1)
+
+def _with_entries(lean: bool):
+    """
+    Wpisy posiłków ładowane jednym dodatkowym zapytaniem (SELECT ... IN) zamiast osobno dla każdego posiłku.
+    `lean=True` pomija ciężką kolumnę `deconstruction_details` - dla wywołań, które potrzebują tylko nazw i makro.
+    """
+    entries = selectinload(models.Meal.entries)
+    return entries.defer(models.MealEntry.deconstruction_details) if lean else entries
+
+def get_meals_by_date(db: Session, user_id: int, target_date: date, lean: bool = False):
+    """Pobiera posiłki użytkownika z określonej daty (wraz z wpisami)."""
+    return db.query(models.Meal).options(_with_entries(lean)).filter(
         models.Meal.owner_id == user_id, 
-        func.date(models.Meal.date) == target_date
+        *_on_day(models.Meal.date, target_date)
     ).all()
 
-def get_meals_by_date_range(db: Session, user_id: int, start_date: date, end_date: date):
-    """Pobiera posiłki użytkownika z zadanego okresu."""
-    query = db.query(models.Meal).filter(models.Meal.owner_id == user_id)
+def get_meals_by_date_range(db: Session, user_id: int, start_date: date, end_date: date, lean: bool = False):
+    """Pobiera posiłki użytkownika z zadanego okresu (wraz z wpisami)."""
+    query = db.query(models.Meal).options(_with_entries(lean)).filter(models.Meal.owner_id == user_id)
     query = query.filter(models.Meal.date.between(start_date, end_date))
     return query.order_by(models.Meal.date).all()
 
@@ -211,7 +413,9 @@ def delete_meal(db: Session, meal_id: int, user_id: int):
     db_meal = db.query(models.Meal).filter(models.Meal.id == meal_id, models.Meal.owner_id == user_id).first()
     if db_meal:
         db.delete(db_meal)
+        refresh_daily_totals(db, user_id, db_meal.date)
         db.commit()
+        chat_context.invalidate_user(user_id)
         return True
     return False
 
@@ -222,7 +426,9 @@ def delete_meal_entry(db: Session, entry_id: int, user_id: int):
     ).first()
     if db_entry:
         db.delete(db_entry)
+        refresh_daily_totals(db, user_id, db_entry.meal.date)
         db.commit()
+        chat_context.invalidate_user(user_id)
         return True
     return False
 
@@ -232,15 +438,24 @@ def add_water_entry(db: Session, water_entry: schemas.WaterEntryCreate, user_id:
     """Dodaje wpis o spożyciu wody."""
     db_entry = models.WaterEntry(**water_entry.model_dump(), owner_id=user_id)
     db.add(db_entry)
+    refresh_daily_totals(db, user_id, db_entry.date)
     db.commit()
     db.refresh(db_entry)
+    chat_context.invalidate_user(user_id)
     return db_entry
 
+def get_water_entries_by_date_range(db: Session, user_id: int, start_date: date, end_date: date):
+    """Pobiera wpisy o wodzie z zadanego okresu."""
+    return db.query(models.WaterEntry).filter(
+        models.WaterEntry.owner_id == user_id,
+        models.WaterEntry.date.between(start_date, end_date)
+    ).order_by(models.WaterEntry.date, models.WaterEntry.time).all()
+
 def get_water_entries_by_date(db: Session, user_id: int, target_date: date):
     """Pobiera wpisy o wodzie z określonej daty."""
     return db.query(models.WaterEntry).filter(
         models.WaterEntry.owner_id == user_id, 
-        func.date(models.WaterEntry.date) == target_date
+        *_on_day(models.WaterEntry.date, target_date)
     ).all()
 
 def delete_water_entry(db: Session, water_entry_id: int, user_id: int):
@@ -248,7 +463,9 @@ def delete_water_entry(db: Session, water_entry_id: int, user_id: int):
     db_entry = db.query(models.WaterEntry).filter(models.WaterEntry.id == water_entry_id, models.WaterEntry.owner_id == user_id).first()
     if db_entry:
         db.delete(db_entry)
+        refresh_daily_totals(db, user_id, db_entry.date)
         db.commit()
+        chat_context.invalidate_user(user_id)
         return True
     return False
 
@@ -256,15 +473,17 @@ def create_workout(db: Session, workout: schemas.WorkoutCreate, user_id: int):
     """Tworzy wpis o treningu."""
     db_workout = models.Workout(**workout.model_dump(), owner_id=user_id)
     db.add(db_workout)
+    refresh_daily_totals(db, user_id, db_workout.date)
     db.commit()
     db.refresh(db_workout)
+    chat_context.invalidate_user(user_id)
     return db_workout
 
 def get_workouts_by_date(db: Session, user_id: int, target_date: date):
     """Pobiera treningi z określonej daty."""
     return db.query(models.Workout).filter(
         models.Workout.owner_id == user_id, 
-        func.date(models.Workout.date) == target_date
+        *_on_day(models.Workout.date, target_date)
     ).all()
 
 def get_workouts_by_date_range(db: Session, user_id: int, start_date: date, end_date: date):
@@ -278,7 +497,9 @@ def delete_workout(db: Session, workout_id: int, user_id: int):
     db_workout = db.query(models.Workout).filter(models.Workout.id == workout_id, models.Workout.owner_id == user_id).first()
     if db_workout:
         db.delete(db_workout)
+        refresh_daily_totals(db, user_id, db_workout.date)
         db.commit()
+        chat_context.invalidate_user(user_id)
         return True
     return False
 
@@ -289,15 +510,123 @@ def get_weight_history_by_date_range(db: Session, user_id: int, start_date: date
         models.WeightEntry.date.between(start_date, end_date)
     ).order_by(models.WeightEntry.date).all()
 
+# --- Daily Totals Operations ---
+
+DAILY_TOTALS_COLUMNS = ("calories", "protein", "fat", "carbs", "meal_entries", "water_ml", "calories_burned", "workouts")
+
+def _diary_totals_select(user_ids: Optional[List[int]] = None, day: Optional[date] = None):
+    """
+    Zapytanie sumujące dziennik w podziale na (użytkownik, dzień): posiłki, woda i treningi w jednym UNION ALL.
+    Wspólne dla przeliczenia jednego dnia i pełnej odbudowy tabeli `daily_totals`.
+    """
+    def scoped(query, owner_column, date_column):
+        query = query.where(owner_column.isnot(None))
+        if user_ids is not None:
+            query = query.where(owner_column.in_(user_ids))
+        if day is not None:
+            query = query.where(date_column == day)
+        return query.group_by(owner_column, date_column)
+
+    zero_float, zero_int = literal(0.0, Float), literal(0, Integer)
+    meals = scoped(
+        select(models.Meal.owner_id.label("user_id"), models.Meal.date.label("date"),
+               func.sum(models.MealEntry.calories).label("calories"), func.sum(models.MealEntry.protein).label("protein"),
+               func.sum(models.MealEntry.fat).label("fat"), func.sum(models.MealEntry.carbs).label("carbs"),
+               func.count(models.MealEntry.id).label("meal_entries"), zero_int.label("water_ml"),
+               zero_int.label("calories_burned"), zero_int.label("workouts"))
+        .join(models.MealEntry, models.MealEntry.meal_id == models.Meal.id),
+        models.Meal.owner_id, models.Meal.date,
+    )
+    water = scoped(
+        select(models.WaterEntry.owner_id, models.WaterEntry.date, zero_float, zero_float, zero_float, zero_float, zero_int,
+               func.sum(models.WaterEntry.amount), zero_int, zero_int),
+        models.WaterEntry.owner_id, models.WaterEntry.date,
+    )
+    workouts = scoped(
+        select(models.Workout.owner_id, models.Workout.date, zero_float, zero_float, zero_float, zero_float, zero_int, zero_int,
+               func.sum(models.Workout.calories_burned), func.count(models.Workout.id)),
+        models.Workout.owner_id, models.Workout.date,
+    )
+    parts = union_all(meals, water, workouts).subquery()
+    return (
+        select(parts.c.user_id, parts.c.date,
+               *(func.coalesce(func.sum(parts.c[name]), 0).label(name) for name in DAILY_TOTALS_COLUMNS))
+        .group_by(parts.c.user_id, parts.c.date)
+    )
+
+def refresh_daily_totals(db: Session, user_id: int, day: date):
+    """
+    Przelicza sumy jednego dnia użytkownika. Wywoływane przez operacje zapisu dziennika przed `commit`,
+    więc rollup zmienia się w tej samej transakcji co wpisy. Dzień bez wpisów nie ma wiersza.
+    """
+    db.flush()
+    row = db.execute(_diary_totals_select([user_id], day)).first()
+    db_totals = db.get(models.DailyTotals, (user_id, day))
+    if row is None:
+        if db_totals is not None:
+            db.delete(db_totals)
+        return
+    if db_totals is None:
+        db_totals = models.DailyTotals(user_id=user_id, date=day)
+        db.add(db_totals)
+    for name in DAILY_TOTALS_COLUMNS:
+        setattr(db_totals, name, getattr(row, name))
+
+def rebuild_daily_totals(db: Session, user_ids: Optional[List[int]] = None) -> int:
+    """Odbudowuje `daily_totals` z surowych wpisów (wszystkich lub wybranych użytkowników). Zwraca liczbę wierszy."""
+    delete_query = db.query(models.DailyTotals)
+    if user_ids is not None:
+        delete_query = delete_query.filter(models.DailyTotals.user_id.in_(user_ids))
+    delete_query.delete(synchronize_session=False)
+    db.execute(insert(models.DailyTotals).from_select(
+        ["user_id", "date", *DAILY_TOTALS_COLUMNS], _diary_totals_select(user_ids)
+    ))
+    db.commit()
+    query = db.query(func.count()).select_from(models.DailyTotals)
+    if user_ids is not None:
+        query = query.filter(models.DailyTotals.user_id.in_(user_ids))
+    return query.scalar()
+
+def backfill_daily_totals_if_empty(db: Session):
+    """Przy pierwszym uruchomieniu z nową tabelą wypełnia ją danymi z istniejących dzienników."""
+    if db.query(models.DailyTotals.user_id).first() is not None:
+        return
+    if not any(db.query(model.id).first() for model in (models.MealEntry, models.WaterEntry, models.Workout)):
+        return
+    rows = rebuild_daily_totals(db)
+    print(f"DEBUG: Wypełniono tabelę daily_totals: {rows} dni.")
+
+def get_daily_totals(db: Session, user_id: int, target_date: date) -> Optional[models.DailyTotals]:
+    """Sumy jednego dnia (None, jeśli tego dnia nie ma żadnych wpisów)."""
+    return db.get(models.DailyTotals, (user_id, target_date))
+
+def get_daily_totals_by_date_range(db: Session, user_id: int, start_date: date, end_date: date) -> List[models.DailyTotals]:
+    """Sumy dzienne z zadanego okresu - jeden wiersz na dzień z wpisami."""
+    return db.query(models.DailyTotals).filter(
+        models.DailyTotals.user_id == user_id,
+        models.DailyTotals.date.between(start_date, end_date)
+    ).order_by(models.DailyTotals.date).all()
+
 # --- Social Operations ---
 
 def search_users_by_email(db: Session, email_query: str, current_user_id: int, limit: int = 10):
-    """Wyszukuje użytkowników po emailu do celów społecznościowych."""
-    return db.query(models.User).filter(
-        models.User.email.ilike(f"%{email_query}%"),
+    """
+    Wyszukuje użytkowników po fragmencie emaila do celów społecznościowych.
+    Korzysta z indeksu trigramowego (`search_index`), a gdy jest niedostępny - z `ILIKE`.
+    """
+    query = db.query(models.User).filter(
         models.User.id != current_user_id,
         models.User.is_social_profile_active == True
-    ).limit(limit).all()
+    )
+    if search_index.can_use_email_index():
+        # Złączenie prowadzone od indeksu FTS - LIMIT kończy skanowanie po znalezieniu pierwszych trafień
+        email_fts = table(search_index.EMAIL_FTS_TABLE, column("rowid"))
+        query = query.join(email_fts, email_fts.c.rowid == models.User.id).filter(
+            text(f"{search_index.EMAIL_FTS_TABLE} MATCH :email_match")
+        ).params(email_match=search_index.email_match_query(email_query))
+    else:
+        query = query.filter(models.User.email.ilike(f"%{email_query}%"))
+    return query.limit(limit).all()
 
 def get_friendship(db: Session, user_id: int, friend_id: int):
     """Pobiera relację przyjaźni między dwoma użytkownikami."""
@@ -306,6 +635,20 @@ def get_friendship(db: Session, user_id: int, friend_id: int):
             (models.Friendship.user_id == friend_id) & (models.Friendship.friend_id == user_id))
     ).first()
 
+def get_friendships_with_users(db: Session, user_id: int, other_user_ids: List[int]) -> Dict[int, models.Friendship]:
+    """Jednym zapytaniem pobiera relacje użytkownika z wieloma innymi użytkownikami (klucz: id drugiej osoby)."""
+    if not other_user_ids:
+        return {}
+    friendships = db.query(models.Friendship).filter(
+        or_((models.Friendship.user_id == user_id) & (models.Friendship.friend_id.in_(other_user_ids)),
+            (models.Friendship.friend_id == user_id) & (models.Friendship.user_id.in_(other_user_ids)))
+    ).all()
+    result: Dict[int, models.Friendship] = {}
+    for friendship in friendships:
+        other_id = friendship.friend_id if friendship.user_id == user_id else friendship.user_id
+        result.setdefault(other_id, friendship)
+    return result
+
 def send_friend_request(db: Session, user_id: int, friend_id: int):
     """Wysyła zaproszenie do znajomych."""
     db_friendship = models.Friendship(user_id=user_id, friend_id=friend_id, status=FriendshipStatus.PENDING)
@@ -319,8 +662,8 @@ def get_friendship_by_id(db: Session, friendship_id: int):
     return db.query(models.Friendship).filter(models.Friendship.id == friendship_id).first()
 
 def get_friend_requests(db: Session, user_id: int):
-    """Pobiera zaproszenia do znajomych oczekujące na akceptację."""
-    return db.query(models.Friendship).filter(
+    """Pobiera zaproszenia do znajomych oczekujące na akceptację wraz z profilami nadawców (jedno zapytanie)."""
+    return db.query(models.Friendship).options(joinedload(models.Friendship.user)).filter(
         models.Friendship.friend_id == user_id,
         models.Friendship.status == FriendshipStatus.PENDING
     ).all()
@@ -383,12 +726,30 @@ def get_recently_completed_challenges_for_user(db: Session, user_id: int):
         models.UserChallenge.end_date >= one_week_ago
     ).all()
 
-def get_active_challenges_to_verify(db: Session):
-    """Pobiera aktywne wyzwania, których termin minął, do weryfikacji."""
-    return db.query(models.UserChallenge).filter(
+def get_recently_completed_challenges_for_users(db: Session, user_ids: List[int]) -> Dict[int, List[models.UserChallenge]]:
+    """Jednym zapytaniem pobiera niedawno ukończone wyzwania wielu użytkowników."""
+    if not user_ids:
+        return {}
+    one_week_ago = date.today() - timedelta(days=7)
+    challenges = db.query(models.UserChallenge).filter(
+        models.UserChallenge.user_id.in_(user_ids),
+        models.UserChallenge.status == ChallengeStatus.COMPLETED,
+        models.UserChallenge.end_date >= one_week_ago
+    ).all()
+    result: Dict[int, List[models.UserChallenge]] = {}
+    for challenge in challenges:
+        result.setdefault(challenge.user_id, []).append(challenge)
+    return result
+
+def get_active_challenges_to_verify(db: Session, ended_after: Optional[date] = None):
+    """Pobiera aktywne wyzwania, których termin minął (opcjonalnie tylko zakończone po `ended_after`), do weryfikacji."""
+    query = db.query(models.UserChallenge).filter(
         models.UserChallenge.status == ChallengeStatus.ACTIVE,
         models.UserChallenge.end_date < date.today()
-    ).all()
+    )
+    if ended_after is not None:
+        query = query.filter(models.UserChallenge.end_date > ended_after)
+    return query.all()
 
 def update_user_challenge_status(db: Session, user_challenge_id: int, status: ChallengeStatus):
     """Aktualizuje status wyzwania użytkownika."""
@@ -400,6 +761,74 @@ def update_user_challenge_status(db: Session, user_challenge_id: int, status: Ch
         return db_challenge
     return None
 
+def update_user_challenge_statuses(db: Session, statuses: Dict[int, ChallengeStatus]) -> int:
+    """Zapisuje statusy wielu wyzwań w jednej transakcji (jedno zapytanie UPDATE na status)."""
+    ids_by_status: Dict[ChallengeStatus, List[int]] = {}
+    for user_challenge_id, status in statuses.items():
+        ids_by_status.setdefault(status, []).append(user_challenge_id)
+    updated = 0
+    for status, ids in ids_by_status.items():
+        updated += db.query(models.UserChallenge).filter(models.UserChallenge.id.in_(ids)).update(
+            {models.UserChallenge.status: status}, synchronize_session=False
+        )
+    db.commit()
+    return updated
+
+def get_diet_logs_for_users(db: Session, user_ids: List[int], start_date: date, end_date: date) -> Dict[int, List[Tuple[date, str]]]:
+    """Jednym zapytaniem pobiera (data, nazwa produktu) z dzienników wielu użytkowników w zadanym okresie."""
+    rows = (
+        db.query(models.Meal.owner_id, models.Meal.date, models.MealEntry.product_name)
+        .join(models.MealEntry, models.MealEntry.meal_id == models.Meal.id)
+        .filter(models.Meal.owner_id.in_(user_ids), models.Meal.date.between(start_date, end_date))
+        .order_by(models.Meal.date, models.Meal.id, models.MealEntry.id)
+        .all()
+    )
+    logs: Dict[int, List[Tuple[date, str]]] = {}
+    for owner_id, meal_date, product_name in rows:
+        logs.setdefault(owner_id, []).append((meal_date, product_name))
+    return logs
+
+def get_workout_logs_for_users(db: Session, user_ids: List[int], start_date: date, end_date: date) -> Dict[int, List[Tuple[date, str]]]:
+    """Jednym zapytaniem pobiera (data, nazwa treningu) wielu użytkowników w zadanym okresie."""
+    rows = (
+        db.query(models.Workout.owner_id, models.Workout.date, models.Workout.name)
+        .filter(models.Workout.owner_id.in_(user_ids), models.Workout.date.between(start_date, end_date))
+        .order_by(models.Workout.date, models.Workout.id)
+        .all()
+    )
+    logs: Dict[int, List[Tuple[date, str]]] = {}
+    for owner_id, workout_date, name in rows:
+        logs.setdefault(owner_id, []).append((workout_date, name))
+    return logs
+
+def get_meal_aggregates_for_users(db: Session, user_ids: List[int], start_date: date, end_date: date):
+    """Zwraca (właściciel, data, kategoria, liczba wpisów, kalorie, białko) zgrupowane po dniu i kategorii posiłku."""
+    return (
+        db.query(models.Meal.owner_id, models.Meal.date, models.Meal.category, func.count(models.MealEntry.id),
+                 func.sum(models.MealEntry.calories), func.sum(models.MealEntry.protein))
+        .join(models.MealEntry, models.MealEntry.meal_id == models.Meal.id)
+        .filter(models.Meal.owner_id.in_(user_ids), models.Meal.date.between(start_date, end_date))
+        .group_by(models.Meal.owner_id, models.Meal.date, models.Meal.category)
+        .all()
+    )
+
+def get_workout_totals_for_users(db: Session, user_ids: List[int], start_date: date, end_date: date):
+    """Zwraca (właściciel, data, liczba treningów, spalone kalorie) dla wielu użytkowników - z tabeli `daily_totals`."""
+    return (
+        db.query(models.DailyTotals.user_id, models.DailyTotals.date, models.DailyTotals.workouts,
+                 models.DailyTotals.calories_burned)
+        .filter(models.DailyTotals.user_id.in_(user_ids), models.DailyTotals.date.between(start_date, end_date),
+                models.DailyTotals.workouts > 0)
+        .all()
+    )
+
+def get_calorie_goal_settings(db: Session, user_ids: List[int]) -> Dict[int, Tuple[Optional[int], bool]]:
+    """Zwraca (cel kaloryczny, czy doliczać kalorie z treningów do celu) wielu użytkowników."""
+    rows = db.query(models.User.id, models.User.calorie_goal, models.User.add_workout_calories_to_goal).filter(
+        models.User.id.in_(user_ids)
+    ).all()
+    return {user_id: (goal, bool(add_workout_calories)) for user_id, goal, add_workout_calories in rows}
+
 # --- Password Reset Token Operations ---
 
 def create_password_reset_token(db: Session, user_id: int, token: str):
@@ -410,9 +839,81 @@ def create_password_reset_token(db: Session, user_id: int, token: str):
         user.password_reset_expires = datetime.utcnow() + timedelta(hours=1)
         db.commit()
 
+def clear_expired_password_reset_tokens(db: Session) -> int:
+    """Usuwa przeterminowane tokeny resetu hasła."""
+    cleared = db.query(models.User).filter(
+        models.User.password_reset_token.isnot(None),
+        models.User.password_reset_expires < datetime.utcnow()
+    ).update({models.User.password_reset_token: None, models.User.password_reset_expires: None}, synchronize_session=False)
+    db.commit()
+    return cleared
+
 def get_user_by_password_reset_token(db: Session, token: str):
     """Znajduje użytkownika na podstawie tokenu resetującego hasło."""
     return db.query(models.User).filter(
         models.User.password_reset_token == token,
         models.User.password_reset_expires > datetime.utcnow()
     ).first()
+
+# --- Background Job Operations ---
+
+def get_user_ids_with_meals_between(db: Session, start_date: date, end_date: date, after_id: int, limit: int) -> List[int]:
+    """Zwraca kolejną stronę (rosnąco po id) użytkowników, którzy zapisali posiłki w zadanym okresie."""
+    rows = (
+        db.query(models.Meal.owner_id)
+        .filter(models.Meal.date.between(start_date, end_date), models.Meal.owner_id > after_id)
+        .distinct()
+        .order_by(models.Meal.owner_id)
+        .limit(limit)
+        .all()
+    )
+    return [owner_id for (owner_id,) in rows]
+
+def acquire_job_lease(db: Session, name: str, owner: str, ttl_seconds: float) -> bool:
+    """
+    Przejmuje lub odnawia dzierżawę `name` dla `owner`, jeśli jest wolna, przeterminowana lub już należy do niego.
+    Warunkowy UPDATE jest atomowy, więc spośród kilku procesów dzierżawę dostaje dokładnie jeden.
+    """
+    now = datetime.utcnow()
+    if db.get(models.JobState, name) is None:
+        try:
+            db.add(models.JobState(name=name))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+    acquired = db.query(models.JobState).filter(
+        models.JobState.name == name,
+        or_(models.JobState.lease_owner.is_(None), models.JobState.lease_owner == owner, models.JobState.lease_expires_at < now)
+    ).update({models.JobState.lease_owner: owner, models.JobState.lease_expires_at: now + timedelta(seconds=ttl_seconds)},
+             synchronize_session=False)
+    db.commit()
+    return acquired == 1
+
+def release_job_lease(db: Session, name: str, owner: str):
+    """Zwalnia dzierżawę, jeśli należy do `owner`."""
+    db.query(models.JobState).filter(models.JobState.name == name, models.JobState.lease_owner == owner).update(
+        {models.JobState.lease_owner: None, models.JobState.lease_expires_at: None}, synchronize_session=False
+    )
+    db.commit()
+
+def get_job_states(db: Session, names: List[str]) -> Dict[str, models.JobState]:
+    return {state.name: state for state in db.query(models.JobState).filter(models.JobState.name.in_(names)).all()}
+
+def start_job_run(db: Session, name: str):
+    """Oznacza początek przebiegu zadania (tworzy wiersz stanu, jeśli go nie ma)."""
+    state = db.get(models.JobState, name) or models.JobState(name=name)
+    state.last_started_at = datetime.utcnow()
+    state.last_status = "running"
+    db.add(state)
+    db.commit()
+
+def save_job_cursor(db: Session, name: str, cursor: Optional[dict]):
+    db.query(models.JobState).filter(models.JobState.name == name).update({models.JobState.cursor: cursor}, synchronize_session=False)
+    db.commit()
+
+def finish_job_run(db: Session, name: str, status: str, error: Optional[str] = None):
+    db.query(models.JobState).filter(models.JobState.name == name).update(
+        {models.JobState.last_finished_at: datetime.utcnow(), models.JobState.last_status: status, models.JobState.last_error: error},
+        synchronize_session=False,
+    )
+    db.commit()
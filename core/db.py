@@ -1,6 +1,12 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./aikcal.db"
 
@@ -17,3 +23,34 @@ def get_db():
         yield db
     finally:
         db.close()
+
+# --- Dostęp do bazy z kodu asynchronicznego ---
+# Zapytania SQLAlchemy są blokujące. W funkcjach `async def` wykonujemy je w osobnej puli wątków,
+# aby wolne zapytanie lub blokada zapisu SQLite nie wstrzymywały pętli zdarzeń (i zapytań do AI innych użytkowników).
+# Pula jest oddzielona od domyślnej puli FastAPI/anyio, więc nie konkuruje z endpointami synchronicznymi.
+
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+_db_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+T = TypeVar("T")
+
+async def run_db(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Wykonuje blokującą funkcję bazodanową w puli wątków bazy danych.
+    Przekazana sesja może być używana z różnych wątków, ale nigdy równolegle - każde wywołanie czekamy do końca.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_db_executor, functools.partial(fn, *args, **kwargs))
+
+async def run_in_session(fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Wykonuje `fn(db, *args, **kwargs)` w nowej, krótkotrwałej sesji w puli wątków bazy danych."""
+    def call() -> T:
+        db = SessionLocal()
+        try:
+            return fn(db, *args, **kwargs)
+        finally:
+            db.close()
+    return await run_db(call)
+
+def shutdown_db_executor():
+    _db_executor.shutdown(wait=True)
@@ -0,0 +1,141 @@
+"""
+Moduł odpowiedzialny za szybkie wyszukiwanie produktów i dań po nazwie.
+
+Ten plik zawiera:
+1.  Indeks w pamięci, który mapuje znormalizowane nazwy i aliasy na ID rekordów.
+2.  Leniwe ładowanie indeksu z bazy przy pierwszym użyciu.
+3.  Funkcje do aktualizacji indeksu po zapisie nowych produktów i dań.
+
+Zapytania `func.lower(name) == func.lower(:name)` nie mogą korzystać z indeksów
+`ix_products_name`/`ix_dishes_name`, więc każde wyszukiwanie skanowało całą tabelę.
+Indeks rozwiązuje nazwę w O(1) i dodatkowo przeszukuje kolumny `aliases`.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy.orm import Session
+
+from . import models, units
+
+
+def normalize_key(name: Optional[str]) -> str:
+    """Zwraca klucz indeksu: nazwa po normalizacji (małe litery, synonimy, pojedyncze spacje)."""
+    if not name or not isinstance(name, str):
+        return ""
+    return units.normalize_name(" ".join(name.split()))
+
+
+class FoodIndex:
+    """Indeks nazw i aliasów produktów oraz dań, współdzielony przez cały proces."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Tylko jeden wątek skanuje tabele; RLock, bo `ensure_loaded` wywołuje `load` pod tą samą blokadą
+        self._load_lock = threading.RLock()
+        self._loaded = False
+        # Wpisy dodane w trakcie ładowania - odtwarzane na nowych słownikach przed ich podmianą
+        self._adds_during_load: Optional[List[Tuple[str, int, str, Optional[Iterable[str]]]]] = None
+        self._dishes: Dict[str, int] = {}
+        self._products: Dict[str, int] = {}
+
+    # --- Ładowanie i aktualizacja ---
+
+    def load(self, db: Session):
+        """Wczytuje wszystkie nazwy i aliasy z bazy (jedno zapytanie na tabelę)."""
+        with self._load_lock:
+            with self._lock:
+                self._adds_during_load = []
+            dishes: Dict[str, int] = {}
+            products: Dict[str, int] = {}
+            try:
+                for row in db.query(models.Product.id, models.Product.name, models.Product.aliases).all():
+                    self._register(products, row.id, row.name, row.aliases)
+                for row in db.query(models.Dish.id, models.Dish.name, models.Dish.aliases).all():
+                    self._register(dishes, row.id, row.name, row.aliases)
+            except Exception:
+                with self._lock:
+                    self._adds_during_load = None
+                raise
+            with self._lock:
+                targets = {"product": products, "dish": dishes}
+                for kind, record_id, name, aliases in self._adds_during_load:
+                    self._register(targets[kind], record_id, name, aliases)
+                self._adds_during_load = None
+                self._products = products
+                self._dishes = dishes
+                self._loaded = True
+        print(f"DEBUG: Załadowano indeks żywności: {len(products)} kluczy produktów, {len(dishes)} kluczy dań.")
+
+    def ensure_loaded(self, db: Session):
+        """Ładuje indeks, jeśli nie został jeszcze zbudowany w tym procesie."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            # Inny wątek mógł załadować indeks, gdy ten czekał na blokadę
+            if not self._loaded:
+                self.load(db)
+
+    def invalidate(self):
+        """Wymusza ponowne załadowanie indeksu przy następnym wyszukiwaniu."""
+        with self._lock:
+            self._loaded = False
+
+    def add_product(self, product: models.Product):
+        """Dodaje (lub nadpisuje) wpis produktu po zapisie w bazie."""
+        with self._lock:
+            self._register(self._products, product.id, product.name, product.aliases)
+            if self._adds_during_load is not None:
+                self._adds_during_load.append(("product", product.id, product.name, product.aliases))
+
+    def add_dish(self, dish: models.Dish):
+        """Dodaje (lub nadpisuje) wpis dania po zapisie w bazie."""
+        with self._lock:
+            self._register(self._dishes, dish.id, dish.name, dish.aliases)
+            if self._adds_during_load is not None:
+                self._adds_during_load.append(("dish", dish.id, dish.name, dish.aliases))
+
+    @staticmethod
+    def _register(target: Dict[str, int], record_id: int, name: str, aliases: Optional[Iterable[str]]):
+        # Nazwa główna zawsze wygrywa z aliasem innego rekordu
+        for alias in aliases or []:
+            key = normalize_key(alias)
+            if key and key not in target:
+                target[key] = record_id
+        key = normalize_key(name)
+        if key:
+            target[key] = record_id
+
+    # --- Wyszukiwanie ---
+
+    def find_dish_id(self, db: Session, name: str) -> Optional[int]:
+        self.ensure_loaded(db)
+        return self._dishes.get(normalize_key(name))
+
+    def find_product_id(self, db: Session, name: str) -> Optional[int]:
+        self.ensure_loaded(db)
+        return self._products.get(normalize_key(name))
+
+    def get_dish(self, db: Session, name: str) -> Optional[models.Dish]:
+        """Zwraca danie po nazwie lub aliasie (odczyt po kluczu głównym)."""
+        dish_id = self.find_dish_id(db, name)
+        if dish_id is None:
+            return None
+        dish = db.get(models.Dish, dish_id)
+        if dish is None:
+            # Rekord usunięty poza aplikacją - indeks jest nieaktualny
+            self.invalidate()
+        return dish
+
+    def get_product(self, db: Session, name: str) -> Optional[models.Product]:
+        """Zwraca produkt po nazwie lub aliasie (odczyt po kluczu głównym)."""
+        product_id = self.find_product_id(db, name)
+        if product_id is None:
+            return None
+        product = db.get(models.Product, product_id)
+        if product is None:
+            self.invalidate()
+        return product
+
+
+# Jedna instancja na proces
+food_index = FoodIndex()
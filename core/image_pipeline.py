@@ -0,0 +1,117 @@
+"""
+Moduł odpowiedzialny za wstępne przetwarzanie zdjęć posiłków przed wysłaniem do AI.
+
+Ten plik zawiera:
+1.  Dekodowanie, obrót wg EXIF, zmniejszenie do maksymalnej krawędzi i ponowną kompresję do JPEG.
+    Całość działa w wątku roboczym, aby nie blokować pętli zdarzeń.
+2.  Hash percepcyjny (dHash, 64 bity) liczony z przetworzonego obrazu.
+3.  Cache w pamięci, który dla identycznych lub prawie identycznych zdjęć (mała odległość Hamminga)
+    zwraca wcześniej rozpoznane `{name, quantity, unit}` bez ponownego zapytania do modelu.
+
+Konfiguracja przez zmienne środowiskowe:
+- IMAGE_MAX_EDGE: maksymalna długość dłuższej krawędzi w pikselach (domyślnie 1024),
+- IMAGE_JPEG_QUALITY: jakość ponownej kompresji JPEG (domyślnie 85),
+- IMAGE_HASH_MAX_DISTANCE: maksymalna odległość Hamminga uznawana za to samo zdjęcie (domyślnie 6),
+- IMAGE_HASH_CACHE_SIZE: liczba zapamiętanych zdjęć (domyślnie 512).
+"""
+import asyncio
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+from PIL import Image, ImageOps
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+IMAGE_HASH_MAX_DISTANCE = int(os.getenv("IMAGE_HASH_MAX_DISTANCE", "6"))
+IMAGE_HASH_CACHE_SIZE = int(os.getenv("IMAGE_HASH_CACHE_SIZE", "512"))
+
+
+@dataclass
+class PreparedImage:
+    """Zdjęcie gotowe do wysłania do modelu: zmniejszony obraz JPEG i jego hash percepcyjny."""
+    image: Image.Image
+    jpeg_bytes: bytes
+    phash: int
+
+
+def decode_base64(image_base64: str) -> bytes:
+    """Dekoduje obraz z base64, akceptując zarówno data URL ("data:image/jpeg;base64,..."), jak i czyste base64."""
+    payload = image_base64.split(",", 1)[1] if "," in image_base64 else image_base64
+    return base64.b64decode(payload)
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """Liczy dHash: porównanie jasności sąsiednich pikseli w miniaturze (hash_size+1) x hash_size."""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def prepare_image(image_data: bytes) -> PreparedImage:
+    """Dekoduje, zmniejsza i ponownie kompresuje zdjęcie. Funkcja blokująca - wywoływać w wątku."""
+    with Image.open(io.BytesIO(image_data)) as original:
+        image = ImageOps.exif_transpose(original).convert("RGB")
+    image.thumbnail((IMAGE_MAX_EDGE, IMAGE_MAX_EDGE), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    jpeg_bytes = buffer.getvalue()
+    # Ponowne otwarcie z JPEG, aby do modelu trafił skompresowany plik, a nie surowe piksele
+    compressed = Image.open(io.BytesIO(jpeg_bytes))
+    compressed.load()
+    return PreparedImage(image=compressed, jpeg_bytes=jpeg_bytes, phash=dhash(image))
+
+
+async def preprocess_image(image_data: bytes) -> PreparedImage:
+    """Przetwarza zdjęcie w wątku roboczym."""
+    return await asyncio.to_thread(prepare_image, image_data)
+
+
+async def preprocess_base64(image_base64: str) -> PreparedImage:
+    """Dekoduje base64 i przetwarza zdjęcie w wątku roboczym."""
+    return await asyncio.to_thread(lambda: prepare_image(decode_base64(image_base64)))
+
+
+class PerceptualHashCache:
+    """Cache LRU wyników rozpoznania zdjęć, wyszukiwany po odległości Hamminga między hashami."""
+
+    def __init__(self, max_size: int = IMAGE_HASH_CACHE_SIZE, max_distance: int = IMAGE_HASH_MAX_DISTANCE):
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[int, Dict[str, Any]]" = OrderedDict()
+        self.max_size = max_size
+        self.max_distance = max_distance
+
+    def find(self, phash: int) -> Optional[Dict[str, Any]]:
+        """Zwraca kopię wyniku dla najbliższego zapamiętanego zdjęcia w granicy `max_distance`."""
+        with self._lock:
+            best_hash, best_distance = None, self.max_distance + 1
+            for known_hash in self._entries:
+                distance = bin(known_hash ^ phash).count("1")
+                if distance < best_distance:
+                    best_hash, best_distance = known_hash, distance
+                    if distance == 0:
+                        break
+            if best_hash is None:
+                return None
+            self._entries.move_to_end(best_hash)
+            return dict(self._entries[best_hash])
+
+    def add(self, phash: int, parsed: Dict[str, Any]):
+        with self._lock:
+            self._entries[phash] = dict(parsed)
+            self._entries.move_to_end(phash)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+# Jedna instancja na proces
+parsed_image_cache = PerceptualHashCache()
@@ -0,0 +1,257 @@
+"""
+Moduł odpowiedzialny za cykliczne zadania w tle uruchamiane wewnątrz procesu aplikacji.
+
+Ten plik zawiera:
+1.  Harmonogram (`JobScheduler`) startowany i zatrzymywany razem z aplikacją.
+2.  Wybór lidera przez dzierżawę (lease) w tabeli `job_states`: przy kilku workerach uvicorna zadania
+    wykonuje tylko ten, który trzyma dzierżawę; pozostałe co `JOBS_TICK_SECONDS` sprawdzają, czy nie wygasła.
+3.  Trwałe kursory: każde zadanie zapisuje w bazie, dokąd doszło, więc kolejny przebieg (także po restarcie
+    lub zmianie lidera) kontynuuje pracę zamiast zaczynać od nowa.
+4.  Zadania: weryfikacja zakończonych wyzwań, wstępne generowanie analiz tygodniowych i konserwacja bazy.
+
+Konfiguracja przez zmienne środowiskowe:
+- JOBS_ENABLED: "0" wyłącza harmonogram (domyślnie włączony),
+- JOBS_TICK_SECONDS: co ile sekund harmonogram sprawdza dzierżawę i zaległe zadania (domyślnie 30),
+- JOBS_LEASE_SECONDS: czas ważności dzierżawy lidera (domyślnie 120),
+- JOB_WEEKLY_ANALYSIS_ENABLED: "1" włącza wstępne generowanie analiz tygodniowych (domyślnie wyłączone - każda analiza
+  to zapytanie do modelu AI dla każdego aktywnego użytkownika).
+"""
+import asyncio
+import os
+import socket
+import traceback
+import uuid
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from . import ai_scheduler, crud, models, schemas
+from .ai_cache import response_cache
+from .db import SessionLocal, engine, run_db, run_in_session
+from .challenge_verification import verify_ended_challenges_task
+from .weekly_analysis import create_weekly_analysis
+
+JOBS_ENABLED = os.getenv("JOBS_ENABLED", "1") != "0"
+JOBS_TICK_SECONDS = float(os.getenv("JOBS_TICK_SECONDS", "30"))
+JOBS_LEASE_SECONDS = float(os.getenv("JOBS_LEASE_SECONDS", "120"))
+JOB_WEEKLY_ANALYSIS_ENABLED = os.getenv("JOB_WEEKLY_ANALYSIS_ENABLED", "0") == "1"
+
+LEADER_LEASE = "scheduler-leader"
+# Wyzwania, których weryfikacja się nie powiodła, są ponawiane przez tyle dni po terminie
+CHALLENGE_RETRY_DAYS = 7
+WEEKLY_ANALYSIS_PAGE_SIZE = 50
+WEEKLY_ANALYSIS_CONCURRENCY = 4
+
+
+class JobContext:
+    """Przekazywany do zadania: ostatnio zapisany kursor i możliwość zapisania postępu w trakcie przebiegu."""
+
+    def __init__(self, name: str, cursor: Optional[dict]):
+        self.name = name
+        self.cursor = cursor or {}
+
+    async def save(self, cursor: dict):
+        self.cursor = cursor
+        await run_in_session(crud.save_job_cursor, self.name, cursor)
+
+
+@dataclass
+class Job:
+    name: str
+    interval: timedelta
+    run: Callable[[JobContext], Awaitable[None]]
+
+
+# --- Zadania ---
+
+async def verify_challenges_job(ctx: JobContext):
+    """
+    Weryfikuje wyzwania zakończone od ostatniego przebiegu (z zapasem na ponowienia).
+    Kursor `verified_through` to dzień, do którego wszystko zostało sprawdzone; w ciągu dnia nic nowego
+    się nie kończy, więc kolejne przebiegi tego samego dnia są pomijane, chyba że poprzedni miał błędy.
+    """
+    today = date.today()
+    verified_through = ctx.cursor.get("verified_through")
+    if verified_through == today.isoformat() and not ctx.cursor.get("errors"):
+        return
+    ended_after = date.fromisoformat(verified_through) - timedelta(days=CHALLENGE_RETRY_DAYS) if verified_through else None
+    result = await verify_ended_challenges_task(ended_after=ended_after)
+    await ctx.save({"verified_through": today.isoformat(), "errors": result["errors"]})
+
+
+def _has_own_analysis(user: models.User, start_date: date) -> bool:
+    """Użytkownik sam wygenerował analizę w trakcie tygodnia docelowego lub później - nie nadpisujemy jej."""
+    return user.last_analysis_generated_at is not None and user.last_analysis_generated_at.date() >= start_date
+
+
+async def _pregenerate_analysis(user_id: int, start_date: date, end_date: date, semaphore: asyncio.Semaphore):
+    async with semaphore:
+        ai_scheduler.bind_user(user_id)
+        db = SessionLocal()
+        try:
+            user = await run_db(crud.get_user_by_id, db, user_id)
+            if user is None or _has_own_analysis(user, start_date):
+                return
+            analysis = await create_weekly_analysis(db, user, start_date, end_date, call_site="weekly_analysis_pregen")
+            # Ponowne sprawdzenie - użytkownik mógł wygenerować własną analizę w trakcie zapytania do AI
+            await run_db(db.refresh, user)
+            if _has_own_analysis(user, start_date):
+                return
+            # Bez zmiany `last_analysis_generated_at` - analiza wygenerowana w tle nie blokuje ręcznego generowania
+            user_update = schemas.UserUpdate(last_weekly_analysis=analysis.model_dump_json())
+            await run_db(crud.update_user, db, db_user=user, user_update=user_update)
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się wygenerować analizy tygodniowej dla użytkownika {user_id}. {e}")
+        finally:
+            await run_db(db.close)
+
+
+async def weekly_analysis_job(ctx: JobContext):
+    """
+    Przygotowuje analizy poprzedniego tygodnia (pon.-niedz.) dla użytkowników, którzy w nim coś zapisali
+    i nie wygenerowali w tym czasie własnej analizy.
+    Kursor: tydzień i id ostatniego obsłużonego użytkownika - po przerwaniu praca jest kontynuowana od tego miejsca.
+    """
+    today = date.today()
+    week_start = today - timedelta(days=today.weekday() + 7)
+    week_end = week_start + timedelta(days=6)
+    cursor = ctx.cursor
+    if cursor.get("week_start") != week_start.isoformat():
+        cursor = {"week_start": week_start.isoformat(), "last_user_id": 0, "done": False}
+    if cursor.get("done"):
+        return
+
+    semaphore = asyncio.Semaphore(WEEKLY_ANALYSIS_CONCURRENCY)
+    while True:
+        user_ids = await run_in_session(crud.get_user_ids_with_meals_between, week_start, week_end,
+                                        cursor["last_user_id"], WEEKLY_ANALYSIS_PAGE_SIZE)
+        if not user_ids:
+            await ctx.save({**cursor, "done": True})
+            return
+        await asyncio.gather(*(_pregenerate_analysis(user_id, week_start, week_end, semaphore) for user_id in user_ids))
+        cursor = {**cursor, "last_user_id": user_ids[-1]}
+        await ctx.save(cursor)
+        print(f"DEBUG: Analizy tygodniowe {week_start} - {week_end}: gotowe do użytkownika {user_ids[-1]}.")
+
+
+def _maintain_database(db) -> dict:
+    cleared_tokens = crud.clear_expired_password_reset_tokens(db)
+    if engine.dialect.name == "sqlite":
+        db.execute(text("PRAGMA optimize"))
+        db.commit()
+    return {"cleared_reset_tokens": cleared_tokens}
+
+
+async def db_maintenance_job(ctx: JobContext):
+    """Czyści przeterminowany cache AI i tokeny resetu hasła oraz odświeża statystyki planera zapytań."""
+    await run_db(response_cache.purge)
+    result = await run_in_session(_maintain_database)
+    await ctx.save({"last_run": datetime.utcnow().isoformat(), **result})
+
+
+def default_jobs() -> List[Job]:
+    jobs = [
+        Job("verify_challenges", timedelta(hours=1), verify_challenges_job),
+        Job("db_maintenance", timedelta(hours=24), db_maintenance_job),
+    ]
+    if JOB_WEEKLY_ANALYSIS_ENABLED:
+        jobs.append(Job("weekly_analysis", timedelta(hours=1), weekly_analysis_job))
+    return jobs
+
+
+# --- Harmonogram ---
+
+class JobScheduler:
+    """Pętla harmonogramu: utrzymuje dzierżawę lidera i uruchamia zaległe zadania jedno po drugim."""
+
+    def __init__(self, jobs: List[Job], tick_seconds: float = JOBS_TICK_SECONDS, lease_seconds: float = JOBS_LEASE_SECONDS):
+        self.jobs = jobs
+        self.tick_seconds = tick_seconds
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.is_leader = False
+        self._task: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="job-scheduler")
+            print(f"DEBUG: Harmonogram zadań uruchomiony ({self.owner}).")
+
+    async def stop(self):
+        for task in (self._heartbeat, self._task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._heartbeat = None
+        if self.is_leader:
+            await run_in_session(crud.release_job_lease, LEADER_LEASE, self.owner)
+            self.is_leader = False
+
+    async def _acquire_leadership(self) -> bool:
+        try:
+            return await run_in_session(crud.acquire_job_lease, LEADER_LEASE, self.owner, self.lease_seconds)
+        except Exception as e:
+            print(f"BŁĄD: Nie udało się odnowić dzierżawy harmonogramu. {e}")
+            return False
+
+    async def _renew_lease(self):
+        """Odnawia dzierżawę w trakcie długich zadań, aby inny worker nie przejął przywództwa."""
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            self.is_leader = await self._acquire_leadership()
+
+    async def _run(self):
+        while True:
+            leader = await self._acquire_leadership()
+            if leader != self.is_leader:
+                print(f"DEBUG: Harmonogram zadań: {'przejęto' if leader else 'utracono'} rolę lidera ({self.owner}).")
+            self.is_leader = leader
+            if leader:
+                if self._heartbeat is None:
+                    self._heartbeat = asyncio.create_task(self._renew_lease())
+                try:
+                    await self._run_due_jobs()
+                except Exception as e:
+                    print(f"BŁĄD: Harmonogram zadań nie mógł uruchomić zaległych zadań. {e}")
+            elif self._heartbeat is not None:
+                self._heartbeat.cancel()
+                self._heartbeat = None
+            await asyncio.sleep(self.tick_seconds)
+
+    async def _run_due_jobs(self):
+        states = await run_in_session(crud.get_job_states, [job.name for job in self.jobs])
+        now = datetime.utcnow()
+        for job in self.jobs:
+            if not self.is_leader:
+                return
+            state = states.get(job.name)
+            # Termin liczony od startu ostatniego przebiegu, więc zadanie zakończone błędem nie jest ponawiane w kółko
+            if state is not None and state.last_started_at and now - state.last_started_at < job.interval:
+                continue
+            await self.run_job(job, state.cursor if state is not None else None)
+
+    async def run_job(self, job: Job, cursor: Optional[dict] = None):
+        await run_in_session(crud.start_job_run, job.name)
+        print(f"DEBUG: Start zadania '{job.name}'.")
+        try:
+            await job.run(JobContext(job.name, cursor))
+        except Exception as e:
+            traceback.print_exc()
+            print(f"BŁĄD: Zadanie '{job.name}' zakończyło się błędem. {e}")
+            await run_in_session(crud.finish_job_run, job.name, "error", str(e))
+            return
+        await run_in_session(crud.finish_job_run, job.name, "ok")
+        print(f"DEBUG: Zadanie '{job.name}' zakończone.")
+
+    def status(self) -> Dict[str, object]:
+        return {"owner": self.owner, "is_leader": self.is_leader, "jobs": [job.name for job in self.jobs]}
+
+
+# Jedna instancja na proces
+job_scheduler = JobScheduler(default_jobs())
@@ -13,12 +13,15 @@ load_dotenv(dotenv_path=env_path)
 print("Redirect URI:", os.getenv("GOOGLE_REDIRECT_URI"))
 
 # 📦 Importy backendu i routerów
-from .db import engine
-from . import security, models
+from .db import SessionLocal, engine, shutdown_db_executor
+from . import crud, security, models, ai_cache, ai_client, ai_scheduler, chat_context, jobs, search_index
 from .routers import users, meals, analysis, workouts, social, summary, chat, challenges, auth_google, auth_actions # dodaj auth_actions
 
 # 🔧 Tworzenie tabel w bazie danych przy starcie
 models.Base.metadata.create_all(bind=engine)
+search_index.ensure_email_search_index(engine)
+with SessionLocal() as db:
+    crud.backfill_daily_totals_if_empty(db)
 
 # 🚀 Inicjalizacja aplikacji FastAPI
 app = FastAPI(
@@ -52,6 +55,18 @@ app.include_router(challenges.router)
 app.include_router(auth_google.router)
 app.include_router(auth_actions.router)
 
+# 📊 Metryki warstwy AI (rejestrowane przed ścieżką frontendu, która przechwytuje wszystkie adresy)
+@app.get("/metrics/ai", include_in_schema=False)
+async def ai_metrics():
+    """Metryki warstwy AI: kolejka i budżet schedulera, stan klienta, trafienia cache, migawki kontekstu czatu i harmonogram zadań."""
+    return {
+        "scheduler": ai_scheduler.scheduler.metrics(),
+        "client": ai_client.get_ai_client().stats(),
+        "cache": ai_cache.response_cache.stats(),
+        "chat_context": chat_context.daily_context.stats(),
+        "jobs": jobs.job_scheduler.status(),
+    }
+
 # 🎨 Serwowanie frontendu z katalogu frontend/
 frontend_dir = Path(__file__).resolve().parent.parent / "frontend"
 
@@ -101,4 +116,12 @@ async def startup_event():
         if hasattr(route, "path"):
             methods = ",".join(route.methods) if hasattr(route, "methods") else ""
             print(f"Ścieżka: {route.path}\t Metody: [{methods}]\t Nazwa: {route.name}")
-    print("--- ZAREJESTROWANE ŚCIEŻKI API (KONIEC) ---")
\ No newline at end of file
+    print("--- ZAREJESTROWANE ŚCIEŻKI API (KONIEC) ---")
+    if jobs.JOBS_ENABLED:
+        jobs.job_scheduler.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Zatrzymuje harmonogram zadań i kończy zadania w puli wątków bazy danych przed zamknięciem serwera."""
+    await jobs.job_scheduler.stop()
+    shutdown_db_executor()
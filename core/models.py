@@ -1,4 +1,4 @@
-from sqlalchemy import (Column, Integer, String, Float, Date, Time, ForeignKey, JSON, Boolean, Text, DateTime, desc)
+from sqlalchemy import (Column, Integer, String, Float, Date, Time, ForeignKey, JSON, Boolean, Text, DateTime, Index, desc)
 from sqlalchemy.orm import relationship
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.types import Enum as SQLAlchemyEnum
@@ -41,6 +41,10 @@ class Dish(Base):
     category = Column(String, nullable=True)
     # Przechowuje popularne, potoczne nazwy i błędy w pisowni
     aliases = Column(JSON, default=[])
+    # Zmaterializowane wartości przepisu, przeliczane przy zmianie składników lub ich produktów
+    nutrients_per_100g = Column(JSON, nullable=True)
+    base_weight_g = Column(Float, nullable=True) # Łączna waga składników przepisu
+    state = Column(SQLAlchemyEnum(ProductState), nullable=True) # Stan wyliczony z udziału płynów
     
     # Relacja do tabeli z "przepisami"
     ingredients = relationship("DishIngredient", back_populates="dish", cascade="all, delete-orphan")
@@ -50,7 +54,7 @@ class DishIngredient(Base):
     __tablename__ = "dish_ingredients"
     id = Column(Integer, primary_key=True)
     dish_id = Column(Integer, ForeignKey("dishes.id"), nullable=False)
-    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False, index=True)
     weight_g = Column(Float, nullable=False) # Waga składnika w tym konkretnym daniu
 
     dish = relationship("Dish", back_populates="ingredients")
@@ -67,6 +71,9 @@ class Conversation(Base):
     title = Column(String, default="Nowy czat")
     created_at = Column(DateTime, default=datetime.utcnow)
     is_pinned = Column(Boolean, default=False)
+    # Kroczące streszczenie starszej części rozmowy i id ostatniej wiadomości, która została w nim ujęta
+    summary = Column(Text, nullable=True)
+    summarized_until_id = Column(Integer, nullable=True)
     
     user = relationship("User", back_populates="conversations")
     messages = relationship("ChatMessage", back_populates="conversation", cascade="all, delete-orphan", order_by="ChatMessage.created_at")
@@ -75,7 +82,7 @@ class ChatMessage(Base):
     """Tabela przechowująca pojedyncze wiadomości w ramach konwersacji."""
     __tablename__ = "chat_messages"
     id = Column(Integer, primary_key=True)
-    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False)
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=False, index=True)
     role = Column(String, nullable=False) # 'user' lub 'ai'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -132,6 +139,7 @@ class User(Base):
     workouts = relationship("Workout", back_populates="owner", cascade="all, delete-orphan")
     user_challenges = relationship("UserChallenge", back_populates="user", cascade="all, delete-orphan")
     conversations = relationship("Conversation", back_populates="user", cascade="all, delete-orphan") # Nowa relacja do rozmów
+    daily_totals = relationship("DailyTotals", back_populates="user", cascade="all, delete-orphan")
 
     @property
     def weight(self) -> Optional[float]:
@@ -161,6 +169,9 @@ class UserChallenge(Base):
     
     user = relationship("User", back_populates="user_challenges")
 
+    # Wyszukiwanie aktywnych wyzwań zakończonych w danym okresie (cykliczna weryfikacja)
+    __table_args__ = (Index("ix_user_challenges_status_end_date", "status", "end_date"),)
+
 class WeightEntry(Base):
     __tablename__ = "weight_entries"
     id = Column(Integer, primary_key=True, index=True)
@@ -168,6 +179,7 @@ class WeightEntry(Base):
     date = Column(Date, default=date_type.today, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="weights")
+    __table_args__ = (Index("ix_weight_entries_owner_id_date", "owner_id", "date"),)
 
 class Friendship(Base):
     __tablename__ = "friendships"
@@ -192,6 +204,7 @@ class Meal(Base):
     owner = relationship("User", back_populates="meals")
     
     entries = relationship("MealEntry", back_populates="meal", cascade="all, delete-orphan")
+    __table_args__ = (Index("ix_meals_owner_id_date", "owner_id", "date"),)
 
 class MealEntry(Base):
     __tablename__ = "meal_entries"
@@ -224,6 +237,7 @@ class WaterEntry(Base):
     time = Column(Time, nullable=False, default=lambda: datetime.now().time())
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="water_entries")
+    __table_args__ = (Index("ix_water_entries_owner_id_date", "owner_id", "date"),)
 
 class Workout(Base):
     __tablename__ = "workouts"
@@ -233,6 +247,7 @@ class Workout(Base):
     calories_burned = Column(Integer, nullable=False)
     owner_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="workouts")
+    __table_args__ = (Index("ix_workouts_owner_id_date", "owner_id", "date"),)
 
 class CachedDish(Base):
     __tablename__ = "cached_dishes"
@@ -243,3 +258,47 @@ class CachedProduct(Base):
     __tablename__ = "cached_products"
     name = Column(String, primary_key=True, index=True)
     nutrients = Column(JSON, nullable=False)
+
+class AIResponseCache(Base):
+    """Trwały cache odpowiedzi modelu AI dla deterministycznych zapytań (klucz: hash modelu, promptu i obrazu)."""
+    __tablename__ = "ai_response_cache"
+    key = Column(String, primary_key=True)
+    call_site = Column(String, nullable=False, index=True)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+    last_used_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+    hit_count = Column(Integer, default=0, nullable=False)
+
+class JobState(Base):
+    """Stan zadań cyklicznych: kursor postępu, wynik ostatniego przebiegu oraz dzierżawa (lease) lidera."""
+    __tablename__ = "job_states"
+    name = Column(String, primary_key=True)
+    cursor = Column(JSON, nullable=True)
+    lease_owner = Column(String, nullable=True)
+    lease_expires_at = Column(DateTime, nullable=True)
+    last_started_at = Column(DateTime, nullable=True)
+    last_finished_at = Column(DateTime, nullable=True)
+    last_status = Column(String, nullable=True)
+    last_error = Column(Text, nullable=True)
+
+
+class DailyTotals(Base):
+    """
+    Zmaterializowane sumy dnia użytkownika (posiłki, woda, treningi).
+    Przeliczane w tej samej transakcji przez każdą operację zapisu dziennika w `crud`;
+    pełne odbudowanie: `rebuild_daily_totals.py`.
+    """
+    __tablename__ = "daily_totals"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    date = Column(Date, primary_key=True)
+    calories = Column(Float, nullable=False, default=0.0)
+    protein = Column(Float, nullable=False, default=0.0)
+    fat = Column(Float, nullable=False, default=0.0)
+    carbs = Column(Float, nullable=False, default=0.0)
+    meal_entries = Column(Integer, nullable=False, default=0)
+    water_ml = Column(Integer, nullable=False, default=0)
+    calories_burned = Column(Integer, nullable=False, default=0)
+    workouts = Column(Integer, nullable=False, default=0)
+
+    user = relationship("User", back_populates="daily_totals")
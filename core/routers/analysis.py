@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.exceptions import RequestValidationError
+from pydantic import ValidationError
+from starlette.datastructures import UploadFile
 from sqlalchemy.orm import Session
 from datetime import datetime, timedelta, date
 import json
-from typing import List
+import os
+from typing import List, Optional, Tuple
 
-from .. import crud, models, schemas, ai_analyzer
-from ..db import get_db
+from .. import crud, models, schemas, ai_analyzer, ai_scheduler
+from ..db import get_db, run_db
+from ..weekly_analysis import create_weekly_analysis
 from ..auth import get_current_user
+from ..enums import MealCategory
 
 router = APIRouter(
     prefix="/api/analysis",
@@ -14,18 +20,90 @@ router = APIRouter(
 )
 
 # --- GŁÓWNY ENDPOINT DO ANALIZY POSIŁKU ---
-@router.post("/meal", response_model=schemas.AnalysisResponse)
-async def analyze_meal_endpoint(
-    request: schemas.AnalysisRequest,
-):
+
+# Maksymalny rozmiar przesyłanego zdjęcia (multipart/form-data), domyślnie 10 MB
+MAX_IMAGE_UPLOAD_BYTES = int(os.getenv("MAX_IMAGE_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+_UPLOAD_CHUNK_SIZE = 64 * 1024
+
+_MEAL_ANALYSIS_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": schemas.AnalysisRequest.model_json_schema()},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["meal_category"],
+                    "properties": {
+                        "image": {"type": "string", "format": "binary"},
+                        "text": {"type": "string"},
+                        "meal_category": {"type": "string", "enum": [c.value for c in MealCategory]},
+                    },
+                }
+            },
+        },
+    }
+}
+
+def _client_key(request: Request) -> str:
+    return f"ip:{request.client.host}" if request.client else "anonymous"
+
+async def _read_upload(upload: UploadFile) -> bytes:
+    """Czyta przesłany plik porcjami, przerywając po przekroczeniu limitu rozmiaru."""
+    chunks, size = [], 0
+    while chunk := await upload.read(_UPLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > MAX_IMAGE_UPLOAD_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Zdjęcie jest za duże.")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def _parse_meal_analysis_request(request: Request) -> Tuple[Optional[str], Optional[str], Optional[bytes]]:
+    """
+    Odczytuje zapytanie o analizę posiłku w formacie JSON (tekst / obraz w base64)
+    lub multipart/form-data (tekst / plik zdjęcia). Zwraca (tekst, obraz_base64, bajty_zdjęcia).
+    """
+    content_type = request.headers.get("content-type", "")
+    if not content_type.startswith("multipart/form-data"):
+        try:
+            payload = schemas.AnalysisRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError([{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)])
+        return payload.text, payload.image_base64, None
+
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > MAX_IMAGE_UPLOAD_BYTES + _UPLOAD_CHUNK_SIZE:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Zdjęcie jest za duże.")
+
+    # Części plikowe są strumieniowane przez parser do pliku tymczasowego, nie trzymane w pamięci
+    async with request.form(max_files=1, max_fields=10) as form:
+        try:
+            MealCategory(form.get("meal_category"))
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Nieprawidłowa kategoria posiłku.")
+        text = form.get("text") or None
+        upload = form.get("image")
+        image_bytes = await _read_upload(upload) if isinstance(upload, UploadFile) else None
+
+    if not text and not image_bytes:
+        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail="Należy podać tekst lub obrazek do analizy.")
+    return text, None, image_bytes
+
+@router.post("/meal", response_model=schemas.AnalysisResponse, openapi_extra=_MEAL_ANALYSIS_OPENAPI)
+async def analyze_meal_endpoint(request: Request):
     """
     Nowy, główny endpoint do analizy posiłku (tekst lub obraz).
     Uruchamia całą nową, wieloetapową logikę "Cache-First".
+    Przyjmuje JSON (`schemas.AnalysisRequest`) lub multipart/form-data z plikiem w polu `image`.
     """
+    # Endpoint nie wymaga logowania - kolejka AI rozróżnia klientów po adresie
+    ai_scheduler.bind_user(_client_key(request))
+    text, image_base64, image_bytes = await _parse_meal_analysis_request(request)
     try:
         analysis_result = await ai_analyzer.analyze_meal_entry(
-            text=request.text,
-            image_base64=request.image_base64
+            text=text,
+            image_base64=image_base64,
+            image_bytes=image_bytes
         )
         if not analysis_result:
             raise HTTPException(status_code=400, detail="AI nie mogło przeanalizować tego produktu. Spróbuj opisać go inaczej.")
@@ -34,6 +112,25 @@ async def analyze_meal_endpoint(
         print(f"Błąd podczas analizy posiłku: {e}")
         raise HTTPException(status_code=500, detail=f"Wewnętrzny błąd serwera podczas analizy: {e}")
 
+@router.post("/meal/batch", response_model=schemas.MealBatchAnalysisResponse)
+async def analyze_meal_batch_endpoint(
+    request: schemas.MealBatchAnalysisRequest,
+    http_request: Request,
+):
+    """
+    Analizuje cały posiłek opisany jednym tekstem (np. "2 jajka, kromka chleba, 200 ml mleka").
+    Zwraca wyniki dla każdej pozycji oraz sumę wartości odżywczych.
+    """
+    ai_scheduler.bind_user(_client_key(http_request))
+    try:
+        analysis_result = await ai_analyzer.analyze_meal_items(request.text, include_breakdown=request.include_breakdown)
+    except Exception as e:
+        print(f"Błąd podczas analizy zbiorczej posiłku: {e}")
+        raise HTTPException(status_code=500, detail=f"Wewnętrzny błąd serwera podczas analizy: {e}")
+    if not analysis_result:
+        raise HTTPException(status_code=400, detail="Nie znaleziono żadnych produktów w opisie posiłku.")
+    return analysis_result
+
 # --- ENDPOINTY DLA AI CHEFA ---
 @router.get("/suggest-diet-plan", response_model=list[schemas.DietPlanSuggestion])
 async def get_diet_plan_suggestion(
@@ -41,6 +138,7 @@ async def get_diet_plan_suggestion(
     current_user: models.User = Depends(get_current_user)
 ):
     """Generuje i zwraca nowy plan dietetyczny na podstawie preferencji użytkownika."""
+    ai_scheduler.bind_user(current_user.id)
     today = date.today()
     if current_user.last_request_date == today and current_user.diet_plan_requests >= 3:
         raise HTTPException(
@@ -63,7 +161,7 @@ async def get_diet_plan_suggestion(
     user_update = schemas.UserUpdate(last_diet_plan=plan_json_string)
     
     db.add(current_user)
-    crud.update_user(db=db, db_user=current_user, user_update=user_update)
+    await run_db(crud.update_user, db=db, db_user=current_user, user_update=user_update)
     
     return plan
 
@@ -76,6 +174,7 @@ async def generate_weekly_analysis_endpoint(
     current_user: models.User = Depends(get_current_user)
 ):
     """Generuje analizę danych użytkownika dla podanego zakresu dat."""
+    ai_scheduler.bind_user(current_user.id)
     if current_user.last_analysis_generated_at and (datetime.now() - current_user.last_analysis_generated_at < timedelta(hours=24)):
         remaining_time = timedelta(hours=24) - (datetime.now() - current_user.last_analysis_generated_at)
         hours, rem = divmod(remaining_time.total_seconds(), 3600)
@@ -85,22 +184,12 @@ async def generate_weekly_analysis_endpoint(
             detail=f"Analiza może być generowana raz na 24 godziny. Spróbuj ponownie za {int(hours)}h {int(minutes)}min."
         )
 
-    start_date, end_date = request.start_date, request.end_date
-    meals = crud.get_meals_by_date_range(db, current_user.id, start_date, end_date)
-    workouts = crud.get_workouts_by_date_range(db, current_user.id, start_date, end_date)
-    weight_history = crud.get_weight_history_by_date_range(db, current_user.id, start_date, end_date)
-    
-    ai_coach_summary = await ai_analyzer.generate_weekly_analysis(
-        {"meals": meals, "workouts": workouts, "weight_history": weight_history}, 
-        user=current_user, start_date=start_date, end_date=end_date
-    )
-
-    analysis_data = schemas.WeeklyAnalysisResponse(ai_coach_summary=ai_coach_summary)
+    analysis_data = await create_weekly_analysis(db, current_user, request.start_date, request.end_date)
     user_update = schemas.UserUpdate(
         last_weekly_analysis=analysis_data.model_dump_json(),
         last_analysis_generated_at=datetime.now()
     )
-    crud.update_user(db, db_user=current_user, user_update=user_update)
+    await run_db(crud.update_user, db, db_user=current_user, user_update=user_update)
     return analysis_data
 
 @router.get("/latest", response_model=schemas.WeeklyAnalysisResponse)
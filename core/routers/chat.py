@@ -1,9 +1,14 @@
-from fastapi import APIRouter, Depends, HTTPException, Body
+import json
+from contextlib import aclosing
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Body, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Any, Dict, List, Optional
 
-from .. import crud, models, schemas, ai_analyzer
-from ..db import get_db
+from .. import crud, models, schemas, ai_analyzer, ai_scheduler
+from ..ai_client import AIError
+from ..db import get_db, run_db, run_in_session
 from ..auth import get_current_user
 
 router = APIRouter(
@@ -30,38 +35,117 @@ def create_new_conversation(
 @router.get("/conversations/{conversation_id}", response_model=schemas.Conversation)
 def get_conversation_details(
     conversation_id: int,
+    limit: int = Query(50, ge=1, le=200),
+    before_id: Optional[int] = None,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
-    """Pobiera jedną, konkretną konwersację wraz z całą historią wiadomości."""
+    """
+    Pobiera jedną konwersację wraz z ostatnimi `limit` wiadomościami.
+    Starsze wiadomości pobiera się stronami, przekazując `before_id` = id najstarszej otrzymanej wiadomości.
+    """
     conversation = crud.get_conversation_by_id(db, conversation_id=conversation_id, user_id=current_user.id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Konwersacja nie została znaleziona.")
-    return conversation
+    # Jedna wiadomość ponad limit mówi, czy istnieje kolejna strona
+    messages = crud.get_recent_messages(db, conversation_id, limit=limit + 1, before_id=before_id)
+    has_more = len(messages) > limit
+    return schemas.Conversation(
+        **schemas.ConversationInfo.model_validate(conversation).model_dump(),
+        messages=messages[1:] if has_more else messages,
+        has_more_messages=has_more,
+    )
 
 @router.post("/conversations/{conversation_id}/messages", response_model=schemas.ChatMessage)
 async def send_message_to_conversation(
     conversation_id: int,
     request: schemas.ChatRequest,
+    background_tasks: BackgroundTasks,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Wysyła nową wiadomość do istniejącej konwersacji i zwraca odpowiedź AI."""
-    conversation = crud.get_conversation_by_id(db, conversation_id=conversation_id, user_id=current_user.id)
+    ai_scheduler.bind_user(current_user.id)
+    # Zapytania do bazy w puli wątków bazy danych, aby nie blokować pętli zdarzeń w trakcie rozmów z AI
+    conversation = await run_db(crud.get_conversation_by_id, db, conversation_id=conversation_id, user_id=current_user.id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Konwersacja nie została znaleziona.")
 
     # 1. Zapisz wiadomość od użytkownika w bazie
-    crud.add_message_to_conversation(db, conversation_id=conversation.id, role="user", content=request.message)
+    await run_db(crud.add_message_to_conversation, db, conversation_id=conversation_id, role="user", content=request.message)
 
     # 2. Uzyskaj odpowiedź od AI, przekazując cały obiekt konwersacji
     response_text = await ai_analyzer.get_chat_response(db, current_user, conversation, request.message)
 
     # 3. Zapisz odpowiedź AI w bazie
-    ai_message = crud.add_message_to_conversation(db, conversation_id=conversation.id, role="ai", content=response_text)
+    ai_message = await run_db(crud.add_message_to_conversation, db, conversation_id=conversation_id, role="ai", content=response_text)
 
+    # 4. Po wysłaniu odpowiedzi dołącz do streszczenia wiadomości, które wypadły z okna kontekstu
+    background_tasks.add_task(ai_analyzer.refresh_conversation_summary, conversation_id, current_user.id)
     return ai_message
 
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Formatuje jedno zdarzenie server-sent events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/conversations/{conversation_id}/messages/stream")
+async def stream_message_to_conversation(
+    conversation_id: int,
+    request: schemas.ChatRequest,
+    http_request: Request,
+    background_tasks: BackgroundTasks,
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Wysyła nową wiadomość i strumieniuje odpowiedź AI jako server-sent events (text/event-stream).
+    Zdarzenia: `delta` z kolejnym fragmentem tekstu, na końcu `done` z zapisaną wiadomością
+    albo `error`, jeśli model zawiódł (także w trakcie odpowiedzi) lub nie zwrócił żadnego tekstu.
+    Odpowiedź jest zapisywana tylko po poprawnym zakończeniu strumienia - przerwana lub pusta nie trafia do historii.
+    Po rozłączeniu klienta generowanie jest przerywane, a odpowiedź nie jest zapisywana.
+    """
+    ai_scheduler.bind_user(current_user.id)
+    conversation = await run_db(crud.get_conversation_by_id, db, conversation_id=conversation_id, user_id=current_user.id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Konwersacja nie została znaleziona.")
+
+    await run_db(crud.add_message_to_conversation, db, conversation_id=conversation_id, role="user", content=request.message)
+    # Historia budowana przed startem strumienia - sesja żądania może zostać zamknięta w jego trakcie
+    history_for_model = await ai_analyzer.build_chat_history(db, current_user, conversation)
+
+    async def events():
+        parts = []
+        try:
+            async with aclosing(ai_analyzer.stream_chat_response(history_for_model)) as stream:
+                async for chunk in stream:
+                    if await http_request.is_disconnected():
+                        print(f"DEBUG: Klient rozłączył się w trakcie odpowiedzi (konwersacja {conversation_id}).")
+                        return
+                    parts.append(chunk)
+                    yield _sse_event("delta", {"text": chunk})
+        except AIError as e:
+            # Także po części odpowiedzi - klient usuwa niedokończony dymek, a historia nie dostaje połowy odpowiedzi
+            print(f"BŁĄD: Strumieniowanie odpowiedzi AI nie powiodło się: {e}")
+            yield _sse_event("error", {"detail": ai_analyzer.CHAT_FALLBACK_RESPONSE})
+            return
+
+        response_text = "".join(parts)
+        if not response_text:
+            print(f"BŁĄD: Strumień odpowiedzi AI zakończył się bez tekstu (konwersacja {conversation_id}).")
+            yield _sse_event("error", {"detail": ai_analyzer.CHAT_FALLBACK_RESPONSE})
+            return
+        ai_message = await run_in_session(crud.add_message_to_conversation, conversation_id=conversation_id, role="ai", content=response_text)
+        yield _sse_event("done", schemas.ChatMessage.model_validate(ai_message).model_dump(mode="json"))
+
+    # Zadania w tle ruszają po zakończeniu strumienia
+    background_tasks.add_task(ai_analyzer.refresh_conversation_summary, conversation_id, current_user.id)
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+        background=background_tasks,
+    )
+
 @router.post("/conversations/{conversation_id}/pin", response_model=schemas.ConversationInfo)
 def toggle_pin_conversation(
     conversation_id: int,
@@ -1,8 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Dict, List
 
-from .. import crud, models, schemas, challenges_database
+from .. import crud, models, schemas, challenges_database, search_index
 from ..db import get_db
 from ..auth import get_current_user
 from ..enums import FriendshipStatus
@@ -14,7 +14,7 @@ router = APIRouter(
 
 @router.get("/users/search", response_model=List[schemas.FriendInfo], summary="Wyszukaj użytkowników po e-mailu")
 def search_users(
-    email: str = Query(..., min_length=3, description="Fragment adresu e-mail użytkownika (min. 3 znaki)"),
+    email: str = Query(..., min_length=search_index.EMAIL_FTS_MIN_QUERY_LENGTH, description="Fragment adresu e-mail użytkownika (min. 3 znaki)"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
@@ -22,30 +22,33 @@ def search_users(
         raise HTTPException(status_code=403, detail="Twój profil społecznościowy jest nieaktywny.")
         
     found_users = crud.search_users_by_email(db, email_query=email, current_user_id=current_user.id)
+    user_ids = [user.id for user in found_users]
+    # Relacje i odznaki dla całej strony wyników - stała liczba zapytań niezależnie od liczby wyników
+    friendships = crud.get_friendships_with_users(db, user_id=current_user.id, other_user_ids=user_ids)
+    badges = _badges_for_users(db, user_ids)
     
     results = []
     for user in found_users:
-        friendship = crud.get_friendship(db, user_id=current_user.id, friend_id=user.id)
-        completed_challenges_db = crud.get_recently_completed_challenges_for_user(db, user_id=user.id)
-        
-        badges = []
-        for c in completed_challenges_db:
-            challenge_info = challenges_database.get_challenge_by_id(c.challenge_id)
-            if challenge_info:
-                badges.append(schemas.CompletedChallengeBadge(
-                    title=challenge_info['title'],
-                    end_date=c.end_date
-                ))
-
+        friendship = friendships.get(user.id)
         friend_info = schemas.FriendInfo(
             id=user.id, name=user.name, email=user.email,
             friendship_status=friendship.status if friendship else None,
-            completed_challenges=badges
+            completed_challenges=badges.get(user.id, [])
         )
         results.append(friend_info)
         
     return results
 
+def _badges_for_users(db: Session, user_ids: List[int]) -> Dict[int, List[schemas.CompletedChallengeBadge]]:
+    """Odznaki za niedawno ukończone wyzwania wielu użytkowników (jedno zapytanie)."""
+    badges: Dict[int, List[schemas.CompletedChallengeBadge]] = {}
+    for user_id, completed_challenges in crud.get_recently_completed_challenges_for_users(db, user_ids).items():
+        for c in completed_challenges:
+            challenge_info = challenges_database.get_challenge_by_id(c.challenge_id)
+            if challenge_info:
+                badges.setdefault(user_id, []).append(schemas.CompletedChallengeBadge(title=challenge_info['title'], end_date=c.end_date))
+    return badges
+
 @router.post("/friends/request", response_model=schemas.Friendship, summary="Wyślij zaproszenie do znajomych")
 def send_friend_request(
     friend_request: schemas.FriendshipCreate,
@@ -73,7 +76,7 @@ def get_pending_friend_requests(
     pending_requests = crud.get_friend_requests(db, user_id=current_user.id)
     results = []
     for req in pending_requests:
-        sender_info = crud.get_user_by_id(db, user_id=req.user_id)
+        sender_info = req.user # Załadowany razem z zaproszeniami
         if sender_info:
             response_item = schemas.FriendRequestWithUserInfo(
                 id=req.id, user_id=req.user_id, friend_id=req.friend_id,
@@ -102,15 +105,11 @@ def get_friends_list(
     current_user: models.User = Depends(get_current_user)
 ):
     friends = crud.get_friends_list(db, user_id=current_user.id)
+    badges = _badges_for_users(db, [friend.id for friend in friends])
     results_with_badges = []
     for friend in friends:
-        completed_challenges_db = crud.get_recently_completed_challenges_for_user(db, user_id=friend.id)
-        badges = [
-            schemas.CompletedChallengeBadge(title=challenges_database.get_challenge_by_id(c.challenge_id)['title'], end_date=c.end_date)
-            for c in completed_challenges_db if challenges_database.get_challenge_by_id(c.challenge_id)
-        ]
         friend_with_badges = schemas.FriendWithBadges(
-            id=friend.id, name=friend.name, email=friend.email, completed_challenges=badges
+            id=friend.id, name=friend.name, email=friend.email, completed_challenges=badges.get(friend.id, [])
         )
         results_with_badges.append(friend_with_badges)
     return results_with_badges
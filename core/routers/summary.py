@@ -1,64 +1,152 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
 from sqlalchemy.orm import Session
 from sqlalchemy import func
-from datetime import date
-from typing import List
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional
 
 # Dodajemy import utils
 from .. import crud, models, schemas, utils
 from ..db import get_db
 from ..auth import get_current_user
+from ..food_index import food_index
 
 router = APIRouter(
     prefix="/api/summary",
     tags=["Podsumowanie Dnia"]
 )
 
-# W pliku core/routers/summary.py (WERSJA FINALNA)
+# Najdłuższy zakres zestawienia wielodniowego (kwartał)
+SUMMARY_RANGE_MAX_DAYS = 92
+# Dziennik zmienia się przy każdym zapisie - przeglądarka ma zawsze pytać serwer, zamiast użyć kopii z cache
+NO_CACHE = "private, no-cache"
+
+def _ingredient_product_id(db: Session, ingredient_detail: Dict[str, Any]) -> Optional[int]:
+    # Wpisy zapisane przed dodaniem `product_id` rozwiązujemy po nazwie przez indeks w pamięci
+    return ingredient_detail.get("product_id") or food_index.find_product_id(db, ingredient_detail.get("name"))
+
+
+def _attach_ingredient_nutrients(db: Session, meals: List[models.Meal]):
+    """
+    Wzbogaca składniki dań złożonych o aktualne wartości bazowe produktów (`nutrients_per_100g`),
+    potrzebne do edycji wpisu. Wszystkie produkty z całego dnia pobieramy jednym zapytaniem.
+    Składniki, których produktu nie ma w bazie, są pomijane.
+    """
+    resolved = [
+        (entry, [(detail, _ingredient_product_id(db, detail)) for detail in entry.deconstruction_details])
+        for meal in meals for entry in meal.entries if entry.deconstruction_details
+    ]
+    products = crud.get_products_by_ids(db, [pid for _, details in resolved for _, pid in details if pid is not None])
+
+    for entry, details in resolved:
+        enriched_details = []
+        for ingredient_detail, product_id in details:
+            product = products.get(product_id)
+            if product:
+                # Kopiujemy istniejące dane i dodajemy kluczową, brakującą informację
+                new_detail = ingredient_detail.copy()
+                new_detail["product_id"] = product.id
+                new_detail["nutrients_per_100g"] = product.nutrients
+                enriched_details.append(new_detail)
+        entry.deconstruction_details = enriched_details
+
+
+def _effective_calorie_goal(user: models.User, calories_burned: int) -> int:
+    return utils.effective_calorie_goal(user.calorie_goal, user.add_workout_calories_to_goal, calories_burned)
+
+
+# Ścieżka `/range` musi być zadeklarowana przed `/{target_date}`, inaczej zostałaby dopasowana jako data
+@router.get("/range", response_model=schemas.SummaryRange)
+def get_summary_range(
+    response: Response,
+    start: date,
+    end: date,
+    include_entries: bool = Query(False, description="Dołącz pełne listy posiłków, wody i treningów dla każdego dnia."),
+    db: Session = Depends(get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Zestawienie wielu dni jednym zapytaniem: sumy i cele dla każdego dnia okresu (dni bez wpisów mają zera).
+    Sumy pochodzą z tabeli `daily_totals`; listy wpisów (opcjonalnie) są ładowane zbiorczo dla całego okresu.
+    """
+    if end < start:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Data końcowa nie może być wcześniejsza niż początkowa.")
+    if (end - start).days + 1 > SUMMARY_RANGE_MAX_DAYS:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Zakres może obejmować najwyżej {SUMMARY_RANGE_MAX_DAYS} dni.")
+    response.headers["Cache-Control"] = NO_CACHE
+
+    totals = {day.date: day for day in crud.get_daily_totals_by_date_range(db, current_user.id, start, end)}
+    entries_by_day: Dict[date, Dict[str, list]] = {}
+    if include_entries:
+        meals = crud.get_meals_by_date_range(db, current_user.id, start, end)
+        _attach_ingredient_nutrients(db, meals)
+        for key, items in (("meals", meals),
+                           ("water_entries", crud.get_water_entries_by_date_range(db, current_user.id, start, end)),
+                           ("workouts", crud.get_workouts_by_date_range(db, current_user.id, start, end))):
+            for item in items:
+                entries_by_day.setdefault(item.date, {}).setdefault(key, []).append(item)
+
+    days = []
+    for offset in range((end - start).days + 1):
+        day = start + timedelta(days=offset)
+        day_totals = totals.get(day)
+        calories_burned = day_totals.calories_burned if day_totals else 0
+        day_summary = schemas.DaySummary(date=day, calorie_goal=_effective_calorie_goal(current_user, calories_burned))
+        if day_totals:
+            day_summary.calories_consumed = day_totals.calories
+            day_summary.protein_consumed = day_totals.protein
+            day_summary.fat_consumed = day_totals.fat
+            day_summary.carbs_consumed = day_totals.carbs
+            day_summary.water_consumed = day_totals.water_ml
+            day_summary.calories_burned = calories_burned
+        if include_entries:
+            day_entries = entries_by_day.get(day, {})
+            day_summary.meals = [schemas.Meal.model_validate(meal) for meal in day_entries.get("meals", [])]
+            day_summary.water_entries = [schemas.WaterEntry.model_validate(entry) for entry in day_entries.get("water_entries", [])]
+            day_summary.workouts = [schemas.Workout.model_validate(workout) for workout in day_entries.get("workouts", [])]
+        days.append(day_summary)
+
+    return schemas.SummaryRange(
+        start_date=start,
+        end_date=end,
+        protein_goal=current_user.protein_goal or 0,
+        fat_goal=current_user.fat_goal or 0,
+        carb_goal=current_user.carb_goal or 0,
+        water_goal=current_user.water_goal or 0,
+        days=days,
+    )
+
 
 @router.get("/{target_date}", response_model=schemas.DailySummary)
 def get_daily_summary(
     target_date: date,
+    response: Response,
     db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """Pobiera pełne podsumowanie danych z wybranego dnia, wzbogacając dane do edycji."""
+    response.headers["Cache-Control"] = NO_CACHE
     meals = crud.get_meals_by_date(db, user_id=current_user.id, target_date=target_date)
     workouts = crud.get_workouts_by_date(db, user_id=current_user.id, target_date=target_date)
     water_entries = crud.get_water_entries_by_date(db, user_id=current_user.id, target_date=target_date)
 
-    # --- POCZĄTEK NOWEJ LOGIKI: WZBOGACANIE DANYCH ---
-    for meal in meals:
-        for entry in meal.entries:
-            if entry.deconstruction_details:
-                enriched_details = []
-                for ingredient_detail in entry.deconstruction_details:
-                    # Szukamy produktu w naszej bazie, aby pobrać jego wartości bazowe
-                    product = crud.get_product_by_name(db, name=ingredient_detail.get("name"))
-                    if product:
-                        # Kopiujemy istniejące dane i dodajemy kluczową, brakującą informację
-                        new_detail = ingredient_detail.copy()
-                        new_detail["nutrients_per_100g"] = product.nutrients
-                        enriched_details.append(new_detail)
-                entry.deconstruction_details = enriched_details
-    # --- KONIEC NOWEJ LOGIKI ---
-
-    calories_consumed = sum(e.calories for m in meals for e in m.entries)
-    calories_burned = sum(w.calories_burned for w in workouts)
-    water_consumed = sum(w.amount for w in water_entries)
+    _attach_ingredient_nutrients(db, meals)
+
+    # Sumy dnia z tabeli `daily_totals` (brak wiersza = dzień bez wpisów)
+    totals = crud.get_daily_totals(db, user_id=current_user.id, target_date=target_date)
+    calories_consumed = totals.calories if totals else 0.0
+    calories_burned = totals.calories_burned if totals else 0
+    water_consumed = totals.water_ml if totals else 0
     
-    effective_calorie_goal = current_user.calorie_goal or 0
-    if current_user.add_workout_calories_to_goal:
-        effective_calorie_goal += calories_burned
+    effective_calorie_goal = _effective_calorie_goal(current_user, calories_burned)
 
     goal_date = utils.calculate_goal_achievement_date(current_user)
 
     summary = schemas.DailySummary(
         date=target_date,
         calories_consumed=calories_consumed,
-        protein_consumed=sum(e.protein for m in meals for e in m.entries),
-        fat_consumed=sum(e.fat for m in meals for e in m.entries),
-        carbs_consumed=sum(e.carbs for m in meals for e in m.entries),
+        protein_consumed=totals.protein if totals else 0.0,
+        fat_consumed=totals.fat if totals else 0.0,
+        carbs_consumed=totals.carbs if totals else 0.0,
         water_consumed=water_consumed,
         calories_burned=calories_burned,
         total_calories_burned_today=calories_burned,
@@ -3,8 +3,8 @@ from sqlalchemy.orm import Session
 from typing import List
 from datetime import date
 
-from .. import crud, models, schemas, ai_analyzer
-from ..db import get_db
+from .. import crud, models, schemas, ai_analyzer, ai_scheduler
+from ..db import get_db, run_db
 from ..auth import get_current_user
 
 router = APIRouter(
@@ -21,10 +21,13 @@ async def create_workout_entry(
     """
     Analizuje opis treningu, szacuje spalone kalorie i zapisuje go w dzienniku.
     """
-    if not current_user.weight:
+    ai_scheduler.bind_user(current_user.id)
+    # `weight` leniwie ładuje historię wagi - zapytanie wykonujemy w puli wątków bazy danych
+    user_weight = await run_db(lambda: current_user.weight)
+    if not user_weight:
         raise HTTPException(status_code=400, detail="Uzupełnij swoją wagę w profilu, aby oszacować spalone kalorie.")
 
-    analysis = await ai_analyzer.analyze_workout(request.name, current_user.weight)
+    analysis = await ai_analyzer.analyze_workout(request.name, user_weight)
     
     # Używamy nazwy zwróconej przez AI, aby odrzucić nielogiczne treningi
     workout_data = schemas.WorkoutCreate(
@@ -37,7 +40,7 @@ async def create_workout_entry(
     if workout_data.calories_burned == 0 and workout_data.name == "Nierozpoznana aktywność":
         raise HTTPException(status_code=400, detail="Podana aktywność nie jest rozpoznawana jako trening.")
 
-    return crud.create_workout(db=db, workout=workout_data, user_id=current_user.id)
+    return await run_db(crud.create_workout, db=db, workout=workout_data, user_id=current_user.id)
 
 
 @router.get("", response_model=List[schemas.Workout], summary="Pobierz treningi z danego dnia")
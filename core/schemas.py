@@ -20,6 +20,7 @@ class ProductBase(BaseModel):
     aliases: Optional[List[str]] = []
     nutrients: Dict[str, float] # Przechowuje kalorie, białko, tłuszcz, węglowodany na 100g
     state: ProductState
+    average_weight_g: Optional[float] = None
 
 class ProductCreate(ProductBase):
     pass
@@ -80,6 +81,7 @@ class ConversationInfo(BaseModel):
 
 class Conversation(ConversationInfo):
     messages: List[ChatMessage] = []
+    has_more_messages: bool = False # Czy istnieją starsze wiadomości (do pobrania z parametrem before_id)
 
 # --- ZAKTUALIZOWANE SCHEMATY UŻYTKOWNIKA ---
 
@@ -223,6 +225,21 @@ class AnalysisResponse(BaseModel):
     aggregated_meal: Dict[str, Any]
     deconstruction_details: List[Dict[str, Any]]
 
+class MealBatchAnalysisRequest(BaseModel):
+    text: str = Field(..., min_length=1)
+    meal_category: MealCategory
+    include_breakdown: bool = True # False pomija wczytywanie składników dań z bazy
+
+class AnalyzedMealItem(BaseModel):
+    query: str
+    aggregated_meal: Optional[Dict[str, Any]] = None
+    deconstruction_details: List[Dict[str, Any]] = []
+    error: Optional[str] = None
+
+class MealBatchAnalysisResponse(BaseModel):
+    items: List[AnalyzedMealItem]
+    totals: Dict[str, float]
+
 # --- POZOSTAŁE SCHEMATY (zachowane z poprzedniej wersji) ---
 
 class UserPublic(BaseModel):
@@ -332,6 +349,29 @@ class DailySummary(BaseModel):
     workouts: List[Workout]
     total_calories_burned_today: float
 
+class DaySummary(BaseModel):
+    """Sumy jednego dnia w zestawieniu wielodniowym; listy wpisów tylko przy `include_entries=true`."""
+    date: date
+    calories_consumed: float = 0.0
+    protein_consumed: float = 0.0
+    fat_consumed: float = 0.0
+    carbs_consumed: float = 0.0
+    water_consumed: int = 0
+    calories_burned: int = 0
+    calorie_goal: int
+    meals: Optional[List[Meal]] = None
+    water_entries: Optional[List[WaterEntry]] = None
+    workouts: Optional[List[Workout]] = None
+
+class SummaryRange(BaseModel):
+    start_date: date
+    end_date: date
+    protein_goal: int
+    fat_goal: int
+    carb_goal: int
+    water_goal: int
+    days: List[DaySummary]
+
 class AnalysisRequest(BaseModel):
     text: Optional[str] = None
     image_base64: Optional[str] = None
@@ -0,0 +1,90 @@
+"""
+Moduł odpowiedzialny za indeks wyszukiwania użytkowników po adresie email.
+
+Ten plik zawiera:
+1.  Definicję indeksu pełnotekstowego SQLite FTS5 z tokenizerem `trigram` (`users_email_fts`) nad kolumną
+    `users.email`. Tabela jest typu "external content" - przechowuje tylko indeks, a treść czyta z `users`.
+2.  Wyzwalacze utrzymujące indeks w synchronizacji przy dodawaniu, zmianie emaila i usuwaniu użytkownika,
+    dzięki czemu działa on także dla zapisów wykonanych poza `crud`.
+3.  `ensure_email_search_index` - tworzy indeks przy starcie aplikacji (jeśli go brakuje) i zapamiętuje,
+    czy wyszukiwanie przez FTS jest dostępne. Przy innej bazie niż SQLite lub braku FTS5/trigram
+    `crud.search_users_by_email` wraca do zwykłego `ILIKE`.
+
+Trigramy dopasowują dowolny fragment adresu (prefiks i podciąg) bez rozróżniania wielkości liter,
+ale wymagają co najmniej 3 znaków - stąd minimalna długość frazy w endpointcie wyszukiwania.
+"""
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.exc import OperationalError
+
+EMAIL_FTS_TABLE = "users_email_fts"
+# Trigram wymaga co najmniej 3 znaków; ten sam limit egzekwuje `routers/social.py`
+EMAIL_FTS_MIN_QUERY_LENGTH = 3
+
+EMAIL_FTS_DDL: List[str] = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {EMAIL_FTS_TABLE}
+        USING fts5(email, content='users', content_rowid='id', tokenize='trigram')""",
+    f"""CREATE TRIGGER IF NOT EXISTS {EMAIL_FTS_TABLE}_ai AFTER INSERT ON users BEGIN
+        INSERT INTO {EMAIL_FTS_TABLE}(rowid, email) VALUES (new.id, new.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {EMAIL_FTS_TABLE}_ad AFTER DELETE ON users BEGIN
+        INSERT INTO {EMAIL_FTS_TABLE}({EMAIL_FTS_TABLE}, rowid, email) VALUES ('delete', old.id, old.email);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {EMAIL_FTS_TABLE}_au AFTER UPDATE OF email ON users BEGIN
+        INSERT INTO {EMAIL_FTS_TABLE}({EMAIL_FTS_TABLE}, rowid, email) VALUES ('delete', old.id, old.email);
+        INSERT INTO {EMAIL_FTS_TABLE}(rowid, email) VALUES (new.id, new.email);
+    END""",
+]
+EMAIL_FTS_REBUILD = f"INSERT INTO {EMAIL_FTS_TABLE}({EMAIL_FTS_TABLE}) VALUES ('rebuild')"
+EMAIL_FTS_DROP: List[str] = [
+    f"DROP TRIGGER IF EXISTS {EMAIL_FTS_TABLE}_ai",
+    f"DROP TRIGGER IF EXISTS {EMAIL_FTS_TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {EMAIL_FTS_TABLE}_au",
+    f"DROP TABLE IF EXISTS {EMAIL_FTS_TABLE}",
+]
+
+# Ustawiane przez `ensure_email_search_index` przy starcie aplikacji
+email_fts_available = False
+
+
+def is_email_search_table(name: str) -> bool:
+    """Tabela indeksu lub jedna z jej tabel pomocniczych (`_data`, `_idx`, ...) - pomijane przez autogenerate Alembica."""
+    return name == EMAIL_FTS_TABLE or name.startswith(f"{EMAIL_FTS_TABLE}_")
+
+
+def create_email_search_index(connection: Connection):
+    """Tworzy indeks i wyzwalacze; nowo utworzony indeks wypełnia danymi z `users`."""
+    exists = connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": EMAIL_FTS_TABLE}
+    ).first()
+    for statement in EMAIL_FTS_DDL:
+        connection.execute(text(statement))
+    if not exists:
+        connection.execute(text(EMAIL_FTS_REBUILD))
+
+
+def ensure_email_search_index(engine: Engine) -> bool:
+    global email_fts_available
+    if engine.dialect.name != "sqlite":
+        email_fts_available = False
+        return False
+    try:
+        with engine.begin() as connection:
+            create_email_search_index(connection)
+        email_fts_available = True
+    except OperationalError as e:
+        # Starsze SQLite (< 3.34) nie mają tokenizera trigram
+        print(f"BŁĄD: Indeks wyszukiwania emaili niedostępny, używam ILIKE. {e}")
+        email_fts_available = False
+    return email_fts_available
+
+
+def email_match_query(email_query: str) -> str:
+    """Fraza FTS5 dopasowująca dosłowny fragment adresu (cudzysłowy neutralizują składnię zapytań FTS)."""
+    return '"' + email_query.replace('"', '""') + '"'
+
+
+def can_use_email_index() -> bool:
+    return email_fts_available
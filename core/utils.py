@@ -2,6 +2,13 @@ from datetime import date, timedelta
 from typing import Optional
 from . import models
 
+def effective_calorie_goal(calorie_goal: Optional[int], add_workout_calories_to_goal: bool, calories_burned: int) -> int:
+    """Cel kaloryczny dnia widoczny na pulpicie: cel użytkownika, opcjonalnie powiększony o kalorie spalone na treningach."""
+    goal = calorie_goal or 0
+    if add_workout_calories_to_goal:
+        goal += calories_burned
+    return goal
+
 def calculate_goal_achievement_date(user: models.User) -> Optional[str]:
     """Oblicza szacowaną datę osiągnięcia celu wagowego."""
     # Sprawdza, czy wszystkie niezbędne dane są dostępne
@@ -0,0 +1,55 @@
+"""
+Moduł odpowiedzialny za analizę okresu (zwykle tygodnia) dla AI Trenera.
+
+Ten plik zawiera:
+1.  Ładowanie danych okresu: posiłki (wersja "lean" - bez składników), treningi, historia wagi i sumy dzienne.
+2.  Statystyki do wykresów liczone z tabeli `daily_totals`.
+3.  `create_weekly_analysis` - podsumowanie AI wraz ze statystykami; używane przez endpoint `/api/analysis/generate`
+    oraz zadanie cykliczne w `jobs`.
+"""
+from datetime import date
+from typing import Any, Dict
+
+from sqlalchemy.orm import Session
+
+from . import ai_analyzer, crud, models, schemas
+from .db import run_db
+
+
+async def create_weekly_analysis(db: Session, user: models.User, start_date: date, end_date: date,
+                                 call_site: str = "weekly_analysis") -> schemas.WeeklyAnalysisResponse:
+    """Buduje analizę okresu: podsumowanie AI Trenera oraz statystyki do wykresów."""
+    user_data = await run_db(load_weekly_data, db, user.id, start_date, end_date)
+    ai_coach_summary = await ai_analyzer.generate_weekly_analysis(
+        user_data, user=user, start_date=start_date, end_date=end_date, call_site=call_site
+    )
+    stats = await run_db(weekly_stats, user_data)
+    return schemas.WeeklyAnalysisResponse(
+        ai_coach_summary=ai_coach_summary, analysis_start_date=start_date, analysis_end_date=end_date, **stats
+    )
+
+
+def load_weekly_data(db: Session, user_id: int, start_date: date, end_date: date):
+    """Pobiera dane do analizy tygodniowej (funkcja blokująca, wywoływana przez `run_db`)."""
+    return {
+        # Do promptu potrzebne są tylko nazwy i kalorie wpisów
+        "meals": crud.get_meals_by_date_range(db, user_id, start_date, end_date, lean=True),
+        "workouts": crud.get_workouts_by_date_range(db, user_id, start_date, end_date),
+        "weight_history": crud.get_weight_history_by_date_range(db, user_id, start_date, end_date),
+        "daily_totals": crud.get_daily_totals_by_date_range(db, user_id, start_date, end_date),
+    }
+
+
+def weekly_stats(user_data: Dict[str, Any]) -> Dict[str, Any]:
+    """Średnie dzienne makroskładniki (z dni z wpisami), podsumowanie treningów i dane wykresu wagi - z tabeli `daily_totals`."""
+    daily = user_data["daily_totals"]
+    meal_days = [day for day in daily if day.meal_entries]
+    days = len(meal_days) or 1
+    avg_macros = {key: round(sum(getattr(day, key) for day in meal_days) / days, 1) for key in ("calories", "protein", "fat", "carbs")}
+    weights = sorted(user_data["weight_history"], key=lambda entry: entry.date)
+    return {
+        "avg_macros": avg_macros,
+        "total_workouts": sum(day.workouts for day in daily),
+        "total_calories_burned": sum(day.calories_burned for day in daily),
+        "weight_chart_data": {"labels": [entry.date.isoformat() for entry in weights], "values": [entry.weight for entry in weights]},
+    }
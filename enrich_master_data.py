@@ -1,13 +1,11 @@
 import os
 import json
-import time
 import re
 from dotenv import load_dotenv
-import google.generativeai as genai
 
 # --- Konfiguracja ---
 load_dotenv()
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+from core.ai_client import AIError, AIUnavailableError, get_ai_client
 
 INPUT_FILE = "master_dane.json"
 OUTPUT_FILE = "master_dane_wzbogacone.json"
@@ -29,11 +27,11 @@ def clean_json_response(text: str) -> str:
     return text
 
 def enrich_master_file():
-    if not GEMINI_API_KEY:
-        print("BŁĄD: Brak klucza GEMINI_API_KEY w pliku .env"); return
-
-    genai.configure(api_key=GEMINI_API_KEY)
-    model = genai.GenerativeModel('gemini-1.5-flash-latest')
+    # Wspólny klient AI: limity czasu, ponawianie z opóźnieniem przy 429/5xx i wyłącznik obwodu
+    try:
+        ai_client = get_ai_client()
+    except ValueError as e:
+        print(f"BŁĄD: {e}"); return
 
     try:
         with open(INPUT_FILE, 'r', encoding='utf-8') as f:
@@ -68,8 +66,8 @@ def enrich_master_file():
         
         try:
             prompt = enrichment_prompt_template.format(product_name=product_name)
-            response = model.generate_content(prompt)
-            enrichment_data = json.loads(clean_json_response(response.text))
+            response_text = ai_client.generate_sync([prompt], call_site="enrich_product")
+            enrichment_data = json.loads(clean_json_response(response_text))
             
             item['state'] = enrichment_data.get('state', 'solid')
             if "deconstruction" not in item:
@@ -77,15 +75,16 @@ def enrich_master_file():
             
             enriched_data.append(item)
 
+        except AIUnavailableError:
+            # Seria błędów API (np. limit zapytań) - zapisujemy postęp, kolejne uruchomienie wznowi pracę
+            print("  Usługa AI jest chwilowo niedostępna. Zapisuję postęp i kończę.")
+            break
+        except AIError as e:
+            # Wpis nie trafia do pliku, więc zostanie przetworzony przy wznowieniu
+            print(f"  BŁĄD API przy przetwarzaniu '{product_name}'. Pomijam do następnego uruchomienia. Szczegóły: {e}")
         except Exception as e:
-            # NOWA LOGIKA: Obsługa błędu limitu API
-            if "429" in str(e): # Proste sprawdzenie, czy błąd to "Too Many Requests"
-                print("  Osiągnięto limit zapytań API. Czekam 60 sekund...")
-                time.sleep(60)
-                # Spróbuj ponownie przetworzyć ten sam element (opcjonalne, można dodać)
-            else:
-                print(f"  BŁĄD przy przetwarzaniu '{product_name}'. Dodaję wpis bez wzbogacenia. Szczegóły: {e}")
-                enriched_data.append(item)
+            print(f"  BŁĄD przy przetwarzaniu '{product_name}'. Dodaję wpis bez wzbogacenia. Szczegóły: {e}")
+            enriched_data.append(item)
         
         # Zapisuj postęp co 10 pozycji, aby był bezpieczny
         if (i + 1) % 10 == 0:
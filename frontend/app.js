@@ -95,7 +95,8 @@ document.addEventListener('DOMContentLoaded', () => {
     const api = {
         baseUrl: '/api',
         async request(endpoint, options = {}) {
-            const headers = { 'Content-Type': 'application/json', ...options.headers };
+            // Dla FormData przeglądarka sama ustawia Content-Type (z granicą multipart)
+            const headers = options.body instanceof FormData ? { ...options.headers } : { 'Content-Type': 'application/json', ...options.headers };
             if (state.token) headers['Authorization'] = `Bearer ${state.token}`;
 
             setLoading(true);
@@ -145,13 +146,19 @@ document.addEventListener('DOMContentLoaded', () => {
 
         // --- Analiza ---
         analyze: (data) => api.request('/analysis/meal', { method: 'POST', body: JSON.stringify(data) }),
+        analyzePhoto: (imageBlob, category) => {
+            const formData = new FormData();
+            formData.append('image', imageBlob, 'meal.jpg');
+            formData.append('meal_category', category);
+            return api.request('/analysis/meal', { method: 'POST', body: formData });
+        },
         getDietPlan: () => api.request('/analysis/suggest-diet-plan'),
         suggestGoals: (data) => api.request('/users/suggest-goals', { method: 'POST', body: JSON.stringify(data) }),
         getLatestAnalysis: () => api.request('/analysis/latest'),
         generateWeeklyAnalysis: (startDate, endDate) => api.request('/analysis/generate', { method: 'POST', body: JSON.stringify({ start_date: startDate, end_date: endDate }) }),
         
         // --- Dziennik ---
-        getSummaryByDate: (date) => api.request(`/summary/${date}?cb=${new Date().getTime()}`), // Dodano cache-busting
+        getSummaryByDate: (date) => api.request(`/summary/${date}`),
         createMeal: (mealData) => api.request('/meals', { method: 'POST', body: JSON.stringify(mealData) }),
         addMealEntry: (mealId, entryData) => api.request(`/meals/${mealId}/entries`, { method: 'POST', body: JSON.stringify(entryData) }),
         updateMealEntry: (entryId, entryData) => api.request(`/meals/entries/${entryId}`, { method: 'PUT', body: JSON.stringify(entryData) }),
@@ -166,6 +173,39 @@ document.addEventListener('DOMContentLoaded', () => {
         createConversation: () => api.request('/chat/conversations', { method: 'POST' }),
         getConversationMessages: (convoId) => api.request(`/chat/conversations/${convoId}`),
         sendMessageToConversation: (convoId, message) => api.request(`/chat/conversations/${convoId}/messages`, { method: 'POST', body: JSON.stringify({ message }) }),
+        // Odpowiedź AI jako server-sent events: onDelta(tekst) dla każdego fragmentu, na końcu zapisana wiadomość
+        async streamMessageToConversation(convoId, message, onDelta) {
+            const headers = { 'Content-Type': 'application/json' };
+            if (state.token) headers['Authorization'] = `Bearer ${state.token}`;
+            const response = await fetch(`${this.baseUrl}/chat/conversations/${convoId}/messages/stream`, { method: 'POST', headers, body: JSON.stringify({ message }) });
+            if (!response.ok || !response.body) {
+                if (response.status === 401 && state.token) handle.logout();
+                throw new Error(`Błąd serwera: ${response.status} ${response.statusText}`);
+            }
+
+            const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+            let buffer = '';
+            while (true) {
+                const { value, done } = await reader.read();
+                if (done) break;
+                buffer += value;
+                let boundary;
+                while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                    const rawEvent = buffer.slice(0, boundary);
+                    buffer = buffer.slice(boundary + 2);
+                    let eventName = 'message', data = '';
+                    for (const line of rawEvent.split('\n')) {
+                        if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                        else if (line.startsWith('data:')) data += line.slice(5).trim();
+                    }
+                    const payload = data ? JSON.parse(data) : {};
+                    if (eventName === 'delta') onDelta(payload.text);
+                    else if (eventName === 'done') return payload;
+                    else if (eventName === 'error') throw new Error(payload.detail);
+                }
+            }
+            throw new Error('Połączenie zostało przerwane.');
+        },
         pinConversation: (convoId) => api.request(`/chat/conversations/${convoId}/pin`, { method: 'POST' }),
         deleteConversation: (convoId) => api.request(`/chat/conversations/${convoId}`, { method: 'DELETE' }),
 
@@ -570,14 +610,6 @@ document.addEventListener('DOMContentLoaded', () => {
         return `${year}-${month}-${day}`;
     };
 
-    // Funkcja do konwersji pliku na base64
-    const toBase64 = file => new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.readAsDataURL(file);
-        reader.onload = () => resolve(reader.result);
-        reader.onerror = error => reject(error);
-    });
-
     // NOWA FUNKCJA: Kompresja obrazu przed wysłaniem
     const compressImage = (file) => {
         return new Promise((resolve, reject) => {
@@ -1305,16 +1337,14 @@ document.addEventListener('DOMContentLoaded', () => {
                     }
 
                     try {
-                        // Kompresuj obraz
+                        // Kompresuj obraz i wyślij go jako plik (multipart), bez narzutu base64
                         const compressedBlob = await compressImage(file);
-                        // Konwertuj skompresowany Blob na base64
-                        payload.image_base64 = await toBase64(compressedBlob);
 
                         $('#manual-text-input').value = "Analizuję zdjęcie...";
                         $('#manual-text-input').disabled = true;
                         $('#manual-analyze-btn').classList.add('hidden');
 
-                        const result = await api.analyze(payload);
+                        const result = await api.analyzePhoto(compressedBlob, category);
                         render.analysisResults(result, category);
                     } catch(err) {
                         $('#analysis-error-container').textContent = `Błąd analizy zdjęcia: ${err.message}`;
@@ -1795,12 +1825,21 @@ document.addEventListener('DOMContentLoaded', () => {
             messagesContainer.innerHTML += `<div class="chat-message ai"><div class="message-bubble is-typing"><span></span><span></span><span></span></div></div>`;
             messagesContainer.scrollTop = messagesContainer.scrollHeight;
             
+            // Dymek "pisze..." wypełniany na bieżąco kolejnymi fragmentami odpowiedzi
+            const bubble = $('.chat-message.ai .is-typing');
             try {
-                const response = await api.sendMessageToConversation(state.chat.activeConversationId, messageText);
-                $('.chat-message.ai .is-typing').parentElement.remove();
+                let streamedText = '';
+                const response = await api.streamMessageToConversation(state.chat.activeConversationId, messageText, (delta) => {
+                    streamedText += delta;
+                    bubble.classList.remove('is-typing');
+                    bubble.innerHTML = streamedText.replace(/\n/g, '<br>');
+                    messagesContainer.scrollTop = messagesContainer.scrollHeight;
+                });
+                bubble.parentElement.remove();
                 messagesContainer.innerHTML += templates.chatMessage(response);
             } catch (error) {
-                $('.chat-message.ai .is-typing')?.parentElement.remove();
+                // Usuwa także częściowo wypełniony dymek (błąd lub zerwane połączenie w trakcie strumienia)
+                bubble.parentElement?.remove();
                 messagesContainer.innerHTML += templates.chatMessage({ role: 'ai', content: 'Przepraszam, wystąpił błąd.' });
             } finally {
                 input.disabled = false;
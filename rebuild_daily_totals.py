@@ -0,0 +1,34 @@
+"""
+Odbudowuje tabelę `daily_totals` (sumy dnia użytkownika) z surowych wpisów posiłków, wody i treningów.
+
+Użycie:
+    python rebuild_daily_totals.py            # wszyscy użytkownicy
+    python rebuild_daily_totals.py 12 57      # tylko wybrani użytkownicy (id)
+"""
+import sys
+import time
+
+from core import crud, models
+from core.db import SessionLocal, engine
+
+
+def rebuild_daily_totals(user_ids=None):
+    print("--- Rozpoczynam odbudowę tabeli daily_totals ---")
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        rows = crud.rebuild_daily_totals(db, user_ids=user_ids)
+        scope = f"użytkowników {', '.join(map(str, user_ids))}" if user_ids else "wszystkich użytkowników"
+        print(f"Zapisano {rows} dni dla {scope} w {time.perf_counter() - started:.1f} s.")
+    except Exception as e:
+        db.rollback()
+        print(f"BŁĄD: Odbudowa daily_totals nie powiodła się. {e}")
+        raise
+    finally:
+        db.close()
+    print("--- Odbudowa zakończona ---")
+
+
+if __name__ == "__main__":
+    rebuild_daily_totals([int(arg) for arg in sys.argv[1:]] or None)